@@ -5,14 +5,24 @@ XMLEdit GUI-onafhankelijke code
 """
 
 import os
+import array
+import codecs
+import hashlib
+import itertools
+import json
+import mmap
 import pathlib
 
-# import sys
+import sys
 import shutil
+import tempfile
 
 # import copy
 import xml.etree.ElementTree as et  # noqa N813
+from xml.parsers import expat
 import logging
+from .shared import (Namespaces, compressed_stream, get_compression,
+                     megabytes_from_env)
 
 ELSTART = "<>"
 TITEL = "Albert's (Simple) XML editor"
@@ -21,6 +31,13 @@ axe_iconame = str(APATH / "axe.ico")
 # always log in program directory
 LOGFILE = APATH.parent / "logs" / "axe_qt.log"
 LOGPLEASE = "DEBUG" in os.environ and os.environ["DEBUG"] != "0"
+MAP_SIZE = 50 * 1024 * 1024  # larger files are viewed straight from the file
+# where the layout of mapped files is kept, so it's only determined once, and
+# how much room that may take (in MB) before the least recently used go
+CACHE_DIR = pathlib.Path(os.environ.get("XDG_CACHE_HOME")
+                         or pathlib.Path.home() / ".cache") / "axe"
+CACHE_SIZE = megabytes_from_env("AXE_CACHE_MB", 256)
+INDEX_VERSION = 2
 if LOGPLEASE:
     if not LOGFILE.parent.exists():
         LOGFILE.parent.mkdir()
@@ -40,8 +57,11 @@ def log(message):
 
 
 def getshortname(x, attr=False):
-    """build and return a name for this node"""
-    x, ns_prefixes, ns_uris = x
+    """build and return a name for this node
+
+    `x` is ((name, value), namespaces), the latter a shared.Namespaces
+    """
+    x, namespaces = x
     t = ""
     if attr:
         t = x[1]
@@ -52,14 +72,7 @@ def getshortname(x, attr=False):
     w = 60
     if len(t) > w:
         t = t[:w].lstrip() + "..."
-    fullname = x[0]
-    if fullname.startswith("{"):
-        uri, localname = fullname[1:].split("}")
-        for i, x in enumerate(ns_uris):
-            if x == uri:
-                prefix = ns_prefixes[i]
-                break
-        fullname = ":".join((prefix, localname))
+    fullname = namespaces.shortname(x[0])
     strt = " ".join((ELSTART, fullname))
     if attr:
         return " = ".join((fullname, t))
@@ -72,38 +85,34 @@ def getshortname(x, attr=False):
 def find_next(data, search_args, reverse=False, pos=None):
     """searches the flattened tree from start or the given pos
     to find the next item that fulfills the search criteria
+
+    `data` can be any iterable (like the generators returned by the viewers'
+    flatten_tree) and should already be in the order of searching; it is
+    consumed only as far as needed
     """
     wanted_ele, wanted_attr, wanted_value, wanted_text = search_args
-    if reverse:
-        data.reverse()
+    data = iter(data)
 
     if pos:
         pos, is_attr = pos
-        # found_item = False
-        for ix, item in enumerate(data):
+        for item in data:
             if is_attr:
-                found_attr = False
-                for ix2, attr in enumerate(item[3]):
-                    if attr[0] == pos:
-                        found_attr = True
-                        break
-                if found_attr:
-                    break
-            else:
-                if item[0] == pos:
+                nodes = [x[0] for x in item[3]]
+                if pos in nodes:
+                    ix = nodes.index(pos)
+                    id, name, text, attrs = item
+                    attrs = attrs[:ix] if reverse else attrs[ix + 1:]
+                    # search the rest of this element's attributes first
+                    data = itertools.chain([(id, name, text, attrs)], data)
                     break
-        if is_attr:
-            data = data[ix:]
-            id, name, text, attrs = data[0]
-            data[0] = id, name, text, attrs[ix2 + 1:]
-        elif ix < len(data) - 1:
-            data = data[ix + 1:]
+            elif item[0] == pos:
+                break
         else:
             return None, False  # no more data to search
 
-    ele_ok = attr_name_ok = attr_value_ok = attr_ok = text_ok = False
-    itemfound = False
+    itemfound = None
     for item, element_name, element_text, attr_list in data:
+        ele_ok = attr_name_ok = attr_value_ok = attr_ok = text_ok = False
         if not wanted_ele or wanted_ele in element_name:
             ele_ok = True
         if not wanted_text or wanted_text in element_text:
@@ -112,7 +121,7 @@ def find_next(data, search_args, reverse=False, pos=None):
         attr_item = None
         if wanted_attr or wanted_value:
             if reverse:
-                attr_list.reverse()
+                attr_list = reversed(attr_list)
             for attr, name, value in attr_list:
                 if not wanted_attr or wanted_attr in name:
                     attr_name_ok = True
@@ -128,12 +137,13 @@ def find_next(data, search_args, reverse=False, pos=None):
 
         ok = ele_ok and text_ok and attr_ok
         if ok:
-            if attr_item:
+            # explicit tests needed, an element without children is falsey
+            if attr_item is not None:
                 itemfound, is_attr = attr_item, True
             else:
                 itemfound, is_attr = item, False
             break
-    if itemfound:
+    if itemfound is not None:
         return itemfound, is_attr
     else:
         return None, False
@@ -156,6 +166,413 @@ def parse_nsmap(file):
     return et.ElementTree(root), ns_prefixes, ns_uris
 
 
+def read_xml(fname):
+    """read a file to view: parse it, or map it into memory when it's large
+
+    returns the same as parse_nsmap. A compressed file can't be mapped, it's
+    unpacked while it's parsed
+    """
+    compression = get_compression(fname)
+    if compression is not None:
+        with open(fname, "rb") as raw:
+            return parse_nsmap(compressed_stream(compression, raw))
+    if os.path.getsize(fname) > MAP_SIZE:
+        with open(fname, "rb") as f:
+            start = f.read(2)
+        # the parts of a file are put together, that only works for UTF-8 etc.
+        if start not in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+            tree = MappedTree(fname)
+            return tree, tree.prefixes, tree.uris
+    return parse_nsmap(fname)
+
+
+class MappedTree:
+    """read-only document that's read straight from the file, which is mapped
+    into memory
+
+    one scan over the file records where every element starts and ends, which
+    element it's under and how many elements are below it, in compact arrays:
+    4 bytes per number unless the file is too large for that.
+    An element's name, attributes and text are only parsed from the file when
+    it's shown (see MappedElement), so the memory used grows with what's
+    looked at instead of with the size of the file.
+    The file stays mapped until the tree is closed
+    """
+
+    def __init__(self, fname):
+        with open(fname, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        self.typecodes = get_typecodes(stat.st_size)
+        self.starts = array.array(self.typecodes[0])
+        self.ends = array.array(self.typecodes[0])
+        # number of elements below an element
+        self.sizes = array.array(self.typecodes[1])
+        self.parents = array.array(self.typecodes[1])
+        self.prefixes = []
+        self.uris = []
+        self.prolog = b""  # what comes before the root: declarations, DOCTYPE
+        self.elements = {}  # the elements that have been asked for
+        # element: the namespaces known below it and a start tag declaring them
+        self.contexts = {}
+        self.cachefile = CACHE_DIR / "{}.idx".format(
+            hashlib.sha1(os.path.abspath(fname).encode()).hexdigest())
+        self.signature = self.get_signature(stat)
+        if not self.load_index():
+            self.scan()
+            self.save_index()
+
+    def get_signature(self, stat):
+        """return what tells if the file is still the one that's been indexed
+
+        size, time of change and a checksum of the beginning and the end
+        """
+        checksum = hashlib.sha1(self.map[:65536])
+        checksum.update(self.map[-65536:])
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                "checksum": checksum.hexdigest()}
+
+    def arrays(self):
+        "the arrays that make up the index"
+        return self.starts, self.ends, self.sizes, self.parents
+
+    def load_index(self):
+        "read the index from the cache, if it's there and still right"
+        try:
+            with self.cachefile.open("rb") as f:
+                header = json.loads(f.readline())
+                if (header.get("version") != INDEX_VERSION
+                        or header.get("byteorder") != sys.byteorder
+                        or header.get("typecodes") != list(self.typecodes)
+                        or header.get("signature") != self.signature):
+                    return False
+                self.prolog = f.read(header["prolog"])
+                for data in self.arrays():
+                    data.fromfile(f, header["count"])
+            os.utime(self.cachefile)  # recently used
+        except (OSError, ValueError, EOFError, KeyError):
+            for data in self.arrays():
+                del data[:]
+            return False
+        self.prefixes, self.uris = header["prefixes"], header["uris"]
+        return True
+
+    def save_index(self):
+        """write the index to the cache, making room for it if needed
+
+        a cache that can't be written is no reason not to show the file
+        """
+        header = {"version": INDEX_VERSION, "byteorder": sys.byteorder,
+                  "typecodes": list(self.typecodes),
+                  "signature": self.signature, "count": len(self.starts),
+                  "prolog": len(self.prolog), "prefixes": self.prefixes,
+                  "uris": self.uris}
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            fd, tempname = tempfile.mkstemp(suffix=".tmp", dir=str(CACHE_DIR))
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                f.write(self.prolog)
+                for data in self.arrays():
+                    data.tofile(f)
+            os.replace(tempname, str(self.cachefile))
+        except OSError:
+            os.remove(tempname)
+            return
+        prune_cache()
+
+    def scan(self):
+        "find out where the elements are"
+        self.parser = expat.ParserCreate(namespace_separator="}")
+        self.stack = []
+        self.ended = None
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.StartNamespaceDeclHandler = self.start_ns
+        # whatever comes next ends the element before it
+        self.parser.CharacterDataHandler = self.other
+        self.parser.CommentHandler = self.other
+        self.parser.ProcessingInstructionHandler = self.other
+        self.parser.DefaultHandlerExpand = self.other
+        self.map.seek(0)
+        try:
+            self.parser.ParseFile(self.map)
+        except expat.ExpatError as err:
+            raise et.ParseError(str(err)) from None
+        if self.ended is not None:
+            self.ends[self.ended] = len(self.map)
+        self.parser = self.stack = None
+
+    def start_ns(self, prefix, uri):
+        "remember a namespace"
+        self.prefixes.append(prefix or "")
+        self.uris.append(uri or "")
+
+    def start(self, tag, attrs):
+        "remember where an element starts"
+        self.other()
+        pos = self.parser.CurrentByteIndex
+        if not self.starts:
+            self.prolog = self.map[:pos]
+        self.stack.append(len(self.starts))
+        self.parents.append(self.stack[-2] if len(self.stack) > 1 else -1)
+        self.starts.append(pos)
+        self.ends.append(pos)
+        self.sizes.append(0)
+
+    def end(self, tag):
+        "where an element ends is known with whatever comes next"
+        self.other()
+        ix = self.stack.pop()
+        self.sizes[ix] = len(self.starts) - ix - 1
+        self.ended = ix
+
+    def other(self, *args):
+        "something begins here, so the element that just ended ends here"
+        if self.ended is not None:
+            self.ends[self.ended] = self.parser.CurrentByteIndex
+            self.ended = None
+
+    def close(self):
+        "let go of the file; elements that haven't been read can't be anymore"
+        self.elements = {}
+        self.contexts = {}
+        self.map.close()
+
+    def getroot(self):
+        "return the root element"
+        return self.element(0)
+
+    def element(self, ix):
+        "return the element with the given number, the same one every time"
+        try:
+            return self.elements[ix]
+        except KeyError:
+            el = self.elements[ix] = MappedElement(self, ix)
+            return el
+
+    def children(self, ix):
+        "return the numbers of the elements directly below an element"
+        result = []
+        child, last = ix + 1, ix + self.sizes[ix]
+        while child <= last:
+            result.append(child)
+            child += self.sizes[child] + 1
+        return result
+
+    def start_tag(self, ix):
+        "return the file from where an element starts to its first child"
+        end = self.starts[ix + 1] if self.sizes[ix] else self.ends[ix]
+        return self.map[self.starts[ix]:end]
+
+    def context(self, ix):
+        """return a start tag that declares the namespaces known below an
+        element (nothing for the root's parent)
+
+        an element's namespaces are those of its parent with what its own start
+        tag adds, so only that one is parsed for an element whose parent has
+        been done before
+        """
+        chain = []
+        while ix >= 0 and ix not in self.contexts:
+            chain.append(ix)
+            ix = self.parents[ix]
+        known, wrapper = self.contexts[ix] if ix >= 0 else ({}, b"")
+        for ix in reversed(chain):
+            parser = expat.ParserCreate(namespace_separator="}")
+            started, declared = [], {}
+            depth = 1 if wrapper else 0
+
+            def start_ns(prefix, uri):
+                "a namespace declared on the element itself"
+                if len(started) == depth:
+                    declared[prefix or ""] = uri or ""
+
+            parser.StartNamespaceDeclHandler = start_ns
+            parser.StartElementHandler = lambda tag, attrs: started.append(tag)
+            try:
+                parser.Parse(self.prolog + wrapper + self.start_tag(ix), False)
+            except expat.ExpatError as err:
+                raise et.ParseError(str(err)) from None
+            if declared or not wrapper:
+                known = dict(known, **declared)
+                wrapper = b"<_" + b"".join(
+                    b' xmlns%s="%s"' % (b":" + prefix.encode() if prefix
+                                        else b"", escape_uri(uri))
+                    # a prefix can't be undeclared in XML 1.0
+                    for prefix, uri in known.items() if uri or not prefix
+                ) + b">"
+            # without declarations of its own it shares its parent's
+            self.contexts[ix] = known, wrapper
+        return wrapper
+
+    def read(self, ix):
+        """parse the name, attributes and text of an element
+
+        it's parsed after a start tag that declares the namespaces known there
+        (see context); the elements below it are skipped
+        """
+        wrapper = self.context(self.parents[ix])
+        depth = 1 if wrapper else 0
+        result = []
+        texts = []
+        parser = expat.ParserCreate(namespace_separator="}")
+        parser.ordered_attributes = True
+
+        def start(tag, attrs):
+            "the last start tag is the one we want"
+            if depth == len(result):
+                result.append((fixname(tag),
+                               {fixname(attrs[x]): attrs[x + 1]
+                                for x in range(0, len(attrs), 2)}))
+            else:
+                result.append(None)
+
+        def data(text):
+            "text after the last start tag"
+            if len(result) > depth:
+                texts.append(text)
+
+        parser.StartElementHandler = start
+        parser.CharacterDataHandler = data
+        try:
+            parser.Parse(self.prolog + wrapper + self.start_tag(ix), False)
+        except expat.ExpatError as err:
+            raise et.ParseError(str(err)) from None
+        tag, attrib = result[-1]
+        return tag, "".join(texts), attrib
+
+
+def get_typecodes(size):
+    """return the array types for the positions in a file of the given size
+    and for the numbers of its elements
+
+    4 bytes each, unless the file is too large for that: every element takes
+    at least 4 bytes of it
+    """
+    return ("I" if size < 2 ** 32 else "q",
+            "i" if size < 2 ** 33 else "q")
+
+
+def escape_uri(uri):
+    "return a namespace uri as it can be put in a start tag"
+    for old, new in (("&", "&amp;"), ("<", "&lt;"), ('"', "&quot;")):
+        uri = uri.replace(old, new)
+    return uri.encode("ascii", "xmlcharrefreplace")
+
+
+def prune_cache(limit=None):
+    """remove the least recently used indexes until the cache fits its size
+    """
+    limit = CACHE_SIZE if limit is None else limit
+    try:
+        entries = [(x.stat().st_mtime, x.stat().st_size, x)
+                   for x in CACHE_DIR.glob("*.idx")]
+    except OSError:
+        return
+    total = sum(x[1] for x in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+
+
+def fixname(name):
+    "turn expat's uri}name into ElementTree's {uri}name"
+    return "{" + name if "}" in name else name
+
+
+class MappedElement:
+    """an element of a MappedTree, that behaves like an ElementTree element as
+    far as the viewers are concerned
+
+    elements are equal when they're at the same place in the same file;
+    what's in them is read when it's first asked for
+    """
+    __slots__ = ("tree", "index", "data", "subs")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+        self.data = None  # tag, text, attributes
+        self.subs = None  # numbers of the subelements
+
+    def __eq__(self, other):
+        return (isinstance(other, MappedElement) and other.tree is self.tree
+                and other.index == self.index)
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def read(self):
+        "return what's in the element"
+        if self.data is None:
+            self.data = self.tree.read(self.index)
+        return self.data
+
+    @property
+    def tag(self):
+        "element name"
+        return self.read()[0]
+
+    @property
+    def text(self):
+        "text before the first subelement"
+        return self.read()[1]
+
+    def items(self):
+        "attribute names and values"
+        return list(self.read()[2].items())
+
+    def keys(self):
+        "attribute names"
+        return list(self.read()[2])
+
+    def get(self, key, default=None):
+        "attribute value"
+        return self.read()[2].get(key, default)
+
+    def children(self):
+        "return the numbers of the subelements"
+        if self.subs is None:
+            self.subs = self.tree.children(self.index)
+        return self.subs
+
+    def __len__(self):
+        return len(self.children())
+
+    def __getitem__(self, row):
+        return self.tree.element(self.children()[row])
+
+    def __iter__(self):
+        # like iter(), without keeping the elements
+        return (MappedElement(self.tree, x) for x in self.children())
+
+    def iter(self):
+        """walk through this element and everything below it, in document order
+
+        the elements are not kept (see MappedTree.element), so walking a large
+        file doesn't fill the memory
+        """
+        return (MappedElement(self.tree, x) for x in range(
+            self.index, self.index + self.tree.sizes[self.index] + 1))
+
+    def locate(self):
+        "return the element this one is under and its position there"
+        parent = self.tree.parents[self.index]
+        if parent < 0:
+            return None, 0
+        return (self.tree.element(parent),
+                self.tree.children(parent).index(self.index))
+
+
 class MixinError(BaseException):
     """Custom exception for AxeMixin"""
 
@@ -204,7 +621,7 @@ class AxeMixin:
         self.init_tree(et.Element("New"))
         if self.xmlfn != "":
             try:
-                tree, prefixes, uris = parse_nsmap(self.xmlfn)
+                tree, prefixes, uris = read_xml(self.xmlfn)
             except (IOError, et.ParseError) as err:
                 self._meldfout(str(err), abort=True)
                 self.init_tree(None)
@@ -259,7 +676,7 @@ class AxeMixin:
             ok, fname = self._file_to_read()
             if ok:
                 try:
-                    tree, prefixes, uris = parse_nsmap(fname)
+                    tree, prefixes, uris = read_xml(fname)
                 except et.ParseError as e:
                     self._meldfout(str(e))
                     return False
@@ -300,9 +717,11 @@ class AxeMixin:
 
     def init_tree(self, root, prefixes=None, uris=None, name=""):
         "stelt een en ander in en geeft titel voor in de visuele tree terug"
+        self.close_tree()
         self.rt = root
         self.ns_prefixes = prefixes or []
         self.ns_uris = uris or []
+        self.namespaces = Namespaces(prefixes, uris)
         if name:
             titel = name
         elif self.xmlfn:
@@ -311,6 +730,12 @@ class AxeMixin:
             titel = "[unsaved file]"
         return titel
 
+    def close_tree(self):
+        "let go of the file a document that's read straight from it is in"
+        rt = getattr(self, "rt", None)
+        if isinstance(rt, MappedElement):
+            rt.tree.close()
+
     def cut(self):
         "cut is copy with remove and retain"
         self.copy(cut=True)
@@ -3,170 +3,1072 @@ XMLEdit GUI-onafhankelijke code
 """
 
 import os
+import bisect
+import codecs
+import collections
+import functools
+import io
+import itertools
+import re
+import tempfile
 
 # import pathlib
 # import sys
 import shutil
 import xml.etree.ElementTree as et  # noqa N813
+from xml.parsers import expat
+from xml.sax.saxutils import escape
 
 # import logging
 
-from .shared import ELSTART, log
-from .gui import Gui
+from .shared import (ELSTART, SEARCH_MODES, Namespaces, Node, Symbols,
+                     compressed_stream, get_compression, log)
 
 from axe.intl import _
 
 TITEL = "Albert's (Simple) XML editor"
 NEW_ROOT = "(new root)"
+LAZY_LOAD_SIZE = 20 * 1024 * 1024  # files larger than this are shown lazily
+COMPRESSION_RATIO = 10  # how much a compressed XML file usually grows
+LOAD_BATCH = 2000  # number of parse events handled before updating the screen
+READ_CHUNK = 64 * 1024  # bytes read from the file at a time while parsing
+WRITE_BUFFER = 1024 * 1024  # bytes collected before writing to disk
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+# besides &, < and >, for attribute values written between double quotes
+ATTRIB_ENTITIES = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;",
+                   "\t": "&#09;"}
+
+
+@functools.lru_cache(maxsize=32)
+def compile_search(search_args, mode="text"):
+    """turn the (element name, attribute name, attribute value, text) search
+    arguments into tests that are called with the string to check
+
+    with "regex" the arguments are regular expressions, compiled only once for
+    repeated searches; with "xpath" the first argument is a path that has to
+    be evaluated against a tree (see SearchIndex.select), so it gets no test.
+    An empty argument gets no test either
+    """
+    tests = []
+    for ix, arg in enumerate(search_args):
+        if not arg or (mode == "xpath" and ix == 0):
+            tests.append(None)
+        elif mode == "regex":
+            tests.append(re.compile(arg).search)
+        else:
+            tests.append(lambda value, arg=arg: arg in value)
+    return tuple(tests)
+
 
+@functools.lru_cache(maxsize=32)
+def compile_replace(search_args, replace_args, mode="text"):
+    """turn the search arguments and what to replace them with into functions
+    that return the new version of a name or value
 
-def find_in_flattened_tree(data, search_args, reverse=False, pos=None):
-    """searches the flattened tree from start or the given pos
-    to find the next item that fulfills the search criteria
+    a name (the first two arguments) is only replaced by something that is not
+    empty, a value is not replaced when its replacement is None, so only an
+    empty string removes what's found; when there's nothing to replace there's
+    no function
     """
-    # print('in find_in_flattened_tree:', search_args)
-    wanted_ele, wanted_attr, wanted_value, wanted_text = search_args
-    if reverse:
-        data.reverse()
-
-    if pos:
-        pos, is_attr = pos
-        # found_item = False
-        for ix, item in enumerate(data):
-            if is_attr:
-                found_attr = False
-                for ix2, attr in enumerate(item[3]):
-                    if attr[0] == pos:
-                        found_attr = True
-                        break
-                if found_attr:
+    subs = []
+    for ix, (arg, new) in enumerate(zip(search_args, replace_args)):
+        if not arg or new is None or (ix < 2 and not new):
+            subs.append(None)
+        elif mode == "xpath" and ix == 0:
+            subs.append(lambda value, new=new: new)
+        elif mode == "regex":
+            subs.append(functools.partial(re.compile(arg).sub, new))
+        else:
+            subs.append(lambda value, arg=arg, new=new: value.replace(arg,
+                                                                      new))
+    return tuple(subs)
+
+
+def check_search_args(search_args, mode="text", namespaces=None):
+    "return a message if the search arguments can't be used, else nothing"
+    try:
+        compile_search(tuple(search_args), mode)
+        if mode == "xpath" and search_args[0]:
+            list(et.Element("x").iterfind(xpath_for_root(search_args[0]),
+                                          namespaces))
+    except re.error as err:
+        return "Invalid regular expression: {}".format(err)
+    except (SyntaxError, KeyError) as err:
+        return "Invalid path: {}".format(err)
+    except (TypeError, ValueError, StopIteration):
+        # ElementPath doesn't always give a proper error for a wrong path
+        return "Invalid path: `{}`".format(search_args[0])
+    return ""
+
+
+def xpath_for_root(path):
+    """make a path usable for an element that contains the root element, so
+    both absolute and relative paths are understood
+    """
+    if path.startswith("/"):
+        return "." + path
+    return "./*/" + path
+
+
+def match_entry(entry, tests, reverse=False, attrs=None, nodes=None):
+    """check an entry of the flattened tree against the search criteria
+
+    an entry consists of the node, element name, element text and a list of
+    (node, name, value) tuples for the attributes; `attrs` can replace this
+    list, e.g. to search only the attributes after the current one.
+    `tests` are the compiled search arguments (see compile_search), `nodes`
+    the elements selected by a path if there is one.
+    returns the node that was found and whether it's an attribute, or None
+    """
+    wanted_ele, wanted_attr, wanted_value, wanted_text = tests
+    item, element_name, element_text, attr_list = entry
+    if attrs is not None:
+        attr_list = attrs
+    ele_ok = attr_name_ok = attr_value_ok = attr_ok = text_ok = False
+    if nodes is not None:
+        ele_ok = item in nodes
+    elif not wanted_ele or wanted_ele(element_name):
+        ele_ok = True
+    if not wanted_text or wanted_text(element_text):
+        text_ok = True
+
+    attr_item = None
+    if attr_list and (wanted_attr or wanted_value):
+        if reverse:
+            attr_list = reversed(attr_list)
+        for attr, name, value in attr_list:
+            attr_name_ok = attr_value_ok = False
+            if not wanted_attr or wanted_attr(name):
+                attr_name_ok = True
+            if not wanted_value or wanted_value(value):
+                attr_value_ok = True
+            if attr_name_ok and attr_value_ok:
+                attr_ok = True
+                if not (wanted_ele or wanted_text or nodes is not None):
+                    attr_item = attr
+                break
+    elif not wanted_attr and not wanted_value:
+        attr_ok = True
+
+    if ele_ok and text_ok and attr_ok:
+        if attr_item is not None:
+            return attr_item, True
+        return item, False
+    return None
+
+
+class SearchIndex:
+    """searchable data of the visual tree: element names and texts and
+    attribute names and values
+
+    the entries are kept up to date while editing, so a search doesn't have to
+    read the whole tree again. Elements that are added or put back are taken
+    into the document order with everything below them before the next
+    search, removed ones are taken out right away; only the subtrees involved
+    are read (see refresh and remove).
+    Subtrees that aren't in the visual tree yet are indexed from the elements
+    that were read, keyed by element (and (element, name) for an attribute);
+    only the nodes leading to what's found are added to the visual tree
+    """
+
+    def __init__(self, editor):
+        self.editor = editor
+        self.clear()
+
+    def clear(self):
+        "forget everything, e.g. when a new tree is set up"
+        self.entries = {}  # element node: [node, name, text, attributes]
+        self.attr_parent = {}  # attribute node: element node
+        self.order = []  # element nodes in document order
+        self.parents = {}  # element node: parent element node
+        self.sources = {}  # lazily loaded node: element for its subelements
+        self.fresh = set()  # element nodes added since the last refresh
+        self.changed = set()  # nodes that have had those added under them
+        self.dirty = True
+        self.generation = 0  # changes whenever the indexed data changes
+        self.selections = {}  # path: selected element nodes
+        self.selections_for = None  # generation of those selections
+        self.backing_tree = None  # to evaluate paths on, see build_tree
+
+    def add(self, node, name, value, attr=False, parent=None, pos=-1):
+        """register a node that's been added to the visual tree
+
+        for an attribute, `parent` is the element node and `pos` its position
+        among the element's children
+        """
+        if attr:
+            entry = self.entries.get(parent)
+            if entry is None:  # not indexed yet, is read when refreshing
+                self.generation += 1
+                return
+            attrs = entry[3]
+            if pos < 0 or pos > len(attrs):
+                pos = len(attrs)
+            attrs.insert(pos, (node, name, value))
+            self.attr_parent[node] = parent
+            self.change_backing(parent, attr=(None, name, value))
+        else:
+            self.entries[node] = [node, name, value, []]
+            self.add_subtree(node, parent)
+        self.generation += 1
+
+    def add_subtree(self, node, parent):
+        """register an element node that's been added to the visual tree or
+        put back in it, with everything below it
+        """
+        if not self.dirty:
+            self.fresh.add(node)
+            self.changed.add(parent)
+        self.generation += 1
+
+    def invalidate(self):
+        "the tree has changed in a way that needs the order to be rebuilt"
+        self.dirty = True
+        self.generation += 1
+
+    def update(self, node, name, value):
+        "register the new name and value of an edited node"
+        if node in self.attr_parent:
+            element = self.attr_parent[node]
+            attrs = self.entries[element][3]
+            for ix, attr in enumerate(attrs):
+                if attr[0] == node:
+                    attrs[ix] = (node, name, value)
+                    self.change_backing(element, attr=(attr[1], name, value))
                     break
+        elif node in self.entries:
+            self.entries[node][1:3] = [name, value]
+            self.change_backing(node, name, value)
+        self.generation += 1
+
+    def remove(self, node):
+        """forget a node that's about to be taken out of the visual tree,
+        with everything below it
+        """
+        if not self.dirty:
+            self.refresh()
+        if node in self.attr_parent:
+            element = self.attr_parent.pop(node)
+            attrs = self.entries[element][3]
+            for attr in attrs:
+                if attr[0] == node:
+                    self.change_backing(element, attr=(attr[1], None, None))
+            attrs[:] = [x for x in attrs if x[0] != node]
+        elif self.dirty:
+            self.entries.pop(node, None)
+        elif node in self.entries:
+            keys = self.subtree_keys(node)
+            start = self.order.index(node)
+            del self.order[start:start + len(keys)]
+            self.forget(keys)
+            self.backing_tree = None
+        self.generation += 1
+
+    def subtree_keys(self, node):
+        "return the keys of an indexed node and everything below it in order"
+        gui = self.editor.gui
+        keys = []
+        stack = [node]
+        while stack:
+            key = stack.pop()
+            keys.append(key)
+            if isinstance(key, et.Element):
+                stack.extend(reversed(key))
+                continue
+            stack.extend(reversed(self.sources.get(key, ())))
+            stack.extend(x for x in reversed(gui.get_node_children(key))
+                         if x in self.entries)
+        return keys
+
+    def forget(self, keys):
+        "drop the entries for the given keys"
+        for key in keys:
+            entry = self.entries.pop(key)
+            for attr in entry[3]:
+                self.attr_parent.pop(attr[0], None)
+            self.parents.pop(key, None)
+            self.sources.pop(key, None)
+
+    def rebuild(self):
+        """determine the document order of the elements
+
+        nodes that are not known yet are read from the visual tree, for the
+        others only the children are looked up. The subelements of a lazily
+        loaded node are read as they are, without adding them to the tree
+        """
+        gui = self.editor.gui
+        known, known_attrs = self.entries, self.attr_parent
+        self.entries, self.attr_parent, self.parents = {}, {}, {}
+        self.sources = {}
+        self.order = self.read(
+            [x for x in gui.get_node_children(self.editor.top)
+             if gui.is_element(x)], known, known_attrs)
+        self.fresh, self.changed = set(), set()
+        self.backing_tree = None
+        self.dirty = False
+
+    def read(self, nodes, known, known_attrs):
+        """index the given element nodes and everything below them and return
+        the keys in document order
+
+        `known` and `known_attrs` hold the entries and attributes that don't
+        have to be read from the visual tree again
+        """
+        gui = self.editor.gui
+        entries, attr_parent = self.entries, self.attr_parent
+        parents, sources = self.parents, self.sources
+        order = []
+        stack = list(reversed(nodes))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, et.Element):
+                entry = known.get(node)
+                if entry is None:
+                    entry = [node, node.tag, node.text or "",
+                             [((node, name), name, value or '""')
+                              for name, value in node.items()]]
+                entries[node] = entry
+                order.append(node)
+                attr_parent.update((x[0], node) for x in entry[3])
+                parents.update((x, node) for x in node)
+                stack.extend(reversed(node))
+                continue
+            entry = known.get(node)
+            is_known = entry is not None
+            if not is_known:
+                entry = [node, *gui.get_node_data(node), []]
+            entries[node] = entry
+            order.append(node)
+            subnodes = []
+            for subnode in gui.get_node_children(node):
+                if subnode in known:
+                    is_attr = False
+                elif subnode in known_attrs:
+                    is_attr = True
+                else:
+                    is_attr = not gui.is_element(subnode)
+                if not is_attr:
+                    subnodes.append(subnode)
+                    parents[subnode] = node
+                    continue
+                attr_parent[subnode] = node
+                if not is_known:
+                    entry[3].append((subnode, *gui.get_node_data(subnode)))
+            el = self.editor.pending.get(node)
+            if el is not None:
+                sources[node] = el
+                parents.update((x, node) for x in el)
+                subnodes = list(el)
+            stack.extend(reversed(subnodes))
+        return order
+
+    def refresh(self):
+        """bring the document order up to date before searching
+
+        the elements added since the last time are read with everything
+        below them and put in their place. A lazily loaded node whose
+        subelements have been added to the visual tree loses the elements
+        they were indexed by
+        """
+        if self.dirty:
+            self.rebuild()
+            return
+        if not self.changed:
+            return
+        gui = self.editor.gui
+        parents = []
+        for parent in self.changed:
+            node = parent
+            while node is not None and node not in self.fresh:
+                node = gui.get_node_parent(node)
+            if node is None:  # not inside something that's read anyway
+                parents.append(parent)
+        dropped, added = [], set()
+        for parent in parents:
+            el = self.sources.get(parent)
+            if el is not None and parent not in self.editor.pending:
+                start = self.order.index(parent) + 1
+                end = start + sum(1 for _ in el.iter()) - 1
+                dropped.extend(self.order[start:end])
+                del self.order[start:end]
+                del self.sources[parent]
+        for parent in parents:
+            following = None  # the key the elements go before
+            at_end = True  # ... or the last key of the parent's subtree
+            run = []
+            for node in reversed(gui.get_node_children(parent)):
+                if not gui.is_element(node):
+                    continue
+                if node in self.fresh:
+                    run.append(node)
+                    self.parents[node] = parent
+                    continue
+                if run:
+                    added.update(self.insert(run, following, at_end, parent))
+                    run = []
+                following, at_end = node, False
+            if run:
+                added.update(self.insert(run, following, at_end, parent))
+        self.forget(x for x in dropped if x not in added)
+        self.fresh, self.changed = set(), set()
+        self.backing_tree = None
+
+    def insert(self, nodes, following, at_end, parent):
+        """read element nodes (given last to first) and put their keys in the
+        order, before the key `following` or after everything under `parent`
+
+        returns the keys
+        """
+        if at_end:
+            following = self.following(parent)
+        keys = self.read(nodes[::-1], self.entries, self.attr_parent)
+        self.fresh.difference_update(nodes)  # their place is known now
+        ix = len(self.order) if following is None else self.order.index(
+            following)
+        self.order[ix:ix] = keys
+        return keys
+
+    def following(self, node):
+        """return the first indexed key after a node and everything below it,
+        None when that's the end of the document
+        """
+        gui = self.editor.gui
+        while True:
+            parent = gui.get_node_parent(node)
+            if parent is None:
+                return None
+            siblings = gui.get_node_children(parent)
+            for sibling in siblings[siblings.index(node) + 1:]:
+                if gui.is_element(sibling) and sibling not in self.fresh:
+                    return sibling
+            node = parent
+
+    def resolve(self, hits):
+        """turn (node, is_attr) search results into nodes of the visual tree
+
+        for what's in a subtree that isn't shown yet the nodes leading to it
+        are added to the tree
+        """
+        gui = self.editor.gui
+        shown = {}  # element: the node that's been added for it
+
+        def node_for(key):
+            "the node for an element, added to the tree when needed"
+            chain = []
+            while isinstance(key, et.Element) and key not in shown:
+                chain.append(key)
+                key = self.parents[key]
+            if isinstance(key, et.Element):
+                node, parent_el = shown[key], key
             else:
-                if item[0] == pos:
+                node, parent_el = key, self.sources.get(key)
+            for el in reversed(chain):
+                self.editor.populate_node(node)
+                shown.update(zip(parent_el, (
+                    x for x in gui.get_node_children(node)
+                    if gui.is_element(x))))
+                node, parent_el = shown[el], el
+            return node
+
+        result = []
+        for key, is_attr in hits:
+            if is_attr and isinstance(key, tuple):
+                element, name = key
+                node = node_for(element)
+                for subnode in gui.get_node_children(node):
+                    if (not gui.is_element(subnode)
+                            and gui.get_node_data(subnode)[0] == name):
+                        key = subnode
+                        break
+            else:
+                key = node_for(key)
+            result.append((key, is_attr))
+        return result
+
+    def contains(self, node):
+        "check if a node is (still) in the visual tree"
+        self.refresh()
+        return node in self.entries or node in self.attr_parent
+
+    def select(self, path, namespaces=None):
+        """return the element nodes found by an (ElementTree) XPath expression
+
+        the expression is evaluated against an ElementTree built from the
+        index (see build_tree), the results are kept until the document
+        changes
+        """
+        self.refresh()
+        if self.backing_tree is None:
+            self.backing_tree = self.build_tree()
+        if self.selections_for != self.generation:
+            self.selections = {}
+            self.selections_for = self.generation
+        if path not in self.selections:
+            document, elements, nodes = self.backing_tree
+            found = document.iterfind(xpath_for_root(path), namespaces)
+            # a path can lead outside the document, e.g. "/.."
+            selected = (nodes.get(el, el) for el in found)
+            self.selections[path] = {x for x in selected if x in self.entries}
+        return self.selections[path]
+
+    def build_tree(self):
+        """build an ElementTree from the indexed data
+
+        only the elements of the visual tree are copied: a subtree that isn't
+        shown yet is taken over as it was read. Renaming and changing texts
+        and attributes is done in this tree as well (see change_backing), so
+        it only has to be built again after elements were added or removed
+
+        returns an element containing the root element, a mapping from the
+        nodes of the visual tree to their elements and the reverse mapping
+        """
+        document = et.Element("document")
+        elements, nodes = {}, {}
+        for node in self.order:
+            if isinstance(node, et.Element):  # part of a subtree taken over
+                continue
+            _, name, text, attrs = self.entries[node]
+            parent = elements.get(self.parents.get(node), document)
+            el = et.SubElement(parent, name, {x[1]: x[2] for x in attrs})
+            el.text = text or None
+            el.extend(self.sources.get(node, ()))
+            elements[node] = el
+            nodes[el] = node
+        return document, elements, nodes
+
+    def change_backing(self, node, name=None, value=None, attr=None):
+        """make the same change to the tree paths are evaluated against
+
+        for an attribute `attr` holds the old name and the new name and value;
+        a new attribute has no old name, a removed one no new name
+        """
+        if self.backing_tree is None:
+            return
+        el = self.backing_tree[1].get(node)
+        if el is None:
+            return
+        if attr is None:
+            el.tag, el.text = name, value or None
+            return
+        old, name, value = attr
+        if old is not None:
+            el.attrib.pop(old, None)
+        if name is not None:
+            el.set(name, value)
+
+    def get_tests(self, search_args, mode):
+        "compile the search arguments and evaluate a path if needed"
+        tests = compile_search(tuple(search_args), mode)
+        nodes = None
+        if mode == "xpath" and search_args[0]:
+            nodes = self.select(search_args[0],
+                                self.editor.namespaces.by_prefix)
+        return tests, nodes
+
+    def match(self, node, search_args, mode="text"):
+        """check if a node itself fulfills the search criteria
+
+        returns (node, is_attr) like a search does, or None
+        """
+        tests, nodes = self.get_tests(search_args, mode)
+        self.refresh()
+        if node in self.attr_parent:
+            entry = self.entries[self.attr_parent[node]]
+            attrs = [x for x in entry[3] if x[0] == node]
+            found = match_entry(entry, tests, attrs=attrs, nodes=nodes)
+            if found is not None and found[1]:
+                return found
+        elif node in self.entries:
+            return match_entry(self.entries[node], tests, nodes=nodes)
+        return None
+
+    def find_all(self, search_args, mode="text"):
+        """find all nodes that fulfill the search criteria in one pass
+
+        returns (node, is_attr) tuples in document order; when searching for
+        attributes only, every matching attribute of an element counts
+        """
+        tests, nodes = self.get_tests(search_args, mode)
+        self.refresh()
+        hits = []
+        for node in self.order:
+            if nodes is not None and node not in nodes:
+                continue
+            entry = self.entries[node]
+            attrs = None
+            while True:
+                found = match_entry(entry, tests, attrs=attrs, nodes=nodes)
+                if found is None:
                     break
-        if is_attr:
-            data = data[ix:]
-            id, name, text, attrs = data[0]
-            data[0] = id, name, text, attrs[ix2 + 1:]
-        elif ix < len(data) - 1:
-            data = data[ix + 1:]
-        else:
-            return None, False  # no more data to search
-
-    itemfound = False
-    for item, element_name, element_text, attr_list in data:
-        ele_ok = attr_name_ok = attr_value_ok = attr_ok = text_ok = False
-        # print(element_name, element_text, attr_list)
-        # ele_ok = text_ok = False
-        if not wanted_ele or wanted_ele in element_name:
-            ele_ok = True
-            # print('ele wanted:', wanted_ele, 'found:', ele_ok)
-        if not wanted_text or wanted_text in element_text:
-            text_ok = True
-            # print('text wanted:', wanted_text, 'found:', text_ok)
-
-        attr_item = None
-        if attr_list and (wanted_attr or wanted_value):
-            if reverse:
-                attr_list.reverse()
-            for attr, name, value in attr_list:
-                attr_name_ok = attr_value_ok = False
-                if not wanted_attr or wanted_attr in name:
-                    attr_name_ok = True
-                    # print('attr name wanted:', wanted_attr,
-                    #       'found:', attr_name_ok)
-                if not wanted_value or wanted_value in value:
-                    attr_value_ok = True
-                    # print('attr value wanted:', wanted_value,
-                    #       'found:', attr_value_ok)
-                if attr_name_ok and attr_value_ok:
-                    attr_ok = True
-                    if not (wanted_ele or wanted_text):
-                        attr_item = attr
+                hits.append(found)
+                if not found[1]:
                     break
-        elif not wanted_attr and not wanted_value:
-            attr_ok = True
+                attr_nodes = [x[0] for x in entry[3]]
+                attrs = entry[3][attr_nodes.index(found[0]) + 1:]
+        return self.resolve(hits)
 
-        ok = ele_ok and text_ok and attr_ok
-        if ok:
-            if attr_item:
-                itemfound, is_attr = attr_item, True
+    def find(self, search_args, reverse=False, pos=None, mode="text"):
+        """find the next node that fulfills the search criteria, starting
+        after the given (node, is_attr) position
+        """
+        tests, nodes = self.get_tests(search_args, mode)
+        self.refresh()
+        step = -1 if reverse else 1
+        start = len(self.order) - 1 if reverse else 0
+        attrs = None
+        if pos:
+            node = pos[0]
+            if node in self.attr_parent:
+                element = self.attr_parent[node]
+                start = self.order.index(element)
+                attr_nodes = [x[0] for x in self.entries[element][3]]
+                ix = attr_nodes.index(node)
+                attrs = self.entries[element][3]
+                attrs = attrs[:ix] if reverse else attrs[ix + 1:]
+            elif node in self.entries:
+                start = self.order.index(node) + step
+        stop = -1 if reverse else len(self.order)
+        for ix in range(start, stop, step):
+            found = match_entry(self.entries[self.order[ix]], tests,
+                                reverse, attrs, nodes)
+            if found:
+                return self.resolve([found])[0]
+            attrs = None
+        return None, False
+
+
+class Parser:
+    """parse XML with expat into ElementTree elements, reporting the
+    "start-ns", "start" and "end" events like et.iterparse does
+
+    besides that, after its "end" event a ("span", (element, start, end))
+    event tells where the element is in the file, if whatever's in the file
+    can be copied as it is (see Layout): not when it uses another encoding
+    than UTF-8 or has a DOCTYPE, which could define entities
+    """
+
+    def __init__(self):
+        self.parser = expat.ParserCreate(namespace_separator="}")
+        self.parser.ordered_attributes = True
+        self.builder = et.TreeBuilder()
+        self.events = []
+        self.names = {}
+        self.keep_spans = True
+        self.size = 0  # number of bytes fed so far
+        self.starts = []  # where the elements that are still open begin
+        self.ended = None  # element that's ended, (element, start)
+        parser = self.parser
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.data
+        parser.StartNamespaceDeclHandler = self.start_ns
+        parser.XmlDeclHandler = self.xml_decl
+        parser.StartDoctypeDeclHandler = self.doctype
+        # whatever comes next ends the element before it
+        parser.CommentHandler = self.other
+        parser.ProcessingInstructionHandler = self.other
+        parser.DefaultHandlerExpand = self.other
+
+    def feed(self, data, final=False):
+        "parse the next part of the file"
+        if not self.size and data.startswith((codecs.BOM_UTF16_LE,
+                                              codecs.BOM_UTF16_BE)):
+            self.keep_spans = False
+        self.size += len(data)
+        try:
+            self.parser.Parse(data, final)
+        except expat.ExpatError as err:
+            raise et.ParseError(str(err)) from None
+        if final:
+            self.end_span(self.size)
+
+    def fixname(self, name):
+        "turn expat's uri}name into {uri}name"
+        try:
+            return self.names[name]
+        except KeyError:
+            fixed = "{" + name if "}" in name else name
+            self.names[name] = fixed
+            return fixed
+
+    def start_ns(self, prefix, uri):
+        "handle a namespace declaration"
+        self.other()
+        self.events.append(("start-ns", (prefix or "", uri or "")))
+
+    def start(self, tag, attrs):
+        "handle the start of an element"
+        self.other()
+        attrib = {self.fixname(attrs[ix]): attrs[ix + 1]
+                  for ix in range(0, len(attrs), 2)}
+        el = self.builder.start(self.fixname(tag), attrib)
+        self.events.append(("start", el))
+        self.starts.append(self.parser.CurrentByteIndex)
+
+    def end(self, tag):
+        "handle the end of an element; where it ends becomes known later"
+        self.other()
+        el = self.builder.end(self.fixname(tag))
+        self.events.append(("end", el))
+        self.ended = el, self.starts.pop()
+
+    def data(self, text):
+        "handle text"
+        self.other()
+        self.builder.data(text)
+
+    def other(self, *args):
+        "something else begins here, so the element that just ended ends here"
+        if self.ended is not None:
+            self.end_span(self.parser.CurrentByteIndex)
+
+    def end_span(self, pos):
+        "report where the element that just ended is in the file"
+        if self.ended is not None and self.keep_spans:
+            el, start = self.ended
+            self.events.append(("span", (el, start, pos)))
+        self.ended = None
+
+    def xml_decl(self, version, encoding, standalone):
+        "only an UTF-8 file can be copied from"
+        if encoding and encoding.lower() not in ("utf-8", "utf8", "ascii",
+                                                 "us-ascii"):
+            self.keep_spans = False
+
+    def doctype(self, *args):
+        "entities defined in a DOCTYPE can't be copied elsewhere"
+        self.keep_spans = False
+
+
+def parse_events(fname, batchsize=LOAD_BATCH):
+    """parse an XML file in one pass and yield the events in batches
+
+    a batch is a list of (event, data) tuples for the "start-ns", "start",
+    "end" and "span" events (see Parser), so namespaces, elements and their
+    texts can be handled while the file is being read. Every batch comes with
+    the percentage of the file that has been read so far.
+
+    A compressed file is unpacked while it's read; what's in it can't be
+    copied as it is, so it gets no spans
+    """
+    parser = Parser()
+    compression = get_compression(fname)
+    with open(fname, "rb") as raw:
+        size = os.fstat(raw.fileno()).st_size or 1
+        f = raw
+        if compression is not None:
+            parser.keep_spans = False
+            f = compressed_stream(compression, raw)
+        while True:
+            data = f.read(READ_CHUNK)
+            parser.feed(data, final=not data)
+            events = parser.events
+            while len(events) >= batchsize:
+                yield events[:batchsize], raw.tell() * 100 // size
+                del events[:batchsize]
+            if not data:
+                break
+        if parser.events:
+            yield parser.events, 100
+
+
+def file_stat(fname):
+    "return what tells if a file has been changed, None if there's no file"
+    try:
+        stat = os.stat(fname)
+    except (OSError, ValueError):
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class Layout:
+    """where the elements of a document are in the file it was read from
+
+    elements that haven't changed since can be copied from that file as they
+    are when saving. The spans of bytes are kept by node id for what's in the
+    visual tree and by element for what isn't shown yet; when a node changes
+    it loses its span and so do the nodes above it (see Editor.node_changed)
+    """
+
+    def __init__(self, fname=""):
+        self.fname = fname
+        self.stat = file_stat(fname) if fname else None
+        self.spans = {}
+        self.element_spans = {}
+
+    def usable(self):
+        "can the file still be copied from?"
+        return (bool(self.fname and self.spans)
+                and file_stat(self.fname) == self.stat)
+
+    def discard(self):
+        "the file can't be copied from"
+        self.fname = ""
+        self.spans.clear()
+        self.element_spans.clear()
+
+    def moved(self, fname, copied, spans, element_spans):
+        """return the layout of the file the document has just been written to
+
+        `copied` are (start, end, new start) of what's been copied as it is,
+        `spans` and `element_spans` tell where everything else went
+        """
+        layout = Layout(fname)
+        copied.sort()
+        starts = [x[0] for x in copied]
+        for old, new in ((self.spans, layout.spans),
+                         (self.element_spans, layout.element_spans)):
+            for key, (start, end) in old.items():
+                ix = bisect.bisect_right(starts, start) - 1
+                if ix >= 0 and end <= copied[ix][1]:
+                    shift = copied[ix][2] - copied[ix][0]
+                    new[key] = (start + shift, end + shift)
+        layout.spans.update(spans)
+        layout.element_spans.update(element_spans)
+        return layout
+
+
+class XMLWriter:
+    """write a document straight from the visual tree to a file
+
+    every element is written as soon as it's reached, so nothing is copied
+    into an ElementTree first. Elements that haven't changed since the
+    document was read are copied from that file as they are (see Layout);
+    where everything ends up is remembered for the next time.
+
+    Names get the prefixes of the document's namespaces, which are declared
+    on the root; a namespace that isn't known there is declared on the
+    element that uses it. The output is compressed on the way when asked for;
+    positions are then those in the uncompressed document
+    """
+    # what's on the stack: a visual node, an element that isn't shown yet or
+    # the end of an element
+    NODE, ELEMENT, END = range(3)
+
+    def __init__(self, editor):
+        self.editor = editor
+        self.gui = editor.gui
+        self.prefixes = {XML_NAMESPACE: "xml"}
+        self.declare = []
+        for prefix, uri in editor.namespaces.by_prefix.items():
+            self.prefixes.setdefault(uri, prefix)
+            if prefix != "xml":
+                self.declare.append((prefix, uri))
+        self.out = None
+        self.pos = 0  # number of bytes written
+        self.copied = []  # (start, end, new start) of what's been copied
+        self.spans = {}  # where the nodes that are written anew are
+        self.element_spans = {}
+
+    def write(self, fn, compression=None, name=""):
+        """write the document to a file and make sure it's on disk
+
+        `compression` is the module to compress it with (see
+        shared.COMPRESSIONS), `name` the name of the file it's meant for when
+        that's not `fn`
+        """
+        layout = self.editor.layout
+        source = open(layout.fname, "rb") if layout.usable() else None
+        try:
+            with open(fn, "wb", buffering=WRITE_BUFFER) as raw:
+                if compression is None:
+                    self.out = raw
+                    self.write_document(source)
+                else:
+                    # a compressor takes many small writes badly
+                    with compressed_stream(compression, raw, "wb",
+                                           name or fn) as packer, \
+                            io.BufferedWriter(packer, WRITE_BUFFER) as out:
+                        self.out = out
+                        self.write_document(source)
+                raw.flush()
+                os.fsync(raw.fileno())  # on disk before it replaces anything
+        finally:
+            if source is not None:
+                source.close()
+
+    def write_document(self, source):
+        "write the XML declaration and the elements"
+        self.put("<?xml version='1.0' encoding='utf-8'?>\n")
+        self.write_elements(source)
+
+    def put(self, text):
+        "write some text"
+        data = text.encode("utf-8", "xmlcharrefreplace")
+        self.out.write(data)
+        self.pos += len(data)
+
+    def copy(self, source, start, end):
+        "copy an element from the file the document was read from"
+        source.seek(start)
+        size = end - start
+        while size:
+            data = source.read(min(size, WRITE_BUFFER))
+            if not data:
+                raise IOError("{} has been changed while saving".format(
+                    source.name))
+            self.out.write(data)
+            size -= len(data)
+        self.copied.append((start, end, self.pos))
+        self.pos += end - start
+
+    def write_elements(self, source):
+        "write the elements, top down and without recursion"
+        layout = self.editor.layout
+        todo = [(self.NODE, self.gui.get_treetop())]
+        while todo:
+            kind, item = todo.pop()
+            if kind == self.END:
+                tag, tail, spans, key, start = item
+                self.put("</{}>".format(tag))
+                spans[key] = start, self.pos
+                self.put(escape(tail))
+                continue
+            if kind == self.NODE:
+                spans, key = self.spans, self.gui.get_node_id(item)
+                span = layout.spans.get(key)
             else:
-                itemfound, is_attr = item, False
-            break
-    if itemfound:
-        return itemfound, is_attr
-    return None, False
-
-
-def parse_nsmap(file):
-    """analyze namespaces"""
-    root = None
-    ns_prefixes = []
-    ns_uris = []
-
-    for event, elem in et.iterparse(file, ("start-ns", "start")):
-        if event == "start-ns":
-            ns_prefixes.append(elem[0])
-            ns_uris.append(elem[1])
-        elif event == "start":
-            if root is None:
-                root = elem
-
-    return et.ElementTree(root), ns_prefixes, ns_uris
-
-
-class XMLTree:
-    """class to store XMLdata"""
-
-    def __init__(self, data):
-        self.root = et.Element(data)
-
-    def expand(self, root, text, data):
-        "expand node"
-        if text.startswith(ELSTART):
-            node = et.SubElement(root, data[0])
-            if data[1]:
-                node.text = data[1]
-            return node
-        else:
-            root.set(data[0], data[1])
-            return None
+                spans, key = self.element_spans, item
+                span = layout.element_spans.get(item)
+            if source is not None and span is not None:
+                self.copy(source, *span)
+                if kind == self.ELEMENT:
+                    self.put(escape(item.tail or ""))
+                continue
+            if kind == self.NODE:
+                name, attrs, text, subitems, tail = self.read_node(item)
+            else:
+                name, attrs, text, subitems, tail = self.read_element(item)
+            declare, self.declare = self.declare, []  # only on the root
+            local = {}
+            tag = self.qualify(name, local)
+            attrs = [(self.qualify(attname, local, attr=True), value)
+                     for attname, value in attrs]
+            attrs[:0] = [("xmlns:" + prefix if prefix else "xmlns", uri)
+                         for prefix, uri in declare + list(local.items())]
+            start = self.pos
+            self.put("<" + tag)
+            for attname, value in attrs:
+                self.put(' {}="{}"'.format(attname,
+                                           escape(value, ATTRIB_ENTITIES)))
+            if text or subitems:
+                self.put(">" + escape(text))
+                todo.append((self.END, (tag, tail, spans, key, start)))
+                todo.extend(reversed(subitems))
+            else:
+                self.put(" />")
+                spans[key] = start, self.pos
+                self.put(escape(tail))
+
+    def read_node(self, node):
+        """return name, attributes, text, subelements and tail of an element
+        in the visual tree
 
-    def write(self, fn, ns_data=None):
-        "write XML to tree"
-        tree = et.ElementTree(self.root)
-        if ns_data:
-            prefixes, uris = ns_data
-            for idx, prefix in enumerate(prefixes):
-                et.register_namespace(prefix, uris[idx])
-        tree.write(fn, encoding="utf-8", xml_declaration=True)
+        subtrees that were never shown are taken over as they are
+        """
+        name, text = self.gui.get_node_data(node)
+        attrs, subitems = [], []
+        for subnode in self.gui.get_node_children(node):
+            if self.gui.is_element(subnode):
+                subitems.append((self.NODE, subnode))
+            else:
+                attrs.append(self.gui.get_node_data(subnode))
+        subitems.extend((self.ELEMENT, el)
+                        for el in self.editor.pending.get(node, ()))
+        return name, attrs, text or "", subitems, ""
+
+    def read_element(self, el):
+        "the same for an element that hasn't been added to the visual tree"
+        return (el.tag, el.items(), el.text or "",
+                [(self.ELEMENT, subel) for subel in el], el.tail or "")
+
+    def qualify(self, fullname, local, attr=False):
+        """turn a "{uri}localname" name into "prefix:localname"
+
+        a namespace without a prefix gets one that's declared locally (an
+        attribute can't use the default namespace)
+        """
+        if not fullname.startswith("{"):
+            return fullname
+        uri, localname = fullname[1:].split("}", 1)
+        prefix = self.prefixes.get(uri)
+        if prefix is None or (attr and not prefix):
+            for prefix, known in local.items():
+                if known == uri:
+                    break
+            else:
+                prefix = "ns{}".format(len(local))
+                while prefix in self.editor.namespaces.by_prefix:
+                    prefix += "_"
+                local[prefix] = uri
+        return ":".join((prefix, localname)) if prefix else localname
+
+
+def make_backup(fname, backup):
+    """let the backup file name refer to the current contents of a file
+
+    a hard link copies nothing; where that's not possible the file is renamed,
+    it's going to be replaced anyway
+    """
+    if os.path.exists(backup):
+        os.remove(backup)
+    try:
+        os.link(fname, backup)
+    except OSError:
+        os.replace(fname, backup)
+
+
+def sync_dir(dirname):
+    "make sure a rename in a directory is on disk (not possible on Windows)"
+    if os.name == "nt":
+        return
+    fd = os.open(dirname or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 # class AxeMixin():
 class Editor:
     """Applicatievenster zonder GUI-specifieke methoden
     (Application window without GUI specific methods)
+
+    `gui_class` is the Gui to use; without it that of the toolkit chosen in
+    axe.toolkit is imported
     """
 
-    def __init__(self, fname):
+    def __init__(self, fname, gui_class=None):
         self.title = "Albert's XML Editor"
-        self.xmlfn = os.path.abspath(fname) if fname else ""
-        self.gui = Gui(self, fname)
+        self.xmlfn = ""  # the file is only known once it's been read
+        if gui_class is None:
+            from .gui import Gui as gui_class
+        self.gui = gui_class(self, fname)
         self.gui.cut_att = None
         self.gui.cut_el = None
         self.search_args = []
+        self.search_mode = SEARCH_MODES[0]
+        self.replace_args = (None, None, None, None)
+        self.pending = {}  # visual nodes whose children are not shown yet
+        self.search_index = SearchIndex(self)
+        # names of elements and attributes, for every document shown in this
+        # window: a tree that's put aside while loading still refers to them
+        self.symbols = Symbols()
+        # every node gets a number that stays the same while it exists, so it
+        # can be found again without depending on its place in the tree
+        self.node_ids = itertools.count(1)
+        self.nodes = {}
+        self.stashed = None  # previous document while loading another one
+        self.load_error = ""  # why the file given at the start wasn't read
         self.gui.init_gui()
         self.init_tree(et.Element(NEW_ROOT))
-        if self.xmlfn:
+        if fname:
             try:
-                tree, prefixes, uris = parse_nsmap(self.xmlfn)
+                self.load_xml(os.path.abspath(fname))
             except (IOError, et.ParseError) as err:
-                self.gui.meldfout(str(err), abort=True)
-                self.gui.init_tree(None)
+                self.load_error = str(err)
+                self.gui.meldfout(self.load_error, abort=True)
                 return  # None
-            else:
-                self.init_tree(tree.getroot(), prefixes, uris)
         self.gui.go()
 
     def mark_dirty(self, state):
@@ -204,6 +1106,8 @@ class Editor:
         If there is no selection or the file title is selected, display
         a message (if requested). Also return False in that case.
         """
+        if self.stashed is not None:  # still loading
+            return False
         sel = True
         self.item = self.gui.get_selected_item()  # self.tree.Selection
         if message and (self.item is None or self.item == self.top):
@@ -214,48 +1118,47 @@ class Editor:
         return sel
 
     def writexml(self, oldfile=""):
-        "(re)write tree to XML file; backup first"
-
-        def expandnode(rt, root, tree):
-            "recursively expand node"
-            for tag in self.gui.get_node_children(rt):
-                title = self.gui.get_node_title(tag)
-                data = self.gui.get_node_data(tag)
-                node = tree.expand(root, title, data)
-                if node is not None:
-                    expandnode(tag, node, tree)
+        """(re)write tree to XML file; the previous version becomes the backup
 
+        the document is written to a temporary file next to the original that
+        only takes its place when it's complete, so a failed save leaves the
+        original as it was. A file that was compressed stays that way, and one
+        with the extension of a compression is compressed when saved.
+        When the file is a symbolic link, the file it points to is replaced
+        """
         if oldfile == "":
             oldfile = self.xmlfn + ".bak"
-        if os.path.exists(self.xmlfn):
-            shutil.copyfile(self.xmlfn, oldfile)
-        rt = self.gui.get_treetop()
-        # text = self.gui.get_node_title(rt)
-        data = self.gui.get_node_data(rt)
-        tree = XMLTree(data[0])  # .split(None,1)
-        root = tree.root
-        expandnode(rt, root, tree)
-        namespace_data = None
-        if self.ns_prefixes:
-            namespace_data = (self.ns_prefixes, self.ns_uris)
-        tree.write(self.xmlfn, namespace_data)
+        target = os.path.realpath(self.xmlfn)
+        compression = get_compression(target, writing=True)
+        fd, tempname = tempfile.mkstemp(prefix=".~", suffix=".xml",
+                                        dir=os.path.dirname(target))
+        os.close(fd)
+        writer = XMLWriter(self)
+        try:
+            writer.write(tempname, compression, target)
+            if os.path.exists(target):
+                shutil.copymode(target, tempname)
+                make_backup(target, oldfile)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tempname, 0o666 & ~umask)
+            os.replace(tempname, target)
+        except BaseException:  # whatever went wrong, leave no temp file
+            if os.path.exists(tempname):
+                os.remove(tempname)
+            raise
+        sync_dir(os.path.dirname(target))
+        if compression is None:
+            self.layout = self.layout.moved(self.xmlfn, writer.copied,
+                                            writer.spans,
+                                            writer.element_spans)
+        else:  # nothing to copy from
+            self.layout = Layout(self.xmlfn)
         self.mark_dirty(False)
 
-    def init_tree(self, root, prefixes=None, uris=None, name=""):
-        "set up display tree"
-
-        def add_to_tree(el, rt):
-            "recursively add elements"
-            rr = self.add_item(rt, el.tag, el.text)
-            # log(calculate_location(self, rr))
-            for attr in el.keys():
-                h = el.get(attr)
-                if not h:
-                    h = '""'
-                self.add_item(rr, attr, h, attr=True)
-            for subel in list(el):
-                add_to_tree(subel, rr)
-
+    def setup_tree(self, name=""):
+        "set up an empty display tree"
         if name:
             titel = name
         elif self.xmlfn:
@@ -263,38 +1166,248 @@ class Editor:
         else:
             titel = "[unsaved file]"
         self.top = self.gui.setup_new_tree(titel)
-        self.rt = root
-        self.ns_prefixes = prefixes or []
-        self.ns_uris = uris or []
+        self.nodes = {}
+        self.register_node(self.top)
+        self.rt = None
+        self.namespaces = Namespaces()
+        self.pending = {}
+        self.layout = Layout(self.xmlfn)
+        self.search_index.clear()
+        self.lazy = False
+        if self.xmlfn and os.path.exists(self.xmlfn):
+            size = os.path.getsize(self.xmlfn)
+            if get_compression(self.xmlfn) is not None:
+                size *= COMPRESSION_RATIO
+            self.lazy = size > LAZY_LOAD_SIZE
         self.gui.set_windowtitle(" - ".join((os.path.basename(titel), TITEL)))
+
+    def finish_tree(self):
+        "final actions after the display tree has been built"
+        # self.tree.selection = self.top
+        # set_selection()
+        if self.lazy:
+            # only show what's been loaded, expanding fills the whole tree
+            self.gui.expand_item(self.top, levels=2)
+        else:
+            self.gui.expand_item(self.top)
+        self.mark_dirty(False)
+
+    def init_tree(self, root, prefixes=None, uris=None, name=""):
+        "set up display tree"
+        self.setup_tree(name)
         if root is None:  # explicit test needed, empty root element is falsey
             return
+        self.rt = root
         # eventuele namespaces toevoegen
-        namespaces = False
-        for ix, prf in enumerate(self.ns_prefixes):
-            if not namespaces:
-                ns_root = self.gui.add_node_to_parent(self.top)
-                self.gui.set_node_title(ns_root, "namespaces")
-                # ns_root = qtw.QTreeWidgetItem(['namespaces'])
-                namespaces = True
-            ns_item = self.gui.add_node_to_parent(ns_root)
-            self.gui.set_node_title(
-                ns_item,
-                "{}: {}".format(prf, self.ns_uris[ix])
-            )
-        rt = self.add_item(self.top, self.rt.tag, self.rt.text)
-        for attr in self.rt.keys():
-            h = self.rt.get(attr)
+        for ix, prf in enumerate(prefixes or []):
+            self.add_namespace(prf, uris[ix])
+        with self.gui.batch_update():
+            rt = self.add_item(self.top, self.rt.tag, self.rt.text,
+                               changed=False)
+            for attr in self.rt.keys():
+                h = self.rt.get(attr)
+                if not h:
+                    h = '""'
+                self.add_item(rt, attr, h, attr=True, changed=False)
+            for el in list(self.rt):
+                self.add_element(rt, el, lazy=self.lazy)
+        self.finish_tree()
+
+    def load_xml(self, fname):
+        """parse an XML file and build the display tree in the same pass
+
+        the screen is updated after each batch of parse events, so the first
+        part of the document is visible before the whole file has been read.
+        The document shown until then is put aside and comes back when the
+        file can't be read
+        """
+        self.start_loading(fname)
+        try:
+            for batch, done in parse_events(fname):
+                self.load_batch(batch)
+                self.gui.update_display()
+        except Exception:
+            self.cancel_loading()
+            raise
+        self.finish_loading()
+
+    def start_loading(self, fname):
+        """put the current document aside and set up an empty tree for a file
+        that's going to be parsed in the background
+        """
+        selected = self.gui.get_selected_item()
+        self.stashed = (self.xmlfn, self.top, self.rt, self.namespaces,
+                        getattr(self, "ns_root", None), self.pending,
+                        self.layout, self.lazy, self.tree_dirty,
+                        None if selected is None
+                        else self.gui.get_node_id(selected))
+        self.gui.stash_tree()
+        self.xmlfn = fname
+        self.setup_tree()
+        self.load_stack = [self.top]  # nodes for the elements being parsed
+        self.load_ended = None
+
+    def finish_loading(self):
+        "the file has been parsed completely: forget the previous document"
+        self.stashed = None
+        self.gui.drop_stashed_tree()
+        self.finish_tree()
+
+    def cancel_loading(self, message=""):
+        "throw away what has been loaded and show the previous document again"
+        (self.xmlfn, self.top, self.rt, self.namespaces, self.ns_root,
+         self.pending, self.layout, self.lazy, dirty,
+         selected) = self.stashed
+        self.stashed = None
+        self.top = self.gui.restore_tree()
+        # the nodes keep their ids, but they may be other objects now
+        self.nodes = {}
+        for node in self.walk_tree(self.top):
+            node_id = self.gui.get_node_id(node)
+            if node_id is not None:  # namespaces have none
+                self.nodes[node_id] = node
+        if selected in self.nodes:
+            self.gui.set_selected_item(self.nodes[selected])
+        self.search_index.clear()
+        titel = self.gui.get_node_title(self.top)
+        self.gui.set_windowtitle(" - ".join((os.path.basename(titel), TITEL)))
+        self.mark_dirty(dirty)
+        if message:
+            self.gui.meldfout(message)
+
+    def load_batch(self, batch):
+        "add the elements from a batch of parse events to the display tree"
+        with self.gui.batch_update():
+            for event, data in batch:
+                if event == "start-ns":
+                    self.add_namespace(*data)
+                elif event == "start":
+                    parent = self.load_stack[-1]
+                    if parent is None or (self.lazy
+                                          and len(self.load_stack) > 2):
+                        # below the first level: wait until it's expanded
+                        self.load_stack.append(None)
+                        continue
+                    if self.rt is None:  # only its name and text are kept
+                        self.rt = et.Element(data.tag)
+                    # the text is only known at the end event
+                    node = self.add_item(parent, data.tag, "", changed=False)
+                    for attr in data.keys():
+                        h = data.get(attr)
+                        if not h:
+                            h = '""'
+                        self.add_item(node, attr, h, attr=True,
+                                      changed=False)
+                    self.load_stack.append(node)
+                elif event == "span":
+                    node = self.load_ended
+                    if not self.layout.fname:
+                        continue
+                    if node is None:
+                        self.layout.element_spans[data[0]] = data[1:]
+                    else:
+                        self.layout.spans[self.gui.get_node_id(node)] = (
+                            data[1:])
+                elif event == "end":
+                    node = self.load_ended = self.load_stack.pop()
+                    if node is None:
+                        continue
+                    if data.text:
+                        self.gui.set_node_data(node, data.tag, data.text)
+                        self.gui.set_node_title(
+                            node, self.getshortname((data.tag, data.text)))
+                        self.search_index.update(node, data.tag, data.text)
+                    if len(self.load_stack) == 1:
+                        self.rt.text = data.text
+                    if self.lazy and len(self.load_stack) == 2 and len(data):
+                        self.pending[node] = data
+                        self.gui.set_node_expandable(node, True)
+                    else:
+                        # everything in it is in the visual tree now
+                        data.clear()
+
+    def add_namespace(self, prefix, uri):
+        "remember a namespace and show it in the display tree"
+        if not self.namespaces:
+            self.ns_root = self.gui.add_node_to_parent(self.top, 0)
+            self.gui.set_node_title(self.ns_root, "namespaces")
+        if self.namespaces.by_prefix.get(prefix, uri) != uri:
+            # the prefix means something else in another part of the file
+            self.layout.discard()
+        self.namespaces.add(prefix, uri)
+        ns_item = self.gui.add_node_to_parent(self.ns_root)
+        self.gui.set_node_title(ns_item, "{}: {}".format(prefix, uri))
+
+    def add_element(self, to_item, el, lazy=False):
+        """add an element with its attributes to the visual tree
+
+        With `lazy` the subelements are not added yet but remembered, so they
+        can be shown when the node is expanded for the first time
+        """
+        rr = self.add_item(to_item, el.tag, el.text, changed=False)
+        for attr in el.keys():
+            h = el.get(attr)
             if not h:
                 h = '""'
-            self.add_item(rt, attr, h, attr=True)
-        for el in list(self.rt):
-            add_to_tree(el, rt)
-        # self.tree.selection = self.top
-        # set_selection()
-        self.replaced = {}  # nodes that have been replaced while editing
-        self.gui.expand_item(self.top)
-        self.mark_dirty(False)
+            self.add_item(rr, attr, h, attr=True, changed=False)
+        span = self.layout.element_spans.pop(el, None)
+        if span is not None:
+            self.layout.spans[self.gui.get_node_id(rr)] = span
+        if lazy and len(el):
+            self.pending[rr] = el
+            self.gui.set_node_expandable(rr, True)
+        else:
+            for subel in list(el):
+                self.add_element(rr, subel)
+        return rr
+
+    def populate_node(self, node):
+        """add the subelements of a lazily loaded node to the visual tree
+
+        Called when the node is expanded, before walking through its
+        children and before adding something under it
+        """
+        el = self.pending.pop(node, None)
+        if el is None:
+            return
+        for subel in list(el):
+            self.add_element(node, subel, lazy=True)
+        self.gui.set_node_expandable(node, False)
+
+    def walk_tree(self, node):
+        """generate a node of the visual tree and everything below it in
+        document order
+
+        the tree is walked without recursion and only as far as asked for;
+        subtrees that aren't shown yet are left alone (see fill_subtree)
+        """
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(self.gui.get_node_children(node)))
+
+    def populate_tree(self, node):
+        "make sure the complete subtree of a node is in the visual tree"
+        for subnode in self.fill_subtree(node):
+            pass
+
+    def fill_subtree(self, node, levels=-1):
+        """add what's not shown yet of a subtree to the visual tree, for the
+        given number of levels (all of them when negative)
+
+        yields every node that has been filled; this is done without recursion
+        so the Gui can show something in between or stop halfway
+        """
+        todo = [(node, levels)]
+        while todo:
+            node, levels = todo.pop()
+            if levels == 0:
+                continue
+            self.populate_node(node)
+            yield node
+            todo.extend((subnode, levels - 1) for subnode in reversed(
+                self.gui.get_node_children(node)))
 
     def getshortname(self, data, attr=False):
         """build and return a name for this node"""
@@ -307,13 +1420,7 @@ class Editor:
         max = 60
         if len(text) > max:
             text = text[:max].lstrip() + "..."
-        if fullname.startswith("{"):
-            uri, localname = fullname[1:].split("}")
-            for i, ns_uri in enumerate(self.ns_uris):
-                if ns_uri == uri:
-                    prefix = self.ns_prefixes[i]
-                    break
-            fullname = ":".join((prefix, localname))
+        fullname = self.namespaces.shortname(fullname)
         strt = " ".join((ELSTART, fullname))
         if attr:
             return " = ".join((fullname, text))
@@ -322,8 +1429,11 @@ class Editor:
         return strt
 
     def add_item(self, to_item, name, value, before=False, below=True,
-                 attr=False):
-        """execute adding of item"""
+                 attr=False, changed=True):
+        """execute adding of item
+
+        `changed` is False for what's added to show what's been read
+        """
         log(
             "in add_item for {} value {} to {} before is {} below is {}"
             "".format(
@@ -334,26 +1444,148 @@ class Editor:
             value = ""
         itemtext = self.getshortname((name, value), attr)
         if below:
+            self.populate_node(to_item)
             add_under = to_item
             insert = -1
-            if not itemtext.startswith(ELSTART):
-                itemlist = self.gui.get_node_children(to_item)
-                for seq, subitem in enumerate(itemlist):
-                    if self.gui.get_node_title(subitem).startswith(ELSTART):
-                        break
-                if itemlist and seq < len(itemlist):
-                    insert = seq
         else:
             add_under, insert = self.gui.get_node_parentpos(to_item)
-            print("in base.add_item (not below), insert is", insert)
             if not before:
                 insert += 1
-            print("in base.add_item after correction, insert is", insert)
+        if attr:
+            # attributes go before the subelements: the number of attributes
+            # is the position to insert at
+            attrcount = self.get_attrcount(add_under)
+            if below:
+                insert = attrcount
         item = self.gui.add_node_to_parent(add_under, insert)
-        self.gui.set_node_title(item, itemtext)
         self.gui.set_node_data(item, name, value)
+        self.gui.set_node_title(item, itemtext)
+        self.register_node(item)
+        if attr:
+            self.gui.set_node_attrcount(add_under, attrcount + 1)
+        self.search_index.add(item, name, value, attr, add_under, insert)
+        if changed:
+            self.node_changed(add_under)
         return item
 
+    def copy_subtree(self, node):
+        """return a copy of a node and everything below it, apart from the
+        visual tree (see shared.Node)
+        """
+
+        def copy(node):
+            "copy a node without its children"
+            return Node(self.gui.get_node_title(node),
+                        *self.gui.get_node_data(node))
+
+        top = copy(node)
+        stack = [(node, top)]
+        while stack:
+            node, copied = stack.pop()
+            if copied.is_attr():
+                continue
+            self.populate_node(node)
+            subnodes = self.gui.get_node_children(node)
+            if subnodes:
+                copied.children = [copy(x) for x in subnodes]
+                stack.extend(zip(subnodes, copied.children))
+        return top
+
+    def paste_subtree(self, to_item, data, before=False, below=True):
+        """add a copied node and everything below it to the visual tree
+
+        returns the node that's been added for the top
+        """
+        with self.gui.batch_update():
+            top = self.add_item(to_item, data.name, data.value,
+                                before=before, below=below,
+                                attr=data.is_attr())
+            stack = [(top, data)]
+            while stack:
+                node, data = stack.pop()
+                for subdata in data.children:
+                    added = self.add_item(node, subdata.name, subdata.value,
+                                          attr=subdata.is_attr(),
+                                          changed=False)
+                    if subdata.children:
+                        stack.append((added, subdata))
+        return top
+
+    def register_node(self, node):
+        "give a node a new id and remember it by that id"
+        node_id = next(self.node_ids)
+        self.gui.set_node_id(node, node_id)
+        self.nodes[node_id] = node
+
+    def get_node(self, node_id):
+        """return the node with the given id
+
+        None if it's been forgotten or its place was taken by another node
+        """
+        node = self.nodes.get(node_id)
+        if node is None or self.gui.get_node_id(node) != node_id:
+            return None
+        return node
+
+    def forget_nodes(self, node):
+        """drop a node and everything below it from the ids, because it's
+        gone for good
+        """
+        for subnode in self.walk_tree(node):
+            self.nodes.pop(self.gui.get_node_id(subnode), None)
+
+    def get_attrcount(self, node):
+        """return the number of attributes of an element node
+
+        the count is kept on the node; it's only determined by looking at the
+        node's children when it's not known yet
+        """
+        count = self.gui.get_node_attrcount(node)
+        if count is None:
+            count = 0
+            for subnode in self.gui.get_node_children(node):
+                if self.gui.is_element(subnode):
+                    break
+                count += 1
+            self.gui.set_node_attrcount(node, count)
+        return count
+
+    def node_changed(self, node):
+        """a node or something below it has been changed: it can't be copied
+        from the file it was read from (see Layout), nor can the nodes above it
+        """
+        spans = self.layout.spans
+        while node is not None:
+            spans.pop(self.gui.get_node_id(node), None)
+            node = self.gui.get_node_parent(node)
+
+    def node_removed(self, node, parent):
+        """bookkeeping for a node that's taken out of the visual tree
+
+        to be called before the node is actually removed
+        """
+        self.node_changed(parent)
+        if not self.gui.is_element(node):
+            count = self.gui.get_node_attrcount(parent)
+            if count:
+                self.gui.set_node_attrcount(parent, count - 1)
+        self.search_index.remove(node)
+
+    def node_restored(self, node, parent, pos):
+        """bookkeeping for a node that's been put back in the visual tree
+        after it was taken out (see node_removed)
+        """
+        self.node_changed(parent)
+        if self.gui.is_element(node):
+            # read again with its attributes and everything below it
+            self.search_index.add_subtree(node, parent)
+            return
+        count = self.gui.get_node_attrcount(parent)
+        if count is not None:
+            self.gui.set_node_attrcount(parent, count + 1)
+        self.search_index.add(node, *self.gui.get_node_data(node), attr=True,
+                              parent=parent, pos=pos)
+
     def get_menu_data(self):
         """return menu structure for GUI (title, callback, hotkeys(s))
         """
@@ -368,6 +1600,7 @@ class Editor:
             (
                 ("&Expand All (sub)Levels", self.expand, "Ctrl++"),
                 ("&Collapse All (sub)Levels", self.collapse, "Ctrl+-"),
+                ("&Memory Report", self.memory_report, ""),
             ),
             (
                 ("Nothing to &Undo", self.undo, "Ctrl+Z"),
@@ -389,40 +1622,12 @@ class Editor:
                 ("Find &Last", self.search_last, "Shift+Ctrl+F"),
                 ("Find &Next", self.search_next, "F3"),
                 ("Find &Previous", self.search_prev, "Shift+F3"),
+                ("Find &All", self.search_all, "Alt+Ctrl+F"),
                 ("&Replace", self.replace, "Ctrl+H"),
+                ("Replace A&ll", self.replace_all, "Shift+Ctrl+H"),
             ),
         )
 
-    def flatten_tree(self, element):
-        """return the tree's structure as a flat list
-        probably nicer as a generator function
-        """
-        attr_list = []
-        # print('in flatten tree: node title',
-        #       self.gui.get_node_title(element))
-        # print('in flatten tree: node data',
-        #       self.gui.get_node_data(element))
-        try:
-            title, data = self.gui.get_node_data(element)
-        except TypeError:
-            title = data = ""
-        if not data:
-            data = ("", "")
-        elem_list = [(element, title, data, attr_list)]
-
-        subel_list = []
-        for subel in self.gui.get_node_children(element):
-            if self.gui.get_node_title(subel).startswith(ELSTART):
-                subel_list = self.flatten_tree(subel)
-                elem_list.extend(subel_list)
-            else:
-                # attr_list.append((subel, *self.gui.get_node_data(subel)))
-                x, y = self.gui.get_node_data(subel)
-                attr_list.append((subel, x, y))
-        # for item in elem_list:
-        #     print(item)
-        return elem_list
-
     def find_first(self, reverse=False):
         "start search after asking for options"
         # from_contextmenu = self.checkselection(message=False)
@@ -441,10 +1646,10 @@ class Editor:
 
     def find_next(self, reverse=False):
         "find (default is forward)"
-        found, is_attr = find_in_flattened_tree(self.flatten_tree(self.top),
-                                                self.search_args, reverse,
-                                                self._search_pos)
-        if found:
+        found, is_attr = self.search_index.find(self.search_args, reverse,
+                                                self._search_pos,
+                                                self.search_mode)
+        if found is not None:
             self.gui.set_selected_item(found)
             self._search_pos = (found, is_attr)
         else:
@@ -470,13 +1675,11 @@ class Editor:
         if skip_check or self.check_tree():
             ok, fname = self.gui.file_to_read()
             if ok:
-                try:
-                    tree, prefixes, uris = parse_nsmap(fname)
-                except et.ParseError as e:
-                    self.gui.meldfout(str(e))
-                else:
-                    self.xmlfn = fname
-                    self.init_tree(tree.getroot(), prefixes, uris)
+                self.start_loading(fname)
+                self.gui.load_in_background(parse_events(fname),
+                                            self.load_batch,
+                                            self.finish_loading,
+                                            self.cancel_loading)
 
     def savexml(self, event=None):
         "(re)save XML; ask for filename if unknown"
@@ -562,8 +1765,7 @@ class Editor:
             else:
                 self.gui.meldinfo("Pasting as first element below root")
                 below = True
-        if below and not self.gui.get_node_title(self.item
-                                                 ).startswith(ELSTART):
+        if below and not self.gui.is_element(self.item):
             self.gui.meldinfo("Can't paste below an attribute")
             return
         self.gui.paste(self.item, before=before, below=below)
@@ -572,7 +1774,7 @@ class Editor:
         """start dialog to add a new attribute to the element"""
         if not self.checkselection():
             return
-        if not self.gui.get_node_title(self.item).startswith(ELSTART):
+        if not self.gui.is_element(self.item):
             self.gui.meldfout("Can't add attribute to attribute")
             return
         self.gui.add_attribute(self.item)
@@ -593,8 +1795,7 @@ class Editor:
                 and not below):
             self.gui.meldinfo("Can't insert before or after the root")
             return
-        if below and not self.gui.get_node_title(self.item
-                                                 ).startswith(ELSTART):
+        if below and not self.gui.is_element(self.item):
             self.gui.meldfout("Can't insert below an attribute")
             return
         self.gui.insert(self.item, before=before, below=below)
@@ -615,8 +1816,42 @@ class Editor:
         "find backwards"
         self.find_next(reverse=True)
 
+    def search_all(self, event=None):
+        "find all matches at once and show them in a list"
+        if not self.gui.get_search_args():
+            return
+        hits = self.search_index.find_all(self.search_args, self.search_mode)
+        if not hits:
+            self.gui.meldinfo(_("Niks (meer) gevonden"))
+            return
+        results = []
+        for node, is_attr in hits:
+            text = self.gui.get_node_title(node)
+            if is_attr:
+                element = self.search_index.attr_parent[node]
+                name = self.search_index.entries[element][1]
+                text = " / ".join((self.getshortname((name, "")), text))
+            results.append((node, is_attr, text))
+        attr_count = sum(1 for x in hits if x[1])
+        title = "{} found: {} elements, {} attributes".format(
+            len(hits), len(hits) - attr_count, attr_count)
+        self.gui.show_search_results(title, results)
+
+    def check_search_args(self, search_args, mode):
+        "return a message if the search arguments can't be used, else nothing"
+        return check_search_args(search_args, mode,
+                                 self.namespaces.by_prefix)
+
+    def goto_search_result(self, node, is_attr):
+        "select a search result; find next/previous continues from there"
+        if not self.search_index.contains(node):
+            self.gui.meldinfo("This item is no longer in the tree")
+            return
+        self.gui.set_selected_item(node)
+        self._search_pos = (node, is_attr)
+
     @staticmethod
-    def get_search_text(ele, attr_name, attr_val, text):
+    def get_search_text(ele, attr_name, attr_val, text, mode="text"):
         "build text describing search arguments"
         attr = attr_name or attr_val
         out = ["search for"] if any((ele, attr, text)) else [""]
@@ -624,7 +1859,11 @@ class Editor:
         name_text = " a name"
         value_text = " a value"
         contain_text = "   containing `{}`"
-        if ele:
+        if mode == "regex":
+            contain_text = "   matching `{}`"
+        if ele and mode == "xpath":
+            ele_out = [" an element found by the path", "   `{}`".format(ele)]
+        elif ele:
             ele_out = [" an element" + has_text + name_text,
                        contain_text.format(ele)]
         if attr:
@@ -642,7 +1881,10 @@ class Editor:
                 attr_out[0] = " with" + attr_out[0]
         if text:
             out[0] += " text"
-            out.append("   `{}`".format(text))
+            if mode == "regex":
+                out.append(contain_text.format(text))
+            else:
+                out.append("   `{}`".format(text))
             if ele:
                 ele_out[0] = " under" + ele_out[0]
                 out += ele_out
@@ -660,8 +1902,107 @@ class Editor:
         return out
 
     def replace(self, event=None):
-        "replace an element?"
-        self.gui.meldinfo("Replace: not sure if I wanna implement this")
+        "replace in the selected item if it matches, otherwise in the next one"
+        if not self.gui.get_search_args(replace=True):
+            return
+        item = self.gui.get_selected_item()
+        found = None
+        if item is not None:
+            found = self.search_index.match(item, self.search_args,
+                                            self.search_mode)
+        if found is None:
+            pos = (item, False) if item is not None else None
+            found = self.search_index.find(self.search_args, False, pos,
+                                           self.search_mode)
+            if found[0] is None:
+                self.gui.meldinfo(_("Niks (meer) gevonden"))
+                return
+        self.do_replace([found], "Replace")
+        self.gui.set_selected_item(found[0])
+        self._search_pos = found
+
+    def replace_all(self, event=None):
+        "replace in all items that fulfill the search criteria in one go"
+        if not self.gui.get_search_args(replace=True):
+            return
+        hits = self.search_index.find_all(self.search_args, self.search_mode)
+        if not hits:
+            self.gui.meldinfo(_("Niks (meer) gevonden"))
+            return
+        count = self.do_replace(hits, "Replace All")
+        if count is not None:
+            self.gui.meldinfo("{} items changed".format(count))
+
+    def do_replace(self, hits, description):
+        """change the nodes that were found as a single (undoable) action
+
+        returns the number of changed nodes, or None when that failed
+        """
+        try:
+            changes = self.get_replacements(hits)
+        except re.error as err:
+            self.gui.meldfout("Invalid replacement: {}".format(err))
+            return None
+        if changes:
+            self.gui.replace_items(changes, description)
+            self.mark_dirty(True)
+        return len(changes)
+
+    def get_replacements(self, hits):
+        """work out what replacing does to the (node, is_attr) search results
+
+        returns (node, name, value, is_attr) tuples for the nodes that change
+        """
+        search_args = tuple(self.search_args)
+        sub_ele, sub_attr, sub_value, sub_text = compile_replace(
+            search_args, tuple(self.replace_args), self.search_mode)
+        tests = compile_search(search_args, self.search_mode)
+        index = self.search_index
+        changes = []
+
+        def replace_attr(node, name, value):
+            "replace in an attribute's name and value"
+            new_name = sub_attr(name) if sub_attr else name
+            new_value = sub_value(value) if sub_value else value
+            if (new_name, new_value) != (name, value):
+                changes.append((node, new_name, new_value, True))
+
+        for node, is_attr in hits:
+            if is_attr:
+                for attr in index.entries[index.attr_parent[node]][3]:
+                    if attr[0] == node:
+                        replace_attr(*attr)
+                continue
+            name, text, attrs = index.entries[node][1:]
+            new_name = sub_ele(name) if sub_ele else name
+            new_text = sub_text(text) if sub_text else text
+            if (new_name, new_text) != (name, text):
+                changes.append((node, new_name, new_text, False))
+            if not (sub_attr or sub_value):
+                continue
+            for attr, attr_name, value in attrs:
+                if ((not tests[1] or tests[1](attr_name))
+                        and (not tests[2] or tests[2](value))):
+                    replace_attr(attr, attr_name, value)
+        return changes
+
+    def memory_report(self, event=None):
+        """show how much memory is saved by storing the element and attribute
+        names only once
+
+        only the nodes that are in the visual tree are counted
+        """
+        uses = collections.Counter()
+        stack = [self.gui.get_treetop()]
+        while stack:
+            node = stack.pop()
+            uses[self.gui.get_node_data(node)[0]] += 1
+            stack.extend(self.gui.get_node_children(node))
+        text = self.symbols.report(uses)
+        if self.gui.cut_el:
+            text += "\n\nclipboard: {} nodes taking {} bytes".format(
+                len(list(self.gui.cut_el.walk())), self.gui.cut_el.sizeof())
+        self.gui.meldinfo(text)
 
     def about(self, event=None):
         "Credits"
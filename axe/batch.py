@@ -0,0 +1,138 @@
+"""XML-bestanden bewerken zonder scherm
+(edit XML files from the command line, without a GUI)
+
+uses the editor's own search, replace and insert logic on the headless
+version of the visual tree
+"""
+import argparse
+import sys
+from .base import Editor
+from .gui_headless import Gui
+from .shared import SEARCH_MODES
+
+REPLACE_OPTIONS = ("--replace-element", "--replace-attr-name",
+                   "--replace-attr-value", "--replace-text")
+SEARCH_OPTIONS = ("-e", "-a", "-v", "-t")
+
+
+def parse_args(args):
+    "define and read the command line"
+    parser = argparse.ArgumentParser(
+        prog="xmlbatch",
+        description="Find, replace, insert or delete in XML files. Without an"
+        " action the matches are listed.")
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    group = parser.add_argument_group("search criteria")
+    group.add_argument("-e", "--element", default="",
+                       help="element name (or path with -m xpath)")
+    group.add_argument("-a", "--attr-name", default="")
+    group.add_argument("-v", "--attr-value", default="")
+    group.add_argument("-t", "--text", default="")
+    group.add_argument("-m", "--mode", choices=SEARCH_MODES,
+                       default=SEARCH_MODES[0],
+                       help="how to read the criteria (default: %(default)s)")
+    group = parser.add_argument_group("actions")
+    group.add_argument("--replace-element", default="", metavar="NAME")
+    group.add_argument("--replace-attr-name", default="", metavar="NAME")
+    group.add_argument("--replace-attr-value", default=None, metavar="VALUE")
+    group.add_argument("--replace-text", default=None, metavar="TEXT")
+    group.add_argument("--insert", metavar="NAME[=TEXT]",
+                       help="add an element under every matching element")
+    group.add_argument("--add-attribute", metavar="NAME=VALUE",
+                       help="add an attribute to every matching element")
+    group.add_argument("--delete", action="store_true",
+                       help="remove the matching elements or attributes")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="don't save the changes")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only report the number of matches per file")
+    return parser.parse_args(args)
+
+
+def get_replace_args(options):
+    """return what to replace the found values with, or None when nothing is
+    to be replaced
+    """
+    replace_args = (options.replace_element, options.replace_attr_name,
+                    options.replace_attr_value, options.replace_text)
+    if not any(replace_args[:2]) and replace_args[2:] == (None, None):
+        return None
+    return replace_args
+
+
+def check_replace_args(search_args, replace_args):
+    """return a message if something is to be replaced that isn't searched
+    for, as only what's found is replaced; else nothing
+    """
+    for ix, new in enumerate(replace_args or ()):
+        # names are only replaced with something, values also with nothing
+        given = new is not None and (bool(new) or ix > 1)
+        if given and not search_args[ix]:
+            return "{} needs something to replace, given with {}".format(
+                REPLACE_OPTIONS[ix], SEARCH_OPTIONS[ix])
+    return ""
+
+
+def process_file(fname, options, search_args):
+    """do the requested action on one file
+
+    returns the number of matches, or None if the file couldn't be read
+    """
+    editor = Editor(fname, gui_class=Gui)
+    if editor.load_error:  # already reported
+        return None
+    message = editor.check_search_args(search_args, options.mode)
+    if message:
+        print("{}: {}".format(fname, message), file=sys.stderr)
+        return None
+    editor.search_args, editor.search_mode = search_args, options.mode
+    hits = editor.search_index.find_all(search_args, options.mode)
+    replace_args = get_replace_args(options)
+    if not options.quiet:
+        for node, is_attr in hits:
+            print("{}: {}".format(fname, editor.gui.get_node_title(node)))
+    if replace_args is not None:
+        editor.replace_args = replace_args
+        if editor.do_replace(hits, "Replace All") is None:
+            return None
+    elements = [node for node, is_attr in hits if not is_attr]
+    if options.add_attribute:
+        name, value = options.add_attribute.split("=", 1)
+        for node in elements:
+            editor.add_item(node, name, value, attr=True)
+    if options.insert:
+        name, _, text = options.insert.partition("=")
+        for node in elements:
+            editor.add_item(node, name, text)
+    if elements and (options.add_attribute or options.insert):
+        editor.mark_dirty(True)
+    if options.delete:
+        # last ones first, an attribute before the element it belongs to
+        for node, is_attr in reversed(hits):
+            if node != editor.gui.get_treetop():
+                editor.gui.copy(node, cut=True, retain=False)
+    if editor.tree_dirty and not options.dry_run:
+        editor.writexml()
+    return len(hits)
+
+
+def main(args=None):
+    "edit the files given on the command line; returns the exit status"
+    options = parse_args(sys.argv[1:] if args is None else args)
+    search_args = (options.element, options.attr_name, options.attr_value,
+                   options.text)
+    if not any(search_args):
+        print("Please give search criteria", file=sys.stderr)
+        return 2
+    message = check_replace_args(search_args, get_replace_args(options))
+    if message:
+        print(message, file=sys.stderr)
+        return 2
+    status = 0
+    for fname in options.files:
+        count = process_file(fname, options, search_args)
+        if count is None:
+            status = 1
+        elif options.quiet:
+            print("{}: {}".format(fname, count))
+    return status
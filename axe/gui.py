@@ -4,3 +4,5 @@ if toolkit == "qt":
     from .gui_qt import Gui
 elif toolkit == "wx":
     from .gui_wx import Gui
+elif toolkit == "headless":
+    from .gui_headless import Gui
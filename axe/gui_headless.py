@@ -0,0 +1,239 @@
+"""GUI-loze versie van de XML-editor
+(headless version of the XML editor)
+
+implements the methods that base.Editor calls on its Gui over plain Python
+objects, so documents can be edited from scripts without a display. Things
+that need a dialog (editing, inserting, undo) are not available; scripts use
+Editor.add_item, the search index and the copy/paste methods instead
+"""
+import contextlib
+import sys
+from . import shared
+
+
+class Gui:
+    """stand-in for a window, keeping the tree in memory
+
+    messages are written to stderr (errors) or collected in `messages`
+    """
+
+    def __init__(self, editor, fn=""):
+        self.editor = editor
+        self.messages = []
+        self.search_results = None
+        self.title = ""
+
+    def init_gui(self):
+        "nothing to set up"
+        self.top = None
+        self.stashed = None
+        self.selected = None
+        self.cut_el = self.cut_att = None
+
+    def go(self):
+        "there's no event loop to start"
+
+    def quit(self):
+        "nothing to close"
+
+    def get_node_children(self, node):
+        "return descendants of the given node"
+        return list(node.children)
+
+    def get_node_title(self, node):
+        "return the title of the given node"
+        return node.label(self.editor.getshortname)
+
+    def is_element(self, node):
+        "tell if the given node is an element (and not an attribute)"
+        return not node.is_attr()
+
+    def get_node_data(self, node):
+        "return element name and text/CDATA associated with the given node"
+        return node.name, node.value
+
+    def get_treetop(self):
+        "return the visual tree's root element"
+        for node in self.top.children:
+            if node.title != "namespaces":
+                return node
+        return None
+
+    def setup_new_tree(self, title):
+        "build new visual tree and return its root element"
+        self.top = shared.TreeNode()
+        self.top.title = title
+        self.selected = None
+        return self.top
+
+    def add_node_to_parent(self, parent, pos=-1):
+        "add a new node to the tree and return it"
+        node = shared.TreeNode()
+        parent.insert(pos, node)
+        return node
+
+    def set_node_title(self, node, title):
+        "set the title of the given node"
+        node.set_title(title)
+
+    def get_node_parent(self, node):
+        "return the parent of the given node, None for the top"
+        return node.parent
+
+    def get_node_parentpos(self, node):
+        "return the parent of the given node and its position under it"
+        return node.parent, node.parent.children.index(node)
+
+    def set_node_data(self, node, name, value):
+        "set the name and value of the given node, sharing the name"
+        node.name = self.editor.symbols.intern(name)
+        node.value = value
+
+    def set_node_expandable(self, node, value):
+        "remember if a node has children that haven't been added yet"
+        node.expandable = value
+
+    def get_node_attrcount(self, node):
+        "return the number of attributes of a node, None if not known"
+        return node.attrcount
+
+    def set_node_attrcount(self, node, count):
+        "remember the number of attributes of a node"
+        node.attrcount = count
+
+    def get_node_id(self, node):
+        "return the id the editor gave a node"
+        return node.node_id
+
+    def set_node_id(self, node, node_id):
+        "remember the id the editor gave a node"
+        node.node_id = node_id
+
+    def get_selected_item(self):
+        "return the currently selected item"
+        return self.selected
+
+    def set_selected_item(self, item):
+        "set the currently selected item to the given item"
+        self.selected = item
+
+    def expand_item(self, item=None, levels=-1):
+        "nothing to show; only make sure the nodes are there if asked for all"
+        if levels < 0:
+            self.editor.populate_tree(item or self.top)
+
+    def collapse_item(self, item=None):
+        "nothing to hide"
+
+    def set_windowtitle(self, text):
+        "remember the title"
+        self.title = text
+
+    def get_windowtitle(self):
+        "return the title"
+        return self.title
+
+    def update_display(self):
+        "nothing to update"
+
+    @contextlib.contextmanager
+    def batch_update(self):
+        "nothing to repaint afterwards"
+        yield
+
+    def stash_tree(self):
+        "put the current tree aside so it can be put back later"
+        self.stashed = self.top
+
+    def drop_stashed_tree(self):
+        "forget the tree that was put aside"
+        self.stashed = None
+
+    def restore_tree(self):
+        "put the tree that was put aside back and return its top"
+        self.top, self.stashed = self.stashed, None
+        return self.top
+
+    def load_in_background(self, events, on_batch, on_done, on_cancel):
+        "without an event loop there's no background: just parse the file"
+        try:
+            for batch, done in events:
+                on_batch(batch)
+        except (IOError, SyntaxError) as err:
+            on_cancel(str(err))
+            return
+        except Exception as err:  # anything else also means it's not loaded
+            on_cancel("{}: {}".format(type(err).__name__, err))
+            return
+        on_done()
+
+    def meldinfo(self, text):
+        "remember some information"
+        self.messages.append(text)
+
+    def meldfout(self, text, abort=False):
+        "report an error"
+        print(text, file=sys.stderr)
+
+    def ask_yesnocancel(self, prompt):
+        "nobody to ask: don't save, but go on"
+        return 0
+
+    def ask_for_text(self, prompt, value=""):
+        "nobody to ask: take the suggested value"
+        return value
+
+    def file_to_read(self):
+        "nobody to ask"
+        return False, ""
+
+    def file_to_save(self):
+        "nobody to ask"
+        return False, ""
+
+    def get_search_args(self, replace=False):
+        "the search arguments have to be set on the editor beforehand"
+        return bool(self.editor.search_args)
+
+    def show_search_results(self, title, results):
+        "remember the results of a search"
+        self.search_results = title, results
+
+    def replace_items(self, changes, description):
+        """give the nodes new names and values
+
+        `changes` are (node, name, value, is_attr) tuples
+        """
+        for node, name, value, is_attr in changes:
+            self.set_node_data(node, name, value)
+            node.set_title(self.editor.getshortname((name, value),
+                                                    attr=is_attr))
+            self.editor.search_index.update(node, name, value)
+            self.editor.node_changed(node)
+
+    def enable_pasteitems(self, active=False):
+        "no menu to change"
+
+    def copy(self, item, cut=False, retain=True):
+        """execute cut/delete/copy action"""
+        if retain:
+            if item.is_attr():
+                self.cut_el = None
+                self.cut_att = item.name, item.value
+            else:
+                self.cut_el = self.editor.copy_subtree(item)
+                self.cut_att = None
+        if cut:
+            self.editor.node_removed(item, item.parent)
+            self.editor.forget_nodes(item)
+            item.parent.children.remove(item)
+            self.editor.mark_dirty(True)
+
+    def paste(self, item, before=True, below=False):
+        """execute paste action"""
+        if self.cut_att:
+            self.editor.add_item(item, *self.cut_att, before=before,
+                                 below=below, attr=True)
+        else:
+            self.editor.paste_subtree(item, self.cut_el, before, below)
+        self.editor.mark_dirty(True)
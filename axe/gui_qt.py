@@ -1,6 +1,7 @@
 """PyQT5 versie van een op een treeview gebaseerde XML-editor
 """
 
+import contextlib
 import os
 import sys
 
@@ -8,28 +9,167 @@ import sys
 import PyQt5.QtWidgets as qtw  # noqa N813
 import PyQt5.QtGui as gui  # noqa N813
 import PyQt5.QtCore as core  # noqa N813
-from .shared import ELSTART, axe_iconame, log
+from .shared import (ELSTART, EXPAND_BATCH, SEARCH_MODES, SEARCH_MODE_TEXTS,
+                     UNDO_BUDGET, TreeNode, axe_iconame, log)
 
 if os.name == "nt":
-    HMASK = "XML files (*.xml);;All files (*.*)"
+    HMASK = ("XML files (*.xml);;"
+             "Compressed XML files (*.xml.gz *.xml.bz2 *.xml.xz);;"
+             "All files (*.*)")
 elif os.name == "posix":
-    HMASK = "XML files (*.xml *.XML);;All files (*.*)"
+    HMASK = ("XML files (*.xml *.XML);;"
+             "Compressed XML files (*.xml.gz *.xml.bz2 *.xml.xz);;"
+             "All files (*.*)")
 IMASK = "All files (*.*)"
+ITEM_SIZE = 200  # rough number of bytes taken by a tree node with its texts
 
 
-def calculate_location(win, node):
-    """attempt to calculate some kind of identification for a tree node
+class TreeModel(core.QAbstractItemModel):
+    """the visual tree, shown by a QTreeView
 
-    Returns:
-        tuple: subsequent indices of a child under its parent, which
-            possibly can be used in the replacements dictionary
+    the nodes are compact Python objects (see shared.TreeNode) instead of
+    QTreeWidgetItems with the names and texts copied into their columns. The
+    subelements of a node that hasn't been expanded yet are still elements in
+    the ElementTree; they only become nodes when the view asks for them
+    (fetchMore). Every change to the tree goes through the model; the view is
+    only told about the ones under nodes it has asked about, so building a
+    subtree it hasn't seen yet doesn't cost a signal for every node
     """
-    id_ = []
-    while node != win.top:
-        idx = node.parent().indexOfChild(node)
-        id_.insert(0, idx)
-        node = node.parent()
-    return tuple(id_)
+
+    def __init__(self, populate, title, parent=None):
+        super().__init__(parent)
+        self.populate = populate  # adds the children of a lazily loaded node
+        self.title = title  # makes the text shown for a node
+        self.top = None
+        # the position of every child under its parent, determined when it's
+        # first needed and forgotten when something's inserted in between
+        self.positions = {}
+        self.seen = set()  # the nodes whose children the view knows about
+
+    def set_top(self, top):
+        "show another tree"
+        self.beginResetModel()
+        self.top = top
+        self.positions = {}
+        self.seen = set()
+        self.endResetModel()
+
+    def get_node(self, index):
+        "return the node behind a model index, None for an invalid one"
+        if index.isValid():
+            return index.internalPointer()
+        return None
+
+    def row_of(self, node):
+        "return the position of a node under its parent"
+        parent = node.parent
+        if parent is None:
+            return 0
+        positions = self.positions.get(parent)
+        if positions is None:
+            positions = self.positions[parent] = {
+                child: row for row, child in enumerate(parent.children)}
+        return positions[node]
+
+    def index_for(self, node):
+        "return the model index of a node"
+        if node is None:
+            return core.QModelIndex()
+        return self.createIndex(self.row_of(node), 0, node)
+
+    def index(self, row, column, parent=core.QModelIndex()):
+        "reimplemented: create an index for a row under the given parent"
+        if column != 0 or row < 0:
+            return core.QModelIndex()
+        if parent.isValid():
+            children = parent.internalPointer().children
+            if row >= len(children):
+                return core.QModelIndex()
+            return self.createIndex(row, 0, children[row])
+        if row > 0 or self.top is None:
+            return core.QModelIndex()
+        return self.createIndex(0, 0, self.top)
+
+    def parent(self, index=None):
+        "reimplemented: create an index for the parent of the given index"
+        if index is None:  # QObject.parent()
+            return super().parent()
+        if not index.isValid():
+            return core.QModelIndex()
+        return self.index_for(index.internalPointer().parent)
+
+    def rowCount(self, parent=core.QModelIndex()):
+        "reimplemented: number of children of the given node"
+        if not parent.isValid():
+            return 0 if self.top is None else 1
+        if parent.column() > 0:
+            return 0
+        node = parent.internalPointer()
+        self.seen.add(node)
+        return len(node.children)
+
+    def columnCount(self, parent=core.QModelIndex()):
+        "reimplemented: there's only one column"
+        return 1
+
+    def hasChildren(self, parent=core.QModelIndex()):
+        "reimplemented: a node whose children aren't added yet has them too"
+        if not parent.isValid():
+            return self.top is not None
+        node = parent.internalPointer()
+        self.seen.add(node)
+        return node.expandable or bool(node.children)
+
+    def canFetchMore(self, parent):
+        "reimplemented: are there children that aren't added yet?"
+        node = self.get_node(parent)
+        return node is not None and node.expandable
+
+    def fetchMore(self, parent):
+        "reimplemented: add the children that aren't there yet"
+        self.populate(parent.internalPointer())
+
+    def data(self, index, role=core.Qt.DisplayRole):
+        "reimplemented: the node's title is what's shown"
+        if index.isValid() and role == core.Qt.DisplayRole:
+            return self.title(index.internalPointer())
+        return None
+
+    def insert_node(self, parent, pos, node):
+        "add a node under a parent at the given position (-1: at the end)"
+        row = len(parent.children) if pos == -1 else pos
+        notify = parent in self.seen
+        if notify:
+            self.beginInsertRows(self.index_for(parent), row, row)
+        parent.insert(row, node)
+        positions = self.positions.get(parent)
+        if positions is not None:
+            if row == len(parent.children) - 1:
+                positions[node] = row
+            else:
+                del self.positions[parent]
+        if notify:
+            self.endInsertRows()
+
+    def remove_node(self, parent, row):
+        "take the node at the given position out from under its parent"
+        notify = parent in self.seen
+        if notify:
+            self.beginRemoveRows(self.index_for(parent), row, row)
+        node = parent.children.pop(row)
+        self.positions.pop(parent, None)
+        for subnode in node.walk():
+            self.seen.discard(subnode)
+            self.positions.pop(subnode, None)
+        if notify:
+            self.endRemoveRows()
+        return node
+
+    def node_changed(self, node):
+        "let the view know that a node's title (or expandability) changed"
+        if node.parent is None or node.parent in self.seen:
+            index = self.index_for(node)
+            self.dataChanged.emit(index, index)
 
 
 # Dialog windows
@@ -48,7 +188,7 @@ class ElementDialog(qtw.QDialog):
         self.cmb_ns = qtw.QComboBox(self)
         self.cmb_ns.setEditable(False)
         self.cmb_ns.addItem("-- none --")
-        self.cmb_ns.addItems(self._parent.editor.ns_uris)
+        self.cmb_ns.addItems(self._parent.editor.namespaces.uris)
 
         self.cb = qtw.QCheckBox("Bevat data:", self)
         self.cb.setCheckable(False)
@@ -72,9 +212,9 @@ class ElementDialog(qtw.QDialog):
                 txt = item["text"]
             if ns_uri:
                 self.cb_ns.toggle()
-                for ix, uri in enumerate(self._parent.ns_uris):
-                    if uri == ns_uri:
-                        self.cmb_ns.setCurrentIndex(ix + 1)
+                uris = self._parent.editor.namespaces.uris
+                if ns_uri in uris:
+                    self.cmb_ns.setCurrentIndex(uris.index(ns_uri) + 1)
         self.txt_tag.setText(tag)
         self.txt_data.setText(txt)
 
@@ -160,7 +300,7 @@ class AttributeDialog(qtw.QDialog):
         self.cmb_ns = qtw.QComboBox(self)
         self.cmb_ns.setEditable(False)
         self.cmb_ns.addItem("-- none --")
-        self.cmb_ns.addItems(self._parent.editor.ns_uris)
+        self.cmb_ns.addItems(self._parent.editor.namespaces.uris)
 
         lbl_value = qtw.QLabel("Attribute value:", self)
         self.txt_value = qtw.QLineEdit(self)
@@ -179,9 +319,9 @@ class AttributeDialog(qtw.QDialog):
                 nam = ns_nam
             if ns_uri:
                 self.cb_ns.toggle()
-                for ix, uri in enumerate(self._parent.ns_uris):
-                    if uri == ns_uri:
-                        self.cmb_ns.setCurrentIndex(ix + 1)
+                uris = self._parent.editor.namespaces.uris
+                if ns_uri in uris:
+                    self.cmb_ns.setCurrentIndex(uris.index(ns_uri) + 1)
             val = item["value"]
         self.txt_name.setText(nam)
         self.txt_value.setText(val)
@@ -254,10 +394,11 @@ class AttributeDialog(qtw.QDialog):
 class SearchDialog(qtw.QDialog):
     """Dialog to get search arguments"""
 
-    def __init__(self, parent, title=""):
+    def __init__(self, parent, title="", replace=False):
         super().__init__(parent)
         self.setWindowTitle(title)
         self._parent = parent
+        self.replace = replace
         if self._parent.editor.search_args:
             ele_name, attr_name, attr_val, text_val = \
                 self._parent.editor.search_args
@@ -307,6 +448,28 @@ class SearchDialog(qtw.QDialog):
         self.txt_text = qtw.QLineEdit(self)
         hsizer.addWidget(self.txt_text)
         gsizer.addLayout(hsizer, 3, 1)
+
+        gsizer.addWidget(qtw.QLabel("Search as", self), 4, 0)
+        self.cmb_mode = qtw.QComboBox(self)
+        self.cmb_mode.setEditable(False)
+        self.cmb_mode.addItems(SEARCH_MODE_TEXTS)
+        self.cmb_mode.setCurrentIndex(
+            SEARCH_MODES.index(self._parent.editor.search_mode))
+        gsizer.addWidget(self.cmb_mode, 4, 1)
+        if self.replace:
+            # an empty field leaves what's found alone unless it's asked to
+            # be removed; names are only replaced with something
+            self.txt_replace = []
+            for row, value in enumerate(self._parent.editor.replace_args):
+                hsizer = qtw.QHBoxLayout()
+                hsizer.addWidget(qtw.QLabel("replace with:", self))
+                text = qtw.QLineEdit(value or "", self)
+                hsizer.addWidget(text)
+                gsizer.addLayout(hsizer, row, 2)
+                self.txt_replace.append(text)
+            self.cb_remove = qtw.QCheckBox(
+                "remove the value or text found where left empty", self)
+            gsizer.addWidget(self.cb_remove, 4, 2)
         sizer.addLayout(gsizer)
 
         hsizer = qtw.QHBoxLayout()
@@ -341,6 +504,7 @@ class SearchDialog(qtw.QDialog):
         self.txt_attr_val.setText(attr_val)
         self.txt_text.textChanged.connect(self.set_search)
         self.txt_text.setText(text_val)
+        self.cmb_mode.currentIndexChanged.connect(self.set_search)
 
     def set_search(self):
         """build text describing search action"""
@@ -349,8 +513,9 @@ class SearchDialog(qtw.QDialog):
         attr_name = self.txt_attr_name.text()
         attr_val = self.txt_attr_val.text()
         text = self.txt_text.text()
+        mode = SEARCH_MODES[self.cmb_mode.currentIndex()]
         out = self._parent.editor.get_search_text(ele, attr_name, attr_val,
-                                                  text)
+                                                  text, mode)
         self.lbl_search.setText("\n".join(out))
         # self.layout()
 
@@ -380,25 +545,44 @@ class SearchDialog(qtw.QDialog):
             )
             self.txt_element.setFocus()
             return
+        mode = SEARCH_MODES[self.cmb_mode.currentIndex()]
+        search_args = (ele, attr_name, attr_val, text)
+        message = self._parent.editor.check_search_args(search_args, mode)
+        if message:
+            self._parent.meldfout(message)
+            self.txt_element.setFocus()
+            return
 
         self._parent.in_dialog = True
-        self._parent.editor.search_args = (ele, attr_name, attr_val, text)
+        self._parent.editor.search_args = search_args
+        self._parent.editor.search_mode = mode
+        if self.replace:
+            empty = "" if self.cb_remove.isChecked() else None
+            self._parent.editor.replace_args = tuple(
+                str(x.text()) or empty for x in self.txt_replace)
         super().accept()
 
     # def on_cancel(self):
     #     super().done(qtw.QDialog.Rejected)
 
 
-class VisualTree(qtw.QTreeWidget):
-    """Tree widget subclass overriding some event handlers"""
+class VisualTree(qtw.QTreeView):
+    """Tree view subclass overriding some event handlers"""
 
     def __init__(self, parent):
         self.parent = parent
         super().__init__()
 
+    def node_at(self, pos):
+        "return the node shown at a position, None if there's nothing there"
+        return self.model().get_node(self.indexAt(pos))
+
     def mouseDoubleClickEvent(self, event):
         "reimplemented to reject when on root element"
-        item = self.itemAt(event.x(), event.y())
+        item = self.node_at(event.pos())
+        edit = False
+        if self.parent.loader is not None:  # no editing while loading
+            item = None
         if item:
             if item == self.parent.top:
                 edit = False
@@ -416,7 +600,7 @@ class VisualTree(qtw.QTreeWidget):
     def mouseReleaseEvent(self, event):
         "reimplemented to show popup menu when applicable"
         xc, yc = event.x(), event.y()
-        item = self.itemAt(xc, yc)
+        item = self.node_at(event.pos())
         if event.button() == core.Qt.RightButton:
             if item and item != self.parent.top:
                 # self.parent.setCurrentItem(item)
@@ -429,29 +613,89 @@ class VisualTree(qtw.QTreeWidget):
 
 
 class UndoRedoStack(qtw.QUndoStack):
-    """Undo stack subclass overriding some event handlers"""
+    """Undo stack subclass overriding some event handlers
+
+    The number of steps is not limited, but the memory the commands take is:
+    when it gets over UNDO_BUDGET the oldest commands are released. They stay
+    on the stack, but undo doesn't go back that far anymore.
+    """
 
     def __init__(self, parent):
         super().__init__(parent)
         self.cleanChanged.connect(self.clean_changed)
         self.indexChanged.connect(self.index_changed)
-        self.maxundo = self.undoLimit()
-        self.setUndoLimit(1)  # self.unset_undo_limit(False)
-        # log('Undo limit {}'.format(self.undoLimit()))
+        self.limited = False
+        self.floor = 0  # commands before this one have been released
+        self.sizes = []  # what each command was last counted for
+        self.total = 0  # the sum of those
         win = self.parent()
         win.undo_item.setText("Nothing to undo")
         win.redo_item.setText("Nothing to redo")
         win.undo_item.setDisabled(True)
         win.redo_item.setDisabled(True)
 
+    def push(self, command):
+        "reimplemented: keep the history within its memory budget"
+        pos = self.index()
+        for ix in range(pos, self.count()):  # these can't be redone anymore
+            self.command(ix).release()
+        self.total -= sum(self.sizes[pos:])
+        del self.sizes[pos:]
+        super().push(command)
+        self.recount(pos)
+        self.check_budget()
+
+    def undo(self):
+        "reimplemented: don't go back to commands that have been released"
+        if self.index() > self.floor:
+            super().undo()
+            self.recount(self.index())
+
+    def redo(self):
+        "reimplemented: count what the command keeps after redoing it"
+        if self.index() < self.count():
+            super().redo()
+            self.recount(self.index() - 1)
+
+    def clear(self):
+        "reimplemented: no released commands either"
+        super().clear()
+        self.floor = 0
+        self.sizes = []
+        self.total = 0
+
+    def recount(self, pos):
+        "update the total for a command that's been done or undone"
+        size = self.command(pos).size()
+        if pos == len(self.sizes):
+            self.sizes.append(0)
+        self.total += size - self.sizes[pos]
+        self.sizes[pos] = size
+
+    def check_budget(self):
+        """release the oldest commands while the history takes too much memory
+        (or while there's more than one, when undo is limited)
+        """
+        floor, last = self.floor, self.index() - 1
+        while floor < last and (self.limited or self.total > UNDO_BUDGET):
+            self.command(floor).release()
+            self.total -= self.sizes[floor]
+            self.sizes[floor] = 0
+            floor += 1
+        if floor != self.floor:
+            log("undo history starts at {} ({} bytes)".format(floor,
+                                                              self.total))
+            self.floor = floor
+            self.index_changed()
+
     def unset_undo_limit(self, state):
         """change undo limit"""
         log("state is {}".format(state))
+        self.limited = not state
         if state:
-            self.setUndoLimit(self.maxundo)
             nolim, yeslim = "un", ""
         else:
-            self.setUndoLimit(1)
+            self.check_budget()
             nolim, yeslim = "", " to one"
         # self.parent().setundo_action.setChecked(state)
         self.parent().statusbar.showMessage(
@@ -472,7 +716,7 @@ class UndoRedoStack(qtw.QUndoStack):
         """change text of undo/redo menuitems according to stack change"""
         # print('undo stack index changed:', num)
         win = self.parent()
-        test = self.undoText()
+        test = self.undoText() if self.index() > self.floor else ""
         if test:
             win.undo_item.setText("&Undo " + test)
             win.undo_item.setEnabled(True)
@@ -488,6 +732,33 @@ class UndoRedoStack(qtw.QUndoStack):
             win.redo_item.setDisabled(True)
 
 
+class LoadThread(core.QThread):
+    """Thread subclass that parses a file while the GUI stays responsive
+
+    the parse results are passed to the GUI thread in batches through the
+    batch_ready signal
+    """
+    batch_ready = core.pyqtSignal(object, int)
+    load_failed = core.pyqtSignal(str)
+
+    def __init__(self, parent, events):
+        super().__init__(parent)
+        self.events = events
+        self.cancelled = False
+
+    def run(self):
+        "reimplemented: walk through the parse events"
+        try:
+            for batch, done in self.events:
+                if self.cancelled:
+                    break
+                self.batch_ready.emit(batch, done)
+        except (IOError, SyntaxError) as err:  # ParseError is a SyntaxError
+            self.load_failed.emit(str(err))
+        except Exception as err:  # anything else also means it's not loaded
+            self.load_failed.emit("{}: {}".format(type(err).__name__, err))
+
+
 # UndoCommand subclasses
 class PasteElementCommand(qtw.QUndoCommand):
     """subclass to make Undo/Redo possible"""
@@ -502,9 +773,10 @@ class PasteElementCommand(qtw.QUndoCommand):
             before (bool): switch
             below (bool): switch
             description (str): description of action
-            where (QWidget ??, optional): "where we are," optional
-                because it can be determined from the current position
-                but it should also be possible to provide it.
+            data (shared.Node, optional): copied element to add, including
+                everything below it
+            where (shared.TreeNode): "where we are"; the command
+                remembers it by its id
         """
         self.win = win  # treewidget
         self.tag = tag  # element name
@@ -512,8 +784,9 @@ class PasteElementCommand(qtw.QUndoCommand):
         self.before = before  # switch
         self.below = below  # switch
         self.children = data
-        self.where = where
-        self.replaced = None  # in case item is replaced while redoing
+        self.where_id = win.get_node_id(where)
+        self.added_id = None
+        self.removed = None  # the command that took the item out on undo
         if below:
             description += " Under"
         elif before:
@@ -527,55 +800,56 @@ class PasteElementCommand(qtw.QUndoCommand):
 
     def redo(self):
         "((Re)Do add element"
-
-        def zetzeronder(node, data, before=False, below=True):
-            "add elements recursively"
-            log("zetzeronder voor node {} met data {}".format(node, data))
-            text, data, children = data
-            tag, value = data
-            is_attr = False if text.startswith(ELSTART) else True
-            add_under = self.win.editor.add_item(
-                node, tag, value, before=before, below=below, attr=is_attr
-            )
-            below = True
-            for item in children:
-                zetzeronder(add_under, item)
-            return add_under
-
         print("redo of add")
         print("    tag is", self.tag)
         print("    data is", self.data)
         print("    before is", self.before)
         print("    below is", self.below)
-        print("    where is", self.where)
+        print("    where is", self.where_id)
         log("In paste element redo for tag {} data {}"
             "".format(self.tag, self.data))
-        self.added = self.win.editor.add_item(self.where, self.tag, self.data,
-                                              before=self.before,
-                                              below=self.below)
-        log("newly added {} with children {}"
-            "".format(self.added, self.children))
-        if self.children is not None:
-            for item in self.children[0][2]:
-                zetzeronder(self.added, item)
-        # if self.replaced:
-        #     self.win.replaced[calculate_location(add_under)] = self.added
-        self.win.tree.expandItem(self.added)
-        log("self.added after adding children: {}".format(self.added))
+        if self.removed is not None:
+            # redo after undo: put back the very item that was taken out
+            self.removed.reattach()
+            self.removed = None
+            added = self.win.editor.get_node(self.added_id)
+        else:
+            where = self.win.editor.get_node(self.where_id)
+            if self.children is None:
+                added = self.win.editor.add_item(
+                    where, self.tag, self.data, before=self.before,
+                    below=self.below)
+            else:
+                added = self.win.editor.paste_subtree(
+                    where, self.children, before=self.before,
+                    below=self.below)
+            self.added_id = self.win.get_node_id(added)
+        log("newly added {}".format(self.added_id))
+        self.win.tree.expand(self.win.model.index_for(added))
 
     def undo(self):
         "Undo add element"
         # essentially 'cut' Command
-        log("In paste element undo for added: {}".format(self.added))
-        self.replaced = self.added  # remember original in case redo replaces
-        item = CopyElementCommand(
-            self.win, self.added, cut=True, retain=False, description=__doc__
+        log("In paste element undo for added: {}".format(self.added_id))
+        self.removed = CopyElementCommand(
+            self.win, self.win.editor.get_node(self.added_id), cut=True,
+            retain=False, description=__doc__
         )
-        item.redo()
+        self.removed.redo()
         if self.first_edit:
             self.win.editor.mark_dirty(False)
         self.win.statusbar.showMessage("{} undone".format(self.text()))
 
+    def size(self):
+        "estimate the memory kept by this command"
+        return ITEM_SIZE if self.removed is None else self.removed.size()
+
+    def release(self):
+        "drop what's only needed to undo or redo"
+        if self.removed is not None:  # what was added is gone for good
+            self.removed.release()
+        self.removed = self.children = None
+
 
 class PasteAttributeCommand(qtw.QUndoCommand):
     """subclass to make Undo/Redo possible"""
@@ -583,74 +857,156 @@ class PasteAttributeCommand(qtw.QUndoCommand):
     def __init__(self, win, name, value, item, description=""):
         super().__init__(description)
         self.win = win  # treewidget
-        self.item = item  # where we are now
+        self.item_id = win.get_node_id(item)  # where we are now
+        self.added_id = None
         self.name = name  # attribute name
         self.value = value  # attribute value
+        self.removed = None  # the command that took the item out on undo
         log("init {} {} {} {}"
-            "".format(description, self.name, self.value, self.item))
+            "".format(description, self.name, self.value, self.item_id))
         self.first_edit = not self.win.editor.tree_dirty
         super().__init__(description)
 
     def redo(self):
         "(Re)Do add attribute"
         log("(redo) add attr {} {} {}"
-            "".format(self.name, self.value, self.item))
-        self.added = self.win.editor.add_item(
-            self.item, self.name, self.value, attr=True
-        )
-        self.win.tree.expandItem(self.added.parent())
-        log("Added {}".format(self.added))
+            "".format(self.name, self.value, self.item_id))
+        if self.removed is not None:
+            # redo after undo: put back the very item that was taken out
+            self.removed.reattach()
+            self.removed = None
+            added = self.win.editor.get_node(self.added_id)
+        else:
+            added = self.win.editor.add_item(
+                self.win.editor.get_node(self.item_id), self.name, self.value,
+                attr=True
+            )
+            self.added_id = self.win.get_node_id(added)
+        self.win.tree.expand(self.win.model.index_for(added.parent))
+        log("Added {}".format(self.added_id))
 
     def undo(self):
         "Undo add attribute"
         # essentially 'cut' Command
-        item = CopyElementCommand(
-            self.win, self.added, cut=True, retain=False, description=__doc__
+        self.removed = CopyElementCommand(
+            self.win, self.win.editor.get_node(self.added_id), cut=True,
+            retain=False, description=__doc__
         )
-        item.redo()
+        self.removed.redo()
         if self.first_edit:
             self.win.editor.mark_dirty(False)
         self.win.statusbar.showMessage("{} undone".format(self.text()))
 
+    def size(self):
+        "estimate the memory kept by this command"
+        return ITEM_SIZE if self.removed is None else self.removed.size()
+
+    def release(self):
+        "drop what's only needed to undo or redo"
+        if self.removed is not None:  # what was added is gone for good
+            self.removed.release()
+        self.removed = None
+
 
 class EditCommand(qtw.QUndoCommand):
     """subclass to make Undo/Redo possible"""
 
-    def __init__(self, win, old_state, new_state, description=""):
+    def __init__(self, win, old_state, new_state, description="", item=None,
+                 parent=None):
         log("building editcommand for {}".format(description))
-        super().__init__(description)
+        super().__init__(description, parent)
         self.win = win
-        self.item = self.win.item
+        self.item_id = win.get_node_id(win.item if item is None else item)
         self.old_state = old_state
         self.new_state = new_state
         self.first_edit = not self.win.editor.tree_dirty
+        self.in_macro = parent is not None  # parent takes care of the rest
 
     def redo(self):
         "change node's state to new"
-        self.item.setText(0, self.new_state[0])
-        self.item.setText(1, self.new_state[1])
-        self.item.setText(2, self.new_state[2])
+        item = self.win.editor.get_node(self.item_id)
+        self.win.set_node_data(item, *self.new_state[1:])
+        self.win.set_node_title(item, self.new_state[0])
+        self.win.editor.search_index.update(item, *self.new_state[1:])
+        self.win.editor.node_changed(item)
 
     def undo(self):
         "change node's state back to old"
-        self.item.setText(0, self.old_state[0])
-        self.item.setText(1, self.old_state[1])
-        self.item.setText(2, self.old_state[2])
+        item = self.win.editor.get_node(self.item_id)
+        self.win.set_node_data(item, *self.old_state[1:])
+        self.win.set_node_title(item, self.old_state[0])
+        self.win.editor.search_index.update(item, *self.old_state[1:])
+        self.win.editor.node_changed(item)
+        if self.in_macro:
+            return
         if self.first_edit:
             self.win.editor.mark_dirty(False)
         self.win.statusbar.showMessage("{} undone".format(self.text()))
 
+    def size(self):
+        "estimate the memory kept by this command: the old and new texts"
+        return sum(sys.getsizeof(x) for x in self.old_state + self.new_state)
+
+    def release(self):
+        "drop what's only needed to undo"
+        self.old_state = ()
+
+
+class ReplaceCommand(qtw.QUndoCommand):
+    """subclass to make Undo/Redo possible
+
+    all changes made by one Replace (All) are child commands of this one, so
+    they are undone at once; the tree is repainted only when all are done
+    """
+
+    def __init__(self, win, changes, description=""):
+        super().__init__(description)
+        self.win = win
+        self.first_edit = not self.win.editor.tree_dirty
+        self.edits = [EditCommand(win, old_state, new_state, item=item,
+                                  parent=self)
+                      for item, old_state, new_state in changes]
+
+    def redo(self):
+        "(re)do all replacements"
+        with self.win.batch_update():
+            super().redo()
+
+    def undo(self):
+        "undo all replacements"
+        with self.win.batch_update():
+            super().undo()
+        if self.first_edit:
+            self.win.editor.mark_dirty(False)
+        self.win.statusbar.showMessage("{} undone".format(self.text()))
+
+    def size(self):
+        "estimate the memory kept by this command"
+        return sum(x.size() for x in self.edits)
+
+    def release(self):
+        "drop what's only needed to undo"
+        for edit in self.edits:
+            edit.release()
+
 
 class CopyElementCommand(qtw.QUndoCommand):
-    """subclass to make Undo/Redo possible"""
+    """subclass to make Undo/Redo possible
+
+    a cut item is taken out of the tree as it is and kept here, undoing puts
+    the same item back; so nothing is copied for undo, however big the
+    subtree is. Other items are remembered by their id
+    """
 
     def __init__(self, win, item, cut, retain, description=""):
         super().__init__(description)
-        self.undodata = None
+        self.undodata = None  # copy for the clipboard
+        self.parent_id = None
+        self.itemsize = None
         self.win = win  # treewidget
-        self.item = item  # where we are now
-        self.tag = str(self.item.text(1))
-        self.data = str(self.item.text(2))  # name and text
+        self.item = item  # what's being copied, kept while it's cut
+        self.detached = False  # item is out of the tree
+        self.tag, self.data = self.win.get_node_data(self.item)
         log("init {} {} {} {}"
             "".format(description, self.tag, self.data, self.item))
         self.cut = cut
@@ -659,48 +1015,46 @@ class CopyElementCommand(qtw.QUndoCommand):
 
     def redo(self):
         "(Re)Do Copy Element"
-
-        def push_el(el, result):
-            "do this recursively"
-            text = str(el.text(0))
-            data = (str(el.text(1)), str(el.text(2)))
-            children = []
-            for ix in range(el.childCount()):
-                subel = el.child(ix)
-                push_el(subel, children)
-            result.append((text, data, children))
-            return result
-
         log(
             "In copy element redo for item {} with data {}"
             "".format(self.item, self.data)
         )
-        print("redo of ", self.item)
-        if self.undodata is None:
-            print("building reference data")
-            self.parent = self.item.parent()
-            self.loc = self.parent.indexOfChild(self.item)
-            self.undodata = push_el(self.item, [])
-            if self.loc > 0:
-                self.prev = self.parent.child(self.loc - 1)
-            else:
-                self.prev = self.parent
-                if self.prev == self.win.editor.rt:
-                    self.prev = self.parent.child(self.loc + 1)
-            print("   parent:", self.parent)
-            print("   location:", self.loc)
-            print("   undodata:", self.undodata)
-            print("   pointer fallback:", self.prev)
+        if self.parent_id is None:
+            parent, self.loc = self.win.get_node_parentpos(self.item)
+            self.parent_id = self.win.get_node_id(parent)
         if self.retain:
             log("Retaining item")
+            if self.undodata is None:
+                self.undodata = self.win.editor.copy_subtree(self.item)
             self.win.cut_el = self.undodata
             self.win.cut_att = None
             self.win.enable_pasteitems(True)
         if self.cut:
-            log("cutting item from parent {}".format(self.parent))
-            self.parent.removeChild(self.item)
-            self.item = self.prev
-            self.win.tree.setCurrentItem(self.prev)
+            log("cutting item from parent {}".format(self.parent_id))
+            self.detach()
+
+    def detach(self):
+        """take the item out of the tree, keeping it, and select the one
+        before it
+        """
+        parent = self.win.editor.get_node(self.parent_id)
+        if self.loc > 0:
+            prev = parent.children[self.loc - 1]
+        else:
+            prev = parent
+            if prev == self.win.editor.rt:
+                prev = parent.children[self.loc + 1]
+        self.win.editor.node_removed(self.item, parent)
+        self.win.model.remove_node(parent, self.loc)
+        self.detached = True
+        self.win.set_selected_item(prev)
+
+    def reattach(self):
+        "put the item that was taken out back where it was"
+        parent = self.win.editor.get_node(self.parent_id)
+        self.win.model.insert_node(parent, self.loc, self.item)
+        self.win.editor.node_restored(self.item, parent, self.loc)
+        self.detached = False
 
     def undo(self):
         "Undo Copy Element"
@@ -711,108 +1065,52 @@ class CopyElementCommand(qtw.QUndoCommand):
         )
         # self.cut_el = None
         if self.cut:
-            print("undo of", self.item)
-            if self.loc >= self.parent.childCount():
-                item = PasteElementCommand(
-                    self.win,
-                    self.tag,
-                    self.data,
-                    before=False,
-                    below=True,
-                    data=self.undodata,
-                    description=__doc__,
-                    where=self.parent,
-                )
-            else:
-                item = PasteElementCommand(
-                    self.win,
-                    self.tag,
-                    self.data,
-                    before=True,
-                    below=False,
-                    data=self.undodata,
-                    description=__doc__,
-                    where=self.parent.child(self.loc),
-                )
-            item.redo()  # add_under=add_under, loc=self.loc)
-            self.item = item.added
+            with self.win.batch_update():
+                self.reattach()
         if self.first_edit:
             self.win.editor.mark_dirty(False)
         self.win.statusbar.showMessage("{} undone".format(self.text()))
         # self.win.tree.setCurrentItem(self.item)
 
+    def size(self):
+        """estimate the memory kept by this command: the item that's been cut
+        and the copy made for the clipboard
+        """
+        if self.itemsize is None:
+            self.itemsize = self.item.sizeof() if self.cut else ITEM_SIZE
+            if self.undodata is not None:
+                self.itemsize += self.undodata.sizeof()
+        return self.itemsize
 
-class CopyAttributeCommand(qtw.QUndoCommand):
-    """subclass to make Undo/Redo possible"""
+    def release(self):
+        "drop what's only needed to undo, a cut subtree in particular"
+        if self.detached:
+            self.win.editor.forget_nodes(self.item)
+            self.detached = False
+        self.item = self.undodata = None
 
-    def __init__(self, win, item, cut, retain, description):
-        super().__init__(description)
-        self.win = win  # treewidget
-        self.item = item  # where we are now
-        self.name = str(self.item.text(1))
-        self.value = str(self.item.text(2))  # name and text
-        log("init {} {} {} {}"
-            "".format(description, self.name, self.value, self.item))
-        self.cut = cut
-        self.retain = retain
-        self.first_edit = not self.win.editor.tree_dirty
+
+class CopyAttributeCommand(CopyElementCommand):
+    """subclass to make Undo/Redo possible"""
 
     def redo(self):
         "(re)do copy attribute"
-        log("copying item {} with text {}".format(self.item, self.value))
-        self.parent = self.item.parent()
-        self.loc = self.parent.indexOfChild(self.item)
+        log("copying item {} with text {}".format(self.item, self.data))
+        parent, self.loc = self.win.get_node_parentpos(self.item)
+        self.parent_id = self.win.get_node_id(parent)
         if self.retain:
             log("Retaining attribute")
             self.win.cut_el = None
-            self.win.cut_att = (self.name, self.value)
+            self.win.cut_att = (self.tag, self.data)
             self.win.enable_pasteitems(True)
         if self.cut:
             log("cutting attribute")
-            ix = self.loc
-            if ix > 0:
-                prev = self.parent.child(ix - 1)
-            else:
-                prev = self.parent
-                if prev == self.win.editor.rt:
-                    prev = self.parent.child(ix + 1)
-            self.parent.removeChild(self.item)
-            self.item = None
-            self.win.tree.setCurrentItem(prev)
-
-    def undo(self):
-        "Undo Copy attribute"
-        log("{} for {} {} {}"
-            "".format(__doc__, self.name, self.value, self.item))
-        # self.win.cut_att = None
-        if self.cut:
-            item = PasteAttributeCommand(
-                self.win, self.name, self.value, self.parent,
-                description=__doc__
-            )
-            item.redo()
-            self.item = item.added
-        if self.first_edit:
-            self.win.editor.mark_dirty(False)
-        self.win.statusbar.showMessage("{} undone".format(self.text()))
+            self.detach()
 
 
 # class MainFrame(qtw.QMainWindow, AxeMixin):
 class Gui(qtw.QMainWindow):
     "Main application window"
-    undoredowarning = """\
-    NOTE:
-
-    Limiting undo/redo to one action has a reason.
-
-    This feature may not work as intended when items are removed
-    and immediately un-removed or when multiple redo actions are
-    executed when the originals were done at different levels
-    in the tree.
-
-    So be prepared for surprises, I haven't quite figured this lot
-    out yet.
-    """
 
     def __init__(self, parent=None, fn=""):
         self.editor = parent
@@ -834,6 +1132,12 @@ class Gui(qtw.QMainWindow):
 
     def closeEvent(self, event):
         """reimplemented close event handler: check if data was modified"""
+        if self.loader is not None:
+            # put back the document that was being replaced before asking
+            # about saving, a partly loaded one mustn't be written
+            self.loader.cancelled = True
+            self.loader.wait()
+            self.loading_finished()
         test = self.editor.check_tree()
         if test:
             event.accept()
@@ -845,65 +1149,91 @@ class Gui(qtw.QMainWindow):
     #   for e.g. wx version
     def get_node_children(self, node):
         "return descendants of the given node"
-        return [node.child(i) for i in range(node.childCount())]
+        return list(node.children)
 
     def get_node_title(self, node):
         "return the title of the given node"
-        return node.text(0)
+        return node.label(self.editor.getshortname)
+
+    def is_element(self, node):
+        "tell if the given node is an element (and not an attribute)"
+        return not node.is_attr()
 
     def get_node_data(self, node):
         "return element name and text/CDATA associated with the given node"
-        return node.text(1), node.text(2)
+        return node.name, node.value
 
     def get_treetop(self):
         "return the visual tree's root element"
-        top = self.tree.topLevelItem(0)
-        rt = top.child(0)
-        if rt.text(0) == "namespaces":
-            rt = top.child(1)
-        return rt
+        for node in self.top.children:
+            if node.title != "namespaces":
+                return node
+        return None
 
     def setup_new_tree(self, title):
         "build new visual tree and return its root element"
-        self.tree.clear()  # DeleteAllItems()
-        self.undo_stack.clear()
-        self.top = qtw.QTreeWidgetItem()
-        self.top.setText(0, title)
-        self.tree.addTopLevelItem(self.top)  # AddRoot(titel)
+        if self.stashed is None:
+            self.undo_stack.clear()
+        self.top = TreeNode()
+        self.top.title = title
+        self.model.set_top(self.top)
         return self.top
 
     def add_node_to_parent(self, parent, pos=-1):
         "add new descendant to element at the given position and return it"
-        node = qtw.QTreeWidgetItem()
-        if pos == -1:
-            parent.addChild(node)
-        else:
-            parent.insertChild(pos, node)
+        node = TreeNode()
+        self.model.insert_node(parent, pos, node)
         return node
 
     def set_node_title(self, node, title):
         "set the title for the given node"
-        node.setText(0, title)
+        node.set_title(title)
+        self.model.node_changed(node)
+
+    def get_node_parent(self, node):
+        "return the parent of the given node, None for the top"
+        return node.parent
 
     def get_node_parentpos(self, node):
         "return the parent of the given node and its position under it"
-        parent = node.parent()
-        pos = parent.indexOfChild(node)
-        return parent, pos
+        return node.parent, self.model.row_of(node)
 
     def set_node_data(self, node, name, value):
         """set (element name, text/CDATA) associated with given node
         """
-        node.setText(1, name)
-        node.setText(2, value)
+        # the name is shared through the editor's symbol table
+        node.name = self.editor.symbols.intern(name)
+        node.value = value
+
+    def set_node_expandable(self, node, value):
+        """show an expand indicator for a node whose children aren't loaded yet
+        """
+        node.expandable = value
+        self.model.node_changed(node)
+
+    def get_node_attrcount(self, node):
+        "return the number of attributes of a node, None if not known"
+        return node.attrcount
+
+    def set_node_attrcount(self, node, count):
+        "remember the number of attributes of a node"
+        node.attrcount = count
+
+    def get_node_id(self, node):
+        "return the id the editor gave a node"
+        return node.node_id
+
+    def set_node_id(self, node, node_id):
+        "remember the id the editor gave a node"
+        node.node_id = node_id
 
     def get_selected_item(self):
         "return the currently selected item"
-        return self.tree.currentItem()
+        return self.model.get_node(self.tree.currentIndex())
 
     def set_selected_item(self, item):
         "set the currently selected item to the given item"
-        self.tree.setCurrentItem(item)
+        self.tree.setCurrentIndex(self.model.index_for(item))
 
     def is_node_root(self, item=None):
         """Check if the given element is the visual tree's root.
@@ -916,35 +1246,58 @@ class Gui(qtw.QMainWindow):
         """
         if not item:
             item = self.item
-        if (item.text(1), item.text(2)) == (
+        if self.get_node_data(item) == (
             self.editor.rt.tag,
             self.editor.rt.text or "",
         ):
             return True
         return False
 
-    def expand_item(self, item=None):
-        "expand a tree item"
-
-        def expand_with_children(item):
-            "do it recursively"
-            self.tree.expandItem(item)
-            for ix in range(item.childCount()):
-                expand_with_children(item.child(ix))
+    def expand_item(self, item=None, levels=-1):
+        """expand a tree item, if requested only for a number of levels
 
+        the subtree is filled a batch of nodes at a time; in between the
+        screen is updated and the cancel button can stop the expansion
+        """
         if not item:
-            item = self.tree.currentItem()
-        if item:
-            expand_with_children(item)
-            self.tree.resizeColumnToContents(0)
+            item = self.get_selected_item()
+        if not item or levels == 0:
+            return
+        native = hasattr(self.tree, "expandRecursively")  # Qt 5.13 and later
+        self.expanding = True
+        busy = False
+        with self.batch_update():
+            for count, node in enumerate(self.editor.fill_subtree(item,
+                                                                  levels)):
+                if not native:
+                    self.tree.expand(self.model.index_for(node))
+                if count and not count % EXPAND_BATCH:
+                    if not busy:
+                        busy = True
+                        self.show_loading(True, "Expanding...")
+                        self.progressbar.hide()
+                        self.tree.setEnabled(False)
+                    self.app.processEvents()
+                    if not self.expanding:
+                        break
+            if not self.expanding:
+                self.tree.expand(self.model.index_for(item))
+            elif native:
+                self.tree.expandRecursively(self.model.index_for(item),
+                                            max(levels - 1, -1))
+        if busy:
+            self.tree.setEnabled(True)
+            self.show_loading(False)
+        self.expanding = False
+        self.tree.resizeColumnToContents(0)
 
     def collapse_item(self, item=None):
         "collapse tree item"
         if not item:
-            item = self.tree.currentItem()
+            item = self.get_selected_item()
         if item:
-            self.tree.collapseItem(
-                item
+            self.tree.collapse(
+                self.model.index_for(item)
             )  # mag eventueel recursief in overeenstemming met vorige
             #  (may possibly be recursive in accordance with previous)
             self.tree.resizeColumnToContents(0)
@@ -952,9 +1305,9 @@ class Gui(qtw.QMainWindow):
     def edit_item(self, item):
         "edit an element or attribute"
         self.item = item
-        data = str(self.item.text(0))  # self.item.get_text()
+        data = self.get_node_title(self.item)
         if data.startswith(ELSTART):
-            tag, text = str(self.item.text(1)), str(self.item.text(2))
+            tag, text = self.get_node_data(self.item)
             state = data, tag, text  # current values to pass to UndoAction
             data = {"item": self.item, "tag": tag}
             if text:
@@ -971,7 +1324,7 @@ class Gui(qtw.QMainWindow):
                 self.undo_stack.push(command)
                 self.editor.mark_dirty(True)
         else:
-            nam, val = str(self.item.text(1)), str(self.item.text(2))
+            nam, val = self.get_node_data(self.item)
             state = data, nam, val  # current values to be passed to UndoAction
             data = {"item": self.item, "name": nam, "value": val}
             edt = AttributeDialog(self, title="Edit an attribute",
@@ -990,7 +1343,7 @@ class Gui(qtw.QMainWindow):
         """execute cut/delete/copy action"""
         self.item = item
         txt = self.editor.get_copy_text(cut, retain)
-        if self.item.text(0).startswith(ELSTART):
+        if self.item.title.startswith(ELSTART):
             command = CopyElementCommand(
                 self, self.item, cut, retain, "{} Element".format(txt)
             )
@@ -1013,11 +1366,10 @@ class Gui(qtw.QMainWindow):
             )
             self.undo_stack.push(command)
         elif self.cut_el:
-            tag, text = self.cut_el[0][1]
             command = PasteElementCommand(
                 self,
-                tag,
-                text,
+                self.cut_el.name,
+                self.cut_el.value,
                 before=before,
                 below=below,
                 where=self.item,
@@ -1076,11 +1428,28 @@ class Gui(qtw.QMainWindow):
 
         self.statusbar = self.statusBar()
         self.statusbar.showMessage("Ready")
+        self.progressbar = qtw.QProgressBar(self)
+        self.progressbar.setMaximumWidth(200)
+        self.statusbar.addPermanentWidget(self.progressbar)
+        self.btn_cancel = qtw.QPushButton("Cancel", self)
+        self.btn_cancel.clicked.connect(self.cancel_loading)
+        self.statusbar.addPermanentWidget(self.btn_cancel)
+        self.progressbar.hide()
+        self.btn_cancel.hide()
+        self.loader = None
+        self.expanding = False
+        self.stashed = None
+        self.results_dock = None
+        self.batch_depth = 0
 
         self.init_menus()
 
         self.tree = VisualTree(self)
-        self.tree.headerItem().setHidden(True)
+        self.tree.setHeaderHidden(True)
+        self.tree.setUniformRowHeights(True)
+        self.model = TreeModel(self.editor.populate_node,
+                               self.get_node_title, self)
+        self.tree.setModel(self.model)
         self.setCentralWidget(self.tree)
         self.enable_pasteitems(False)
         self.undo_stack = UndoRedoStack(self)
@@ -1095,6 +1464,109 @@ class Gui(qtw.QMainWindow):
         """get screen title"""
         return self.windowTitle()
 
+    def update_display(self):
+        """show what has been changed while the application is still busy
+        """
+        self.app.processEvents(core.QEventLoop.ExcludeUserInputEvents)
+
+    @contextlib.contextmanager
+    def batch_update(self):
+        """make a number of changes to the tree that are shown all at once
+
+        batches can be nested, the tree is repainted when the outer one ends
+        """
+        self.batch_depth += 1
+        if self.batch_depth == 1:
+            self.tree.setUpdatesEnabled(False)
+        try:
+            yield
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth:
+                self.tree.setUpdatesEnabled(True)
+
+    def stash_tree(self):
+        "take the current tree out of the view so it can be put back later"
+        # the view forgets what was expanded when it gets another tree
+        expanded, todo = [], [self.top]
+        while todo:
+            node = todo.pop()
+            if self.tree.isExpanded(self.model.index_for(node)):
+                expanded.append(node)
+                todo.extend(node.children)
+        self.stashed = self.top, expanded
+
+    def drop_stashed_tree(self):
+        "forget the tree that was put aside, including its undo history"
+        self.stashed = None
+        self.undo_stack.clear()
+
+    def restore_tree(self):
+        "put the tree that was put aside back and return its top"
+        (self.top, expanded), self.stashed = self.stashed, None
+        self.model.set_top(self.top)
+        for node in expanded:
+            self.tree.expand(self.model.index_for(node))
+        return self.top
+
+    def load_in_background(self, events, on_batch, on_done, on_cancel):
+        """parse a file in a separate thread
+
+        on_batch is called for every batch of parse events, on_done when
+        everything has been read and on_cancel when loading is cancelled or
+        fails (with an error message)
+        """
+        self.load_callbacks = on_batch, on_done, on_cancel
+        self.load_error = ""
+        self.loader = LoadThread(self, events)
+        self.loader.batch_ready.connect(self.batch_loaded)
+        self.loader.load_failed.connect(self.loading_failed)
+        self.loader.finished.connect(self.loading_finished)
+        self.show_loading(True)
+        self.loader.start()
+
+    def batch_loaded(self, batch, done):
+        "handle the results of the loader thread"
+        if self.loader is not None and not self.loader.cancelled:
+            self.load_callbacks[0](batch)
+            self.progressbar.setValue(done)
+
+    def loading_failed(self, message):
+        "remember why loading stopped"
+        self.load_error = message
+
+    def loading_finished(self):
+        "the loader thread is done: wrap up or go back to what was shown"
+        if self.loader is None:  # already handled when closing
+            return
+        loader, self.loader = self.loader, None
+        self.show_loading(False)
+        if loader.cancelled:
+            self.load_callbacks[2]()
+        elif self.load_error:
+            self.load_callbacks[2](self.load_error)
+        else:
+            self.load_callbacks[1]()
+
+    def cancel_loading(self):
+        "stop the loader thread or the expansion of a subtree"
+        if self.loader is not None:
+            self.loader.cancelled = True
+        self.expanding = False
+
+    def show_loading(self, state, message="Loading..."):
+        "show or hide the progress bar; no menu actions while loading"
+        self.progressbar.setValue(0)
+        self.progressbar.setVisible(state)
+        self.btn_cancel.setVisible(state)
+        self.statusbar.showMessage(message if state else "Ready")
+        for act in (self.filemenu_actions + self.viewmenu_actions
+                    + self.editmenu_actions + self.searchmenu_actions):
+            act.setEnabled(not state)
+        if not state:
+            self.enable_pasteitems(bool(self.cut_el or self.cut_att))
+            self.undo_stack.index_changed()
+
     def init_menus(self, popup=False):
         """setup application menu"""
         if popup:
@@ -1127,7 +1599,7 @@ class Gui(qtw.QMainWindow):
             ) = self.editmenu_actions[6:9]
             self.setundo_action = self.filemenu_actions[-2]
             self.setundo_action.setCheckable(True)
-            self.setundo_action.setChecked(False)
+            self.setundo_action.setChecked(True)
 
             menubar = self.menuBar()
             filemenu = menubar.addMenu("&File")
@@ -1255,15 +1727,13 @@ class Gui(qtw.QMainWindow):
         "set undo limit"
         newstate = self.setundo_action.isChecked()
         self.undo_stack.unset_undo_limit(newstate)
-        if newstate:
-            self.meldinfo(self.undoredowarning)
 
     def popupmenu(self, item):
         """call up menu"""
         log("self.popupmenu called")
         menu = self.init_menus(popup=True)
         menu.exec_(self.tree.mapToGlobal(
-            self.tree.visualItemRect(item).bottomRight()
+            self.tree.visualRect(self.model.index_for(item)).bottomRight()
         ))
 
     def quit(self):
@@ -1273,42 +1743,88 @@ class Gui(qtw.QMainWindow):
     def on_keyup(self, ev=None):
         "handle keyboard event"
         ky = ev.key()
-        item = self.tree.currentItem()
+        item = self.get_selected_item()
         skip = False
+        if ky == core.Qt.Key_Escape and self.loader is not None:
+            self.cancel_loading()
+            return True
         if item and item != self.top:
             if ky == core.Qt.Key_Return:
                 if self.in_dialog:
                     self.in_dialog = False
                 else:
-                    if item.childCount() > 0:
-                        if item.isExpanded():
-                            self.tree.collapseItem(item)
-                            self.tree.setCurrentItem(item.parent())
+                    self.editor.populate_node(item)
+                    if item.children:
+                        index = self.model.index_for(item)
+                        if self.tree.isExpanded(index):
+                            self.tree.collapse(index)
+                            self.set_selected_item(item.parent)
                         else:
-                            self.tree.expandItem(item)
-                            self.tree.setCurrentItem(item.child(0))
+                            self.tree.expand(index)
+                            self.set_selected_item(item.children[0])
                     # else:
                     #     self.edit()
                 skip = True
             elif ky == core.Qt.Key_Backspace:
-                if item.isExpanded():
-                    self.tree.collapseItem(item)
-                    self.tree.setCurrentItem(item.parent())
+                index = self.model.index_for(item)
+                if self.tree.isExpanded(index):
+                    self.tree.collapse(index)
+                    self.set_selected_item(item.parent)
                 skip = True
             elif ky == core.Qt.Key_Menu:
                 self.popupmenu(item)
                 skip = True
         return skip
 
-    def get_search_args(self):
-        """send dialog to get search argument(s)"""
+    def get_search_args(self, replace=False):
+        """send dialog to get search argument(s)
+
+        with `replace` also ask what to replace the found values with
+        """
         # self.search_args = []
-        edt = SearchDialog(self, title="Search options").exec_()
+        title = "Replace options" if replace else "Search options"
+        edt = SearchDialog(self, title=title, replace=replace).exec_()
         if edt == qtw.QDialog.Accepted:
             # self.editor.search_args = self.search_args
             return True
         return False
 
+    def replace_items(self, changes, description):
+        """give the nodes new names and values as a single undoable action
+
+        `changes` are (node, name, value, is_attr) tuples
+        """
+        edits = []
+        for item, name, value, is_attr in changes:
+            old_state = (self.get_node_title(item), *self.get_node_data(item))
+            title = self.editor.getshortname((name, value), attr=is_attr)
+            edits.append((item, old_state, (title, name, value)))
+        self.undo_stack.push(ReplaceCommand(self, edits, description))
+
+    def show_search_results(self, title, results):
+        """show (node, is_attr, text) tuples for the search results in a list
+        beside the tree
+        """
+        if self.results_dock is None:
+            self.results_dock = qtw.QDockWidget(self)
+            self.results_list = qtw.QListWidget(self.results_dock)
+            self.results_list.itemClicked.connect(self.goto_search_result)
+            self.results_list.itemActivated.connect(self.goto_search_result)
+            self.results_dock.setWidget(self.results_list)
+            self.addDockWidget(core.Qt.BottomDockWidgetArea,
+                               self.results_dock)
+        self.search_results = results
+        self.results_list.clear()
+        self.results_list.addItems([x[2] for x in results])
+        self.results_dock.setWindowTitle(title)
+        self.results_dock.show()
+        self.results_dock.raise_()
+
+    def goto_search_result(self, item):
+        "select the node for the chosen search result"
+        node, is_attr = self.search_results[self.results_list.row(item)][:2]
+        self.editor.goto_search_result(node, is_attr)
+
     def do_undo(self):
         "undo action"
         self.undo_stack.undo()
@@ -1316,4 +1832,4 @@ class Gui(qtw.QMainWindow):
     def do_redo(self):
         "(re)do action"
         self.undo_stack.redo()
-    # region internals
\ No newline at end of file
+    # region internals
\ No newline at end of file
@@ -2,18 +2,27 @@
 (wxPython version of a treeview-based XML editor)
 """
 
+import contextlib
 import os
+import threading
 import wx
 from .shared import (
     ELSTART,
+    EXPAND_BATCH,
+    SEARCH_MODES,
+    SEARCH_MODE_TEXTS,
     axe_iconame,
     # log,
 )
 
 if os.name == "nt":
-    HMASK = "XML files (*.xml)|*.xml|All files (*.*)|*.*"
+    HMASK = ("XML files (*.xml)|*.xml|"
+             "Compressed XML files (*.xml.gz, *.xml.bz2, *.xml.xz)|"
+             "*.xml.gz;*.xml.bz2;*.xml.xz|All files (*.*)|*.*")
 elif os.name == "posix":
-    HMASK = "XML files (*.xml, *.XML)|*.xml;*.XML|All files (*.*)|*.*"
+    HMASK = ("XML files (*.xml, *.XML)|*.xml;*.XML|"
+             "Compressed XML files (*.xml.gz, *.xml.bz2, *.xml.xz)|"
+             "*.xml.gz;*.xml.bz2;*.xml.xz|All files (*.*)|*.*")
 IMASK = "All files|*.*"
 
 
@@ -35,7 +44,7 @@ class ElementDialog(wx.Dialog):
         self.cb_ns = wx.CheckBox(self, label="Namespace:  ")
         self.cmb_ns = wx.ComboBox(self, size=(120, -1))
         self.cmb_ns.Append("-- none --")
-        self.cmb_ns.AppendItems(self._parent.editor.ns_uris)
+        self.cmb_ns.AppendItems(self._parent.editor.namespaces.uris)
 
         self.cb = wx.CheckBox(self, label="Bevat data:")
         self.txt_data = wx.TextCtrl(self, size=(300, 140),
@@ -57,9 +66,9 @@ class ElementDialog(wx.Dialog):
                 txt = item["text"]
             if ns_uri:
                 self.cb_ns.SetValue(True)
-                for ix, uri in enumerate(self.parent.ns_uris):
-                    if uri == ns_uri:
-                        self.cmb_ns.SetSelection(ix + 1)
+                uris = self._parent.editor.namespaces.uris
+                if ns_uri in uris:
+                    self.cmb_ns.SetSelection(uris.index(ns_uri) + 1)
         self.txt_tag.SetValue(tag)
         self.txt_data.SetValue(txt)
 
@@ -163,7 +172,7 @@ class AttributeDialog(wx.Dialog):
         self.cb_ns = wx.CheckBox(self, label="Namespace:  ")
         self.cmb_ns = wx.ComboBox(self, size=(120, -1))
         self.cmb_ns.Append("-- none --")
-        self.cmb_ns.AppendItems(self._parent.editor.ns_uris)
+        self.cmb_ns.AppendItems(self._parent.editor.namespaces.uris)
 
         self.btn_ok = wx.Button(self, id=wx.ID_SAVE)
         self.btn_ok.Bind(wx.EVT_BUTTON, self.on_ok)
@@ -179,9 +188,9 @@ class AttributeDialog(wx.Dialog):
                 nam = ns_nam
             if ns_uri:
                 self.cb_ns.SetValue(True)
-                for ix, uri in enumerate(self.parent.ns_uris):
-                    if uri == ns_uri:
-                        self.cmb_ns.SetSelection(ix + 1)
+                uris = self._parent.editor.namespaces.uris
+                if ns_uri in uris:
+                    self.cmb_ns.SetSelection(uris.index(ns_uri) + 1)
             val = item["value"]
         self.txt_name.SetValue(nam)
         self.txt_value.SetValue(val)
@@ -255,9 +264,11 @@ class SearchDialog(wx.Dialog):
         parent,
         title="",  # size=(320, 160), pos=wx.DefaultPosition,
         style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER,
+        replace=False,
     ):
         super().__init__(parent, title=title, style=style)
         self._parent = parent
+        self.replace = replace
         if self._parent.editor.search_args:
             ele_name, attr_name, attr_val, text_val = \
                 self._parent.editor.search_args
@@ -304,6 +315,28 @@ class SearchDialog(wx.Dialog):
         self.txt_text = wx.TextCtrl(self, size=(128, -1))
         hsizer.Add(self.txt_text)
         gsizer.Add(hsizer, (3, 1))
+
+        lbl_mode = wx.StaticText(self, label="Search as")
+        gsizer.Add(lbl_mode, (4, 0), flag=wx.ALIGN_CENTER_VERTICAL)
+        self.cmb_mode = wx.Choice(self, choices=SEARCH_MODE_TEXTS)
+        self.cmb_mode.SetSelection(
+            SEARCH_MODES.index(self._parent.editor.search_mode))
+        gsizer.Add(self.cmb_mode, (4, 1))
+        if self.replace:
+            # an empty field leaves what's found alone unless it's asked to
+            # be removed; names are only replaced with something
+            self.txt_replace = []
+            for row, value in enumerate(self._parent.editor.replace_args):
+                hsizer = wx.BoxSizer(wx.HORIZONTAL)
+                lbl_replace = wx.StaticText(self, label="replace with: ")
+                hsizer.Add(lbl_replace, flag=wx.ALIGN_CENTER_VERTICAL)
+                text = wx.TextCtrl(self, value=value or "", size=(128, -1))
+                hsizer.Add(text)
+                gsizer.Add(hsizer, (row, 2))
+                self.txt_replace.append(text)
+            self.cb_remove = wx.CheckBox(
+                self, label="remove the value or text found where left empty")
+            gsizer.Add(self.cb_remove, (4, 2))
         sizer.Add(gsizer, flag=wx.TOP | wx.LEFT, border=15)
 
         self.sbsizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -337,6 +370,7 @@ class SearchDialog(wx.Dialog):
         self.txt_attr_val.SetValue(attr_val)
         self.txt_text.Bind(wx.EVT_TEXT, self.set_search)
         self.txt_text.SetValue(text_val)
+        self.cmb_mode.Bind(wx.EVT_CHOICE, self.set_search)
 
     def set_search(self, evt=None):
         """build text describing search action"""
@@ -344,8 +378,9 @@ class SearchDialog(wx.Dialog):
         attr_name = self.txt_attr_name.GetValue()
         attr_val = self.txt_attr_val.GetValue()
         text = self.txt_text.GetValue()
+        mode = SEARCH_MODES[self.cmb_mode.GetSelection()]
         out = self._parent.editor.get_search_text(ele, attr_name, attr_val,
-                                                  text)
+                                                  text, mode)
         self.lbl_search.SetLabel("\n".join(out))
         self.Fit()
 
@@ -371,11 +406,104 @@ class SearchDialog(wx.Dialog):
             )
             self.txt_element.SetFocus()
             return
+        mode = SEARCH_MODES[self.cmb_mode.GetSelection()]
+        search_args = (ele, attr_name, attr_val, text)
+        message = self._parent.editor.check_search_args(search_args, mode)
+        if message:
+            self._parent.meldfout(message)
+            self.txt_element.SetFocus()
+            return
 
-        self._parent.editor.search_args = (ele, attr_name, attr_val, text)
+        self._parent.editor.search_args = search_args
+        self._parent.editor.search_mode = mode
+        if self.replace:
+            empty = "" if self.cb_remove.GetValue() else None
+            self._parent.editor.replace_args = tuple(
+                str(x.GetValue()) or empty for x in self.txt_replace)
         evt.Skip()
 
 
+class SearchResultsDialog(wx.Dialog):
+    """Modeless dialog listing the results of a search"""
+
+    def __init__(
+        self,
+        parent,
+        title="Search results",
+        style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER,
+    ):
+        super().__init__(parent, title=title, style=style)
+        self._parent = parent
+        self.results = []
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        self.lbl_count = wx.StaticText(self, label="")
+        sizer.Add(self.lbl_count, flag=wx.ALL, border=5)
+        self.lst_results = wx.ListBox(self, size=(400, 300))
+        self.lst_results.Bind(wx.EVT_LISTBOX, self.on_select)
+        self.lst_results.Bind(wx.EVT_LISTBOX_DCLICK, self.on_select)
+        sizer.Add(self.lst_results, 1, flag=wx.EXPAND | wx.LEFT | wx.RIGHT,
+                  border=5)
+        self.btn_close = wx.Button(self, id=wx.ID_CLOSE)
+        self.btn_close.Bind(wx.EVT_BUTTON, self.on_close)
+        sizer.Add(self.btn_close,
+                  flag=wx.ALIGN_CENTER_HORIZONTAL | wx.ALL, border=5)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
+
+        self.SetSizer(sizer)
+        self.SetAutoLayout(True)
+        sizer.Fit(self)
+        self.Layout()
+
+    def show_results(self, title, results):
+        "fill the list with (node, is_attr, text) tuples and show it"
+        self.results = results
+        self.lbl_count.SetLabel(title)
+        self.lst_results.Set([x[2] for x in results])
+        self.Show()
+        self.Raise()
+
+    def on_select(self, evt=None):
+        "select the node for the chosen search result"
+        ix = self.lst_results.GetSelection()
+        if ix != wx.NOT_FOUND:
+            node, is_attr = self.results[ix][:2]
+            self._parent.editor.goto_search_result(node, is_attr)
+
+    def on_close(self, evt=None):
+        "hide instead of destroying, so the dialog can be used again"
+        self.Hide()
+
+
+class LoadThread(threading.Thread):
+    """Thread subclass that parses a file while the GUI stays responsive
+
+    the parse results are passed to the GUI thread in batches; every call
+    comes with the thread itself, so what an earlier load still sends after it
+    was let go of can be told apart from the current one
+    """
+
+    def __init__(self, parent, events):
+        super().__init__(daemon=True)
+        self.parent = parent
+        self.events = events
+        self.cancelled = False
+
+    def run(self):
+        "reimplemented: walk through the parse events"
+        try:
+            for batch, done in self.events:
+                if self.cancelled:
+                    break
+                wx.CallAfter(self.parent.batch_loaded, self, batch, done)
+        except (IOError, SyntaxError) as err:  # ParseError is a SyntaxError
+            wx.CallAfter(self.parent.loading_finished, self, str(err))
+        except Exception as err:  # anything else also means it's not loaded
+            wx.CallAfter(self.parent.loading_finished, self, "{}: {}".format(
+                type(err).__name__, err))
+        else:
+            wx.CallAfter(self.parent.loading_finished, self)
+
+
 class Gui(wx.Frame):
     "Main application window"
 
@@ -418,8 +546,18 @@ class Gui(wx.Frame):
             self.PopupMenu(menu)
             menu.Destroy()
 
+    def on_expanding(self, ev=None):
+        "event handler for expanding a tree item: make sure it's filled"
+        self.editor.populate_node(ev.GetItem())
+        ev.Skip()
+
     def afsl(self, ev=None):
         """handle CLOSE event"""
+        if self.loader is not None:
+            # put back the document that was being replaced before asking
+            # about saving, a partly loaded one mustn't be written
+            self.loader.cancelled = True
+            self.loading_finished(self.loader)
         test = self.editor.check_tree()
         if not test:
             ev.Veto()
@@ -439,6 +577,10 @@ class Gui(wx.Frame):
         "return the title of the given node"
         return self.tree.GetItemText(node)
 
+    def is_element(self, node):
+        "tell if the given node is an element (and not an attribute)"
+        return self.tree.GetItemText(node).startswith(ELSTART)
+
     def get_node_data(self, node):
         "return element name and text/CDATA associated with the given node"
         return self.tree.GetItemData(node)  # assuming this is a 2-tuple
@@ -453,6 +595,8 @@ class Gui(wx.Frame):
     def setup_new_tree(self, title):
         "build new visual tree and return its root element"
         self.tree.DeleteAllItems()
+        self.attrcounts = {}
+        self.node_ids = {}
         # self.undo_stack.clear()
         self.top = self.tree.AddRoot(title)
         return self.top
@@ -463,26 +607,57 @@ class Gui(wx.Frame):
             node = self.tree.AppendItem(parent, "")
         else:
             node = self.tree.InsertItem(parent, pos, "")
+        # item ids get reused, so don't inherit from a deleted item
+        self.attrcounts.pop(node, None)
+        self.node_ids.pop(node, None)
         return node
 
     def set_node_title(self, node, title):
         "set the title for the given node"
         self.tree.SetItemText(node, title)
 
+    def get_node_parent(self, node):
+        "return the parent of the given node, None for the top"
+        parent = self.tree.GetItemParent(node)
+        return parent if parent.IsOk() else None
+
     def get_node_parentpos(self, node):
         "return the parent of the given node and its position under it"
         parent = self.tree.GetItemParent(node)
         pos = 0
-        tag, c = self.tree.GetFirstChild(node)
+        tag, c = self.tree.GetFirstChild(parent)
         while tag.IsOk() and tag != node:
             pos += 1
-            tag, c = self.tree.GetNextChild(node, c)
+            tag, c = self.tree.GetNextChild(parent, c)
         return parent, pos
 
     def set_node_data(self, node, name, value):
         """set (element name, text/CDATA) associated with given node
+
+        the name is the copy from the editor's symbol table
+        """
+        self.tree.SetItemData(node, (self.editor.symbols.intern(name), value))
+
+    def set_node_expandable(self, node, value):
+        """show an expand button for a node whose children are not loaded yet
         """
-        self.tree.SetItemData(node, (name, value))
+        self.tree.SetItemHasChildren(node, value)
+
+    def get_node_attrcount(self, node):
+        "return the number of attributes of a node, None if not known"
+        return self.attrcounts.get(node)
+
+    def set_node_attrcount(self, node, count):
+        "remember the number of attributes of a node"
+        self.attrcounts[node] = count
+
+    def get_node_id(self, node):
+        "return the id the editor gave a node"
+        return self.node_ids.get(node)
+
+    def set_node_id(self, node, node_id):
+        "remember the id the editor gave a node"
+        self.node_ids[node] = node_id
 
     def get_selected_item(self):
         "return the currently selected item"
@@ -510,12 +685,40 @@ class Gui(wx.Frame):
             return True
         return False
 
-    def expand_item(self, item=None):
-        "expand a tree item"
+    def expand_item(self, item=None, levels=-1):
+        """expand a tree item, if requested only for a number of levels
+
+        the subtree is filled a batch of nodes at a time; in between the
+        screen is updated and the cancel button can stop the expansion
+        """
         if not item:
             item = self.tree.Selection
-        if item:
-            self.tree.ExpandAllChildren(item)
+        if not item or levels == 0:
+            return
+        self.expanding = True
+        busy = False
+        with self.batch_update():
+            for count, node in enumerate(self.editor.fill_subtree(item,
+                                                                  levels)):
+                if levels > 0:
+                    self.tree.Expand(node)
+                if count and not count % EXPAND_BATCH:
+                    if not busy:
+                        busy = True
+                        self.show_loading(True, "Expanding...")
+                        self.gauge.Hide()
+                        self.tree.Disable()
+                    wx.GetApp().Yield(True)
+                    if not self.expanding:
+                        break
+            if not self.expanding:
+                self.tree.Expand(item)
+            elif levels < 0:
+                self.tree.ExpandAllChildren(item)
+        if busy:
+            self.tree.Enable()
+            self.show_loading(False)
+        self.expanding = False
 
     def collapse_item(self, item=None):
         "collapse tree item"
@@ -541,7 +744,9 @@ class Gui(wx.Frame):
                     h = (self.data["tag"], self.data["text"])
                     self.tree.SetItemText(self.item,
                                           self.editor.getshortname(h))
-                    self.tree.SetItemData(self.item, h)
+                    self.set_node_data(self.item, *h)
+                    self.editor.search_index.update(self.item, *h)
+                    self.editor.node_changed(self.item)
                     self.editor.mark_dirty(True)
         else:
             nam, val = self.tree.GetItemData(self.item)  # self.item.get_data()
@@ -553,37 +758,20 @@ class Gui(wx.Frame):
                     self.tree.SetItemText(
                         self.item, self.editor.getshortname(h, attr=True)
                     )
-                    self.tree.SetItemData(self.item, h)
+                    self.set_node_data(self.item, *h)
+                    self.editor.search_index.update(self.item, *h)
+                    self.editor.node_changed(self.item)
                     self.editor.mark_dirty(True)
 
     def copy(self, item, cut=False, retain=True):
         # retain is t.b.v. delete functie
         """execute cut/delete/copy action"""
-
-        def push_el(el, result):
-            "copy element data recursively"
-            # print "start: ",result
-            text = self.tree.GetItemText(el)
-            data = self.tree.GetItemData(el)
-            children = []
-            # print "before looping over contents:",text,y
-            if text.startswith(ELSTART):
-                subel, whereami = self.tree.GetFirstChild(el)
-                while subel.IsOk():
-                    _ = push_el(subel, children)
-                    subel, whereami = self.tree.GetNextChild(el, whereami)
-            # print "after  looping over contents: ",text,y
-            result.append((text, data, children))
-            # print "end:  ",result
-            return result
-
         self.item = item
         text = self.tree.GetItemText(self.item)
         data = self.tree.GetItemData(self.item)
         if retain:
             if text.startswith(ELSTART):
-                self.cut_el = []
-                self.cut_el = push_el(self.item, self.cut_el)
+                self.cut_el = self.editor.copy_subtree(self.item)
                 self.cut_att = None
             else:
                 self.cut_el = None
@@ -595,6 +783,9 @@ class Gui(wx.Frame):
                 prev = self.tree.GetItemParent(self.item)
                 if prev == self.editor.rt:
                     prev = self.tree.GetNextSibling(self.item)
+            self.editor.node_removed(self.item,
+                                     self.tree.GetItemParent(self.item))
+            self.editor.forget_nodes(self.item)
             self.tree.Delete(self.item)
             self.editor.mark_dirty(True)
             # self.tree.SelectItem(prev)
@@ -602,59 +793,14 @@ class Gui(wx.Frame):
     def paste(self, item, before=True, below=False):
         """execute paste action"""
         self.item = item
+        # goes through the editor so attributes end up before the subelements
+        # and the attribute counts stay right
         if self.cut_att:
-            item = self.editor.getshortname(self.cut_att, attr=True)
-            data = self.cut_att
-            if below:
-                node = self.tree.AppendItem(self.item, item)
-                self.tree.SetItemData(node, data)
-            else:
-                # self.item.get_parent()
-                add_to = self.tree.GetItemParent(self.item)
-                added = False
-                x, c = self.tree.GetFirstChild(add_to)
-                for i in range(self.tree.GetChildrenCount(add_to)):
-                    if x == self.item:
-                        if not before:
-                            i += 1
-                        node = self.tree.InsertItem(add_to, i, item)
-                        self.tree.SetItemData(node, data)
-                        added = True
-                        break
-                    x, c = self.tree.GetNextChild(add_to, c)
-                if not added:
-                    node = self.tree.AppendItem(add_to, item)
-                    self.tree.SetItemData(node, data)
+            self.editor.add_item(self.item, *self.cut_att, before=before,
+                                 below=below, attr=True)
         else:
-
-            def zetzeronder(node, el, pos=-1):
-                "add elements recursively"
-                if pos == -1:
-                    subnode = self.tree.AppendItem(node, el[0])
-                    self.tree.SetItemData(subnode, el[1])
-                else:
-                    subnode = self.tree.InsertItem(node, i, el[0])
-                    self.tree.SetItemData(subnode, el[1])
-                for x in el[2]:
-                    zetzeronder(subnode, x)
-
-            if below:
-                node = self.item
-                i = -1
-            else:
-                # self.item.get_parent()
-                node = self.tree.GetItemParent(self.item)
-                x, c = self.tree.GetFirstChild(node)
-                cnt = self.tree.GetChildrenCount(node)
-                for i in range(cnt):
-                    if x == self.item:
-                        if not before:
-                            i += 1
-                        break
-                    x, c = self.tree.GetNextChild(node, c)
-                if i == cnt:
-                    i = -1
-            zetzeronder(node, self.cut_el[0], i)
+            self.editor.paste_subtree(self.item, self.cut_el, before=before,
+                                      below=below)
         self.editor.mark_dirty(True)
 
     def add_attribute(self, item):
@@ -697,8 +843,22 @@ class Gui(wx.Frame):
         self.Bind(wx.EVT_CLOSE, self.afsl)
 
         # set up statusbar
-        self.SetStatusBar(wx.StatusBar(self))
+        self.statusbar = wx.StatusBar(self)
+        self.statusbar.SetFieldsCount(3, [-1, 150, 80])
+        self.SetStatusBar(self.statusbar)
         self.SetStatusText("Ready.")
+        self.gauge = wx.Gauge(self.statusbar, range=100)
+        self.btn_cancel = wx.Button(self.statusbar, label="Cancel")
+        self.btn_cancel.Bind(wx.EVT_BUTTON, self.cancel_loading)
+        self.statusbar.Bind(wx.EVT_SIZE, self.on_statusbar_size)
+        self.gauge.Hide()
+        self.btn_cancel.Hide()
+        self.loader = None
+        self.expanding = False
+        self.results_dialog = None
+        self.stashed = None
+        self.attrcounts = {}
+        self.node_ids = {}
 
         # self.init_menus()
         menu_bar = wx.MenuBar()
@@ -715,6 +875,7 @@ class Gui(wx.Frame):
         self.tree.Bind(wx.EVT_LEFT_DCLICK, self.on_doubleclick)
         self.tree.Bind(wx.EVT_RIGHT_DOWN, self.on_rightdown)
         self.tree.Bind(wx.EVT_KEY_UP, self.on_keyup)
+        self.tree.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_expanding)
         vsizer = wx.BoxSizer(wx.VERTICAL)
         hsizer = wx.BoxSizer(wx.HORIZONTAL)
         hsizer.Add(self.tree, 1, wx.EXPAND)
@@ -738,6 +899,128 @@ class Gui(wx.Frame):
         """get screen title"""
         return self.GetTitle()
 
+    def update_display(self):
+        """show what has been changed while the application is still busy
+        """
+        wx.SafeYield(None, True)
+
+    @contextlib.contextmanager
+    def batch_update(self):
+        """make a number of changes to the tree that are shown all at once
+
+        batches can be nested, the tree is repainted when the outer one ends
+        """
+        self.tree.Freeze()
+        try:
+            yield
+        finally:
+            self.tree.Thaw()
+
+    def stash_tree(self):
+        """remember the contents of the current tree so it can be rebuilt
+
+        a tree control can't hold a second tree, so the items are copied
+        """
+
+        def push_el(node):
+            "copy item data recursively"
+            return (self.tree.GetItemText(node), self.tree.GetItemData(node),
+                    self.editor.pending.get(node), self.node_ids.get(node),
+                    [push_el(x) for x in self.get_node_children(node)])
+
+        self.stashed = push_el(self.top)
+        self.tree.DeleteAllItems()
+
+    def drop_stashed_tree(self):
+        "forget the tree that was put aside"
+        self.stashed = None
+
+    def restore_tree(self):
+        "rebuild the tree that was put aside and return its top"
+
+        def zetzeronder(node, el):
+            "add items recursively"
+            text, data, pending, node_id, children = el
+            self.tree.SetItemText(node, text)
+            if node_id is not None:
+                self.node_ids[node] = node_id
+            if data is not None:
+                self.tree.SetItemData(node, data)
+            if pending is not None:
+                self.editor.pending[node] = pending
+                self.tree.SetItemHasChildren(node, True)
+            for x in children:
+                zetzeronder(self.tree.AppendItem(node, ""), x)
+
+        self.tree.DeleteAllItems()
+        self.attrcounts = {}
+        self.node_ids = {}
+        self.top = self.tree.AddRoot("")
+        self.editor.pending = {}
+        zetzeronder(self.top, self.stashed)
+        self.stashed = None
+        return self.top
+
+    def load_in_background(self, events, on_batch, on_done, on_cancel):
+        """parse a file in a separate thread
+
+        on_batch is called for every batch of parse events, on_done when
+        everything has been read and on_cancel when loading is cancelled or
+        fails (with an error message)
+        """
+        self.load_callbacks = on_batch, on_done, on_cancel
+        self.loader = LoadThread(self, events)
+        self.show_loading(True)
+        self.loader.start()
+
+    def batch_loaded(self, loader, batch, done):
+        "handle the results of the loader thread"
+        if loader is self.loader and not loader.cancelled:
+            self.load_callbacks[0](batch)
+            self.gauge.SetValue(done)
+
+    def loading_finished(self, loader, message=""):
+        "the loader thread is done: wrap up or go back to what was shown"
+        if loader is not self.loader:  # already handled, e.g. when closing
+            return
+        self.loader = None
+        self.show_loading(False)
+        if loader.cancelled:
+            self.load_callbacks[2]()
+        elif message:
+            self.load_callbacks[2](message)
+        else:
+            self.load_callbacks[1]()
+
+    def cancel_loading(self, ev=None):
+        "stop the loader thread or the expansion of a subtree"
+        if self.loader is not None:
+            self.loader.cancelled = True
+        self.expanding = False
+
+    def show_loading(self, state, message="Loading..."):
+        "show or hide the progress gauge; no menu actions while loading"
+        self.gauge.SetValue(0)
+        self.gauge.Show(state)
+        self.btn_cancel.Show(state)
+        self.SetStatusText(message if state else "Ready.")
+        for menu, label in self.GetMenuBar().GetMenus():
+            for item in menu.GetMenuItems():
+                if not item.IsSeparator():
+                    item.Enable(not state)
+        if not state:
+            self.enable_pasteitems(bool(self.cut_el or self.cut_att))
+
+    def on_statusbar_size(self, ev=None):
+        "keep the progress gauge and cancel button in their statusbar fields"
+        rect = self.statusbar.GetFieldRect(1)
+        self.gauge.SetPosition((rect.x + 2, rect.y + 2))
+        self.gauge.SetSize((rect.width - 4, rect.height - 4))
+        rect = self.statusbar.GetFieldRect(2)
+        self.btn_cancel.SetPosition((rect.x + 1, rect.y + 1))
+        self.btn_cancel.SetSize((rect.width - 2, rect.height - 2))
+        ev.Skip()
+
     def init_menus(self, popup=False):
         """setup application menu"""
         accels = []
@@ -880,7 +1163,9 @@ class Gui(wx.Frame):
         "event handler for keyboard"
         ky = ev.GetKeyCode()
         item = self.tree.Selection
-        if item and item != self.top:
+        if ky == wx.WXK_ESCAPE and self.loader is not None:
+            self.cancel_loading()
+        elif item and item != self.top:
             if ky == wx.WXK_RETURN:
                 if self.tree.ItemHasChildren(item):
                     if self.tree.IsExpanded(item):
@@ -897,10 +1182,14 @@ class Gui(wx.Frame):
                 self.tree.SelectItem(self.tree.GetItemParent(item))
         ev.Skip()
 
-    def get_search_args(self):
-        """end dialog to get search argument(s)"""
+    def get_search_args(self, replace=False):
+        """end dialog to get search argument(s)
+
+        with `replace` also ask what to replace the found values with
+        """
         # self._search_args = []
-        with SearchDialog(self, title="Search options") as edt:
+        title = "Replace options" if replace else "Search options"
+        with SearchDialog(self, title=title, replace=replace) as edt:
             send = True
             while send:
                 ok = edt.ShowModal()
@@ -912,6 +1201,26 @@ class Gui(wx.Frame):
         print(send)
         return send
 
+    def replace_items(self, changes, description):
+        """give the nodes new names and values, repainting the tree only once
+
+        `changes` are (node, name, value, is_attr) tuples
+        """
+        with self.batch_update():
+            for node, name, value, is_attr in changes:
+                self.tree.SetItemText(
+                    node, self.editor.getshortname((name, value),
+                                                   attr=is_attr))
+                self.set_node_data(node, name, value)
+                self.editor.search_index.update(node, name, value)
+                self.editor.node_changed(node)
+
+    def show_search_results(self, title, results):
+        "show (node, is_attr, text) tuples for the search results in a list"
+        if self.results_dialog is None:
+            self.results_dialog = SearchResultsDialog(self)
+        self.results_dialog.show_results(title, results)
+
     def do_undo(self):
         "undo action"
 
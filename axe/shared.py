@@ -3,7 +3,11 @@ XMLEdit GUI-onafhankelijke code
 """
 
 import os
+import bz2
+import gzip
+import lzma
 import pathlib
+import sys
 
 # import sys
 # import shutil
@@ -12,8 +16,38 @@ import logging
 
 # from axe.gui import Gui
 
+
+def megabytes_from_env(name, default):
+    """return a size given in MB by an environment variable, in bytes
+
+    a value that isn't a number is reported and the default is used instead
+    """
+    value = os.environ.get(name, "")
+    try:
+        size = int(value) if value else default
+    except ValueError:
+        # not through the root logger, that would be set up before its time
+        logging.getLogger(__name__).warning(
+            "%s=%r is not a number of MB, using %s", name, value, default)
+        size = default
+    return size * 1024 * 1024
+
+
 ELSTART = "<>"
+# ways to interpret search arguments, with texts to choose them by
+SEARCH_MODES = ("text", "regex", "xpath")
+SEARCH_MODE_TEXTS = ("plain text", "regular expressions",
+                     "element name is an XPath")
 axe_iconame = str(pathlib.Path(__file__).parent / "axe.ico")
+# memory the undo history may take (in MB) before the oldest steps are dropped
+UNDO_BUDGET = megabytes_from_env("AXE_UNDO_MB", 64)
+# number of nodes to expand before the screen gets a chance to react
+EXPAND_BATCH = 500
+# compressed files: how they start and their extension; gzip is written at the
+# level the gzip command uses, the highest one costs much more time
+COMPRESSIONS = ((gzip, b"\x1f\x8b", ".gz"), (bz2, b"BZh", ".bz2"),
+                (lzma, b"\xfd7zXZ\x00", ".xz"))
+GZIP_LEVEL = 6
 # always log in program directory
 LOGFILE = pathlib.Path("/tmp/logs/axe_qt.log")
 LOGPLEASE = "DEBUG" in os.environ and os.environ["DEBUG"] != "0"
@@ -29,7 +63,223 @@ if LOGPLEASE:
     )
 
 
+def get_compression(fname, writing=False):
+    """return the module that (de)compresses a file, None for plain XML
+
+    what's in the file tells how it's compressed; a new or empty file goes by
+    its extension. When writing an extension that names a compression comes
+    first, so a file can be saved compressed under another name
+    """
+    by_ext = None
+    for module, magic, ext in COMPRESSIONS:
+        if fname.lower().endswith(ext):
+            by_ext = module
+    if writing and by_ext:
+        return by_ext
+    try:
+        with open(fname, "rb") as f:
+            start = f.read(6)
+    except OSError:
+        start = b""
+    if not start:
+        return by_ext
+    for module, magic, ext in COMPRESSIONS:
+        if start.startswith(magic):
+            return module
+    return None
+
+
+def compressed_stream(compression, fileobj, mode="rb", name=""):
+    """return a stream that (de)compresses while reading from or writing to an
+    open file, without unpacking the whole file anywhere
+
+    closing the stream leaves the file open. `name` is the file name gzip
+    records; otherwise it takes the name of the file written to
+    """
+    if compression is gzip:
+        return gzip.GzipFile(filename=os.path.basename(name), mode=mode,
+                             compresslevel=GZIP_LEVEL, fileobj=fileobj)
+    if compression is bz2:
+        return bz2.BZ2File(fileobj, mode)
+    return lzma.LZMAFile(fileobj, mode)
+
+
 def log(message):
     """if enabled, write a line to the log"""
     if LOGPLEASE:
         logging.info(message)
+
+
+class Node:
+    """an element or attribute apart from the visual tree, as kept on the
+    clipboard and by undo commands
+
+    a node without children gets an empty tuple instead of a list of its
+    own, so leaves (attributes mostly) cost as little as possible
+    """
+    __slots__ = ("title", "name", "value", "children")
+
+    def __init__(self, title="", name="", value="", children=()):
+        self.title = title
+        self.name = name
+        self.value = value
+        self.children = children
+
+    def is_attr(self):
+        "tell if this is an attribute"
+        return not self.title.startswith(ELSTART)
+
+    def walk(self):
+        "generate this node and everything below it, without recursion"
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def sizeof(self):
+        "return the number of bytes taken by this node and its descendants"
+        size = 0
+        for node in self.walk():
+            size += sys.getsizeof(node)
+            if node.children:
+                size += sys.getsizeof(node.children)
+        return size
+
+
+class TreeNode(Node):
+    """an element or attribute line in the "visual" tree, for a Gui that keeps
+    the tree itself
+
+    the same shape as the copies on the clipboard, with what's needed to
+    find one's way in the tree. The title of an element or attribute is
+    made from its name and value when it's shown, so the title kept is just
+    ELSTART for an element and an empty string for an attribute (see
+    set_title and label); other nodes keep the title they're given
+    """
+    __slots__ = ("parent", "expandable", "attrcount", "node_id")
+
+    def __init__(self, parent=None):
+        super().__init__()
+        self.parent = parent
+        self.expandable = False
+        self.attrcount = None
+        self.node_id = None
+
+    def insert(self, pos, node):
+        """put a node under this one at the given position (-1: at the end)
+        and return the position
+        """
+        if not self.children:  # a leaf shares the empty tuple
+            self.children = []
+        if pos == -1:
+            pos = len(self.children)
+        self.children.insert(pos, node)
+        node.parent = self
+        return pos
+
+    def set_title(self, title):
+        "keep as much of a title as can't be made from the name and value"
+        if title.startswith(ELSTART):
+            self.title = ELSTART
+        elif self.name:
+            self.title = ""
+        else:
+            self.title = title
+
+    def label(self, getshortname):
+        """return the title to show, using `getshortname` (see
+        base.Editor.getshortname) for an element or attribute
+        """
+        if not self.name:
+            return self.title
+        return getshortname((self.name, self.value), attr=self.is_attr())
+
+
+class Symbols:
+    """table of element and attribute names
+
+    every distinct name is stored once; nodes refer to the stored string or
+    to its number instead of keeping a copy of their own
+    """
+
+    def __init__(self):
+        self.names = []
+        self.numbers = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        "store a name if it's new and return its number"
+        try:
+            return self.numbers[name]
+        except KeyError:
+            pass
+        number = self.numbers[sys.intern(name)] = len(self.names)
+        self.names.append(name)
+        return number
+
+    def intern(self, name):
+        "return the stored copy of a name"
+        return self.names[self.add(name)]
+
+    def report(self, uses):
+        """describe the memory the names take compared to every node having
+        a copy of its own; `uses` holds the number of nodes per name
+        """
+        shared = sum(sys.getsizeof(name) for name in uses)
+        copied = sum(sys.getsizeof(name) * count
+                     for name, count in uses.items())
+        return "\n".join((
+            "{} nodes use {} different names".format(sum(uses.values()),
+                                                     len(uses)),
+            "(the table holds {} names)".format(len(self.names)),
+            "names stored once: {} bytes".format(shared),
+            "a copy for every node would take: {} bytes".format(copied),
+            "saved: {} bytes".format(copied - shared)))
+
+
+class Namespaces:
+    """the namespaces of a document, looked up by uri as well as by prefix
+
+    also remembers the short (prefixed) form of every qualified name it has
+    turned into one, so that's only worked out once per distinct name
+    """
+
+    def __init__(self, prefixes=None, uris=None):
+        self.prefixes = []
+        self.uris = []
+        self.by_prefix = {}
+        self.by_uri = {}
+        self.shortnames = {}
+        for prefix, uri in zip(prefixes or [], uris or []):
+            self.add(prefix, uri)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def add(self, prefix, uri):
+        "register a namespace"
+        self.prefixes.append(prefix)
+        self.uris.append(uri)
+        self.by_prefix[prefix] = uri
+        self.by_uri.setdefault(uri, prefix)  # the first prefix is used
+        self.shortnames.clear()  # names in this namespace can be shortened now
+
+    def shortname(self, fullname):
+        """return "prefix:localname" for a "{uri}localname" qualified name
+
+        names without a (known) namespace are returned as they are
+        """
+        try:
+            return self.shortnames[fullname]
+        except KeyError:
+            pass
+        name = fullname
+        if fullname.startswith("{"):
+            uri, localname = fullname[1:].split("}")
+            if uri in self.by_uri:
+                name = ":".join((self.by_uri[uri], localname))
+        name = self.shortnames[fullname] = sys.intern(name)
+        return name
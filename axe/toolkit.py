@@ -1,2 +1,2 @@
-# voor nu: qt of wx
+# voor nu: qt of wx (of headless, zonder scherm)
 toolkit = "qt"
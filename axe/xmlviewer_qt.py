@@ -1,5 +1,8 @@
 """aangepaste versie van tree-based XML-editor, bedoeld als read-only en een
 ietsje verder platgeslagen weergave
+
+the tree view gets its data directly from the ElementTree through a model,
+so elements are not copied into tree widget items
 """
 
 import os
@@ -16,54 +19,170 @@ from .axe_base import (
     TITEL,
     axe_iconame,
     AxeMixin,
+    MappedElement,
 )
+from .shared import Namespaces
 
 from axe.intl import _
 
 TITEL = TITEL.replace("editor", "viewer")
 if os.name == "nt":
-    HMASK = "XML files (*.xml);;All files (*.*)"
+    HMASK = ("XML files (*.xml);;"
+             "Compressed XML files (*.xml.gz *.xml.bz2 *.xml.xz);;"
+             "All files (*.*)")
 elif os.name == "posix":
-    HMASK = "XML files (*.xml *.XML);;All files (*.*)"
+    HMASK = ("XML files (*.xml *.XML);;"
+             "Compressed XML files (*.xml.gz *.xml.bz2 *.xml.xz);;"
+             "All files (*.*)")
 IMASK = "All files (*.*)"
 
 
-def calculate_location(win, node):
-    """attempt to calculate some kind of identification for a tree node
+def flatten_tree(element, reverse=False):
+    """generate the tree's structure in document order, or in reverse order
 
-    Returns:
-        tuple: subsequent indices of a child under its parent, which
-            possibly can be used in the replacements dictionary.
+    attributes are not shown as separate nodes, so an attribute is known by
+    the element it belongs to and its position there
     """
-    id_ = []
-    while node != win.top:
-        idx = node.parent().indexOfChild(node)
-        id_.insert(0, idx)
-        node = node.parent()
-    return tuple(id_)
+    def entry(el):
+        "the data to search in for an element"
+        return el, el.tag, el.text or "", [((el, ix), x, y) for ix, (x, y)
+                                           in enumerate(el.items())]
+
+    if not reverse:
+        for el in element.iter():
+            yield entry(el)
+        return
+    stack = [(element, False)]
+    while stack:
+        el, done = stack.pop()
+        if done:  # subelements have been done
+            yield entry(el)
+        else:
+            stack.append((el, True))
+            stack.extend((x, False) for x in el)
 
 
-def flatten_tree(element):
-    """return the tree's structure as a flat list
-    probably nicer as a generator function
+class Row:
+    """a line in the tree that doesn't correspond to an element
+    (file name, namespaces)
     """
-    itemdict = element.data(0, core.Qt.UserRole)
-    if itemdict:
-        elem_list = [
-            (
-                element, itemdict["tag"],
-                itemdict["text"] or "",
-                itemdict["attrs"]
-            )
-        ]
-    else:
-        elem_list = [(element, "", "", [])]
-    subel_list = []
-    for seq in range(element.childCount()):
-        subitem = element.child(seq)
-        subel_list = flatten_tree(subitem)
-        elem_list.extend(subel_list)
-    return elem_list
+
+    def __init__(self, text, children=None):
+        self.text = text
+        self.children = children or []
+
+    def __len__(self):
+        return len(self.children)
+
+    def __getitem__(self, row):
+        return self.children[row]
+
+
+class ElementTreeModel(core.QAbstractItemModel):
+    """read-only model that takes its data straight from the ElementTree
+
+    The parent of a node is only remembered when the view asks for the node,
+    so building the model costs nothing and memory use grows with the number
+    of rows that have been shown
+    """
+
+    def __init__(self, title="", root=None, namespaces=None, parent=None):
+        super().__init__(parent)
+        self.namespaces = namespaces or Namespaces()
+        top = Row(title)
+        if root is not None:
+            if self.namespaces:
+                top.children.append(Row("namespaces", [
+                    Row("{}: {}".format(prf, uri)) for prf, uri in zip(
+                        self.namespaces.prefixes, self.namespaces.uris)
+                ]))
+            top.children.append(root)
+        self.rt = root
+        self.invisible_root = Row("", [top])
+        self.parents = {top: (self.invisible_root, 0)}  # node: (parent, row)
+        for row, child in enumerate(top.children):
+            self.parents[child] = (top, row)
+
+    def get_node(self, index):
+        "return the element or Row behind a model index"
+        if index.isValid():
+            return index.internalPointer()
+        return self.invisible_root
+
+    def index(self, row, column, parent=core.QModelIndex()):
+        "reimplemented: create an index for a row under the given parent"
+        if not self.hasIndex(row, column, parent):
+            return core.QModelIndex()
+        node = self.get_node(parent)
+        child = node[row]
+        self.parents[child] = (node, row)
+        return self.createIndex(row, column, child)
+
+    def parent(self, index=None):
+        "reimplemented: create an index for the parent of the given index"
+        if index is None:  # QObject.parent()
+            return super().parent()
+        if not index.isValid():
+            return core.QModelIndex()
+        parent, row = self.parents[index.internalPointer()]
+        if parent is self.invisible_root:
+            return core.QModelIndex()
+        row = self.parents[parent][1]
+        return self.createIndex(row, 0, parent)
+
+    def rowCount(self, parent=core.QModelIndex()):
+        "reimplemented: number of children of the given node"
+        if parent.column() > 0:
+            return 0
+        return len(self.get_node(parent))
+
+    def columnCount(self, parent=core.QModelIndex()):
+        "reimplemented: there's only one column"
+        return 1
+
+    def data(self, index, role=core.Qt.DisplayRole):
+        "reimplemented: get the text etc. straight from the element"
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if isinstance(node, Row):
+            if role == core.Qt.DisplayRole:
+                return node.text
+            return None
+        value = node.text or ""
+        if role == core.Qt.DisplayRole:
+            return getshortname(((node.tag, value), self.namespaces))
+        if role == core.Qt.ToolTipRole:
+            attrs = node.items()
+            if attrs:
+                value += "\n--------------------\n" + "\n".join(
+                    ["{}: {}".format(x, y) for x, y in sorted(attrs)]
+                )
+            return value
+        if role == core.Qt.UserRole:
+            return node
+        return None
+
+    def index_for(self, element):
+        """return the model index for an element that may not have been shown
+
+        the first time this is needed the parents of all elements are
+        determined in one pass; for a file that's viewed through a memory map
+        only the elements above this one are looked up
+        """
+        if isinstance(element, MappedElement):
+            # the view has to get the element it's been given before
+            element = self.rt.tree.element(element.index)
+            node = element
+            while node not in self.parents:
+                self.parents[node] = node.locate()
+                node = self.parents[node][0]
+        elif element not in self.parents:
+            for parent in self.rt.iter():
+                for row, child in enumerate(parent):
+                    self.parents[child] = (parent, row)
+        parent, row = self.parents[element]
+        return self.createIndex(row, 0, element)
 
 
 # Dialog windows
@@ -203,8 +322,8 @@ class SearchDialog(qtw.QDialog):
     #     super().done(qtw.QDialog.Rejected)
 
 
-class VisualTree(qtw.QTreeWidget):
-    """Tree widget subclass overriding some event handlers"""
+class VisualTree(qtw.QTreeView):
+    """Tree view subclass overriding some event handlers"""
 
     def __init__(self, parent):
         self.parent = parent
@@ -212,18 +331,9 @@ class VisualTree(qtw.QTreeWidget):
 
     def mouseDoubleClickEvent(self, event):  # noqa N802
         "reimplemented to reject when on root element"
-        item = self.itemAt(event.x(), event.y())
-        if item:
-            if item == self.parent.top:
-                edit = False
-            else:
-                # data = str(item.text(0))
-                edit = True
-                # if data.startswith(ELSTART):
-                # if item.childCount() > 0:
-                # edit = False
-        if edit:
-            self.parent.edit()
+        item = self.indexAt(event.pos())
+        if item.isValid() and item != self.parent.top:
+            super().mouseDoubleClickEvent(event)
         else:
             event.ignore()
 
@@ -231,8 +341,8 @@ class VisualTree(qtw.QTreeWidget):
         "reimplemented to show popup menu when applicable"
         if event.button() == core.Qt.RightButton:
             xc, yc = event.x(), event.y()
-            item = self.itemAt(xc, yc)
-            if item and item != self.parent.top:
+            item = self.indexAt(event.pos())
+            if item.isValid() and item != self.parent.top:
                 # self.parent.setCurrentItem(item)
                 menu = self.parent._init_menus(popup=True)
                 menu.exec_(core.QPoint(xc, yc))
@@ -257,43 +367,13 @@ class MainFrame(qtw.QMainWindow, AxeMixin):
 
     def init_tree(self, root, prefixes=None, uris=None, name=""):
         "set up display tree"
-
-        def add_to_tree(el, rt):
-            "recursively add elements"
-            self.item = rt
-            rr = self._add_item(el)
-            # log(calculate_location(self, rr))
-            # for attr in el.keys():
-            #     h = el.get(attr)
-            #     if not h:
-            #         h = '""'
-            #     self.item = rr
-            #     self._add_item(attr, h, attr=True)
-            for subel in list(el):
-                add_to_tree(subel, rr)
-
-        self.tree.clear()  # DeleteAllItems()
         titel = AxeMixin.init_tree(self, root, prefixes, uris, name)
-        self.top = qtw.QTreeWidgetItem()
-        self.top.setText(0, titel)
-        self.tree.addTopLevelItem(self.top)  # AddRoot(titel)
+        self.model = ElementTreeModel(titel, root, self.namespaces,
+                                      parent=self.tree)
+        self.tree.setModel(self.model)
+        self.top = self.model.index(0, 0)
         self.setWindowTitle(" - ".join((os.path.basename(titel), TITEL)))
-        if not root:
-            return
-        # eventuele namespaces toevoegen
-        namespaces = False
-        for ix, prf in enumerate(self.ns_prefixes):
-            if not namespaces:
-                ns_root = qtw.QTreeWidgetItem(["namespaces"])
-                self.top.addChild(ns_root)
-                namespaces = True
-            ns_item = qtw.QTreeWidgetItem()
-            ns_item.setText(0, "{}: {}".format(prf, self.ns_uris[ix]))
-            ns_root.addChild(ns_item)
-        self.item = self.top
-        rt = self._add_item(self.rt)
-        for el in list(self.rt):
-            add_to_tree(el, rt)
+        self.tree.expand(self.top)
 
     # internals
     def _init_gui(self):
@@ -314,7 +394,7 @@ class MainFrame(qtw.QMainWindow, AxeMixin):
         self._init_menus()
 
         self.tree = VisualTree(self)
-        self.tree.headerItem().setHidden(True)
+        self.tree.header().setHidden(True)
         self.setCentralWidget(self.tree)
         self.in_dialog = False
 
@@ -435,72 +515,56 @@ class MainFrame(qtw.QMainWindow, AxeMixin):
         a message (if requested). Also return False in that case
         """
         sel = True
-        self.item = self.tree.currentItem()
+        self.item = self.tree.currentIndex()
         log("in checkselection: self.item {}".format(self.item))
-        if message and (self.item is None or self.item == self.top):
+        if message and (not self.item.isValid() or self.item == self.top):
             self._meldinfo("You need to select an element or attribute first")
             sel = False
         return sel
 
-    def _add_item(self, element):  # , before=False, below=True, attr=False):
-        """execute adding of item"""
-        name, value, attrs = element.tag, element.text, element.items()
-        itemdict = {"tag": name, "text": value, "attrs": attrs}
-        log("in _add_item for {} value {} attrs {}".format(name, value, attrs))
-        if value is None:
-            value = ""
-        itemtext = getshortname(((name, value), self.ns_prefixes,
-                                 self.ns_uris))
-        new = qtw.QTreeWidgetItem()
-        new.setText(0, itemtext)
-        new.setData(0, core.Qt.UserRole, itemdict)
-        tooltiptext = value
-        if itemdict["attrs"]:
-            tooltiptext += "\n--------------------\n" + "\n".join(
-                ["{}: {}".format(x, y) for x, y in sorted(itemdict["attrs"])]
-            )
-        new.setToolTip(0, tooltiptext)
-        log("add under {}".format(self.item))
-        self.item.addChild(new)
-        return new
-
     # exposed
     def popupmenu(self, item):
         """call up menu"""
         log("self.popupmenu called")
         menu = self._init_menus(popup=True)
         menu.exec_(self.tree.mapToGlobal(
-            self.tree.visualItemRect(item).bottomRight()
+            self.tree.visualRect(item).bottomRight()
         ))
 
     def quit(self):
         "close the application"
         self.close()
 
+    def closeEvent(self, event):
+        "reimplemented: let go of the file that's shown"
+        self.close_tree()
+        super().closeEvent(event)
+
     def on_keyup(self, ev=None):
         "handle keyboard event"
         ky = ev.key()
-        item = self.tree.currentItem()
+        item = self.tree.currentIndex()
         skip = False
-        if item and item != self.top:
+        if item.isValid() and item != self.top:
             if ky == core.Qt.Key_Return:
                 if self.in_dialog:
                     self.in_dialog = False
                 else:
-                    if item.childCount() > 0:
-                        if item.isExpanded():
-                            self.tree.collapseItem(item)
-                            self.tree.setCurrentItem(item.parent())
+                    if self.model.rowCount(item) > 0:
+                        if self.tree.isExpanded(item):
+                            self.tree.collapse(item)
+                            self.tree.setCurrentIndex(item.parent())
                         else:
-                            self.tree.expandItem(item)
-                            self.tree.setCurrentItem(item.child(0))
+                            self.tree.expand(item)
+                            self.tree.setCurrentIndex(
+                                self.model.index(0, 0, item))
                     # else:
                     #     self.edit()
                 skip = True
             elif ky == core.Qt.Key_Backspace:
-                if item.isExpanded():
-                    self.tree.collapseItem(item)
-                    self.tree.setCurrentItem(item.parent())
+                if self.tree.isExpanded(item):
+                    self.tree.collapse(item)
+                    self.tree.setCurrentIndex(item.parent())
                 skip = True
             elif ky == core.Qt.Key_Menu:
                 self.popupmenu(item)
@@ -512,20 +576,20 @@ class MainFrame(qtw.QMainWindow, AxeMixin):
 
         def expand_with_children(item):
             "do it recursively"
-            self.tree.expandItem(item)
-            for ix in range(item.childCount()):
-                expand_with_children(item.child(ix))
+            self.tree.expand(item)
+            for ix in range(self.model.rowCount(item)):
+                expand_with_children(self.model.index(ix, 0, item))
 
-        item = self.tree.currentItem()
-        if item:
+        item = self.tree.currentIndex()
+        if item.isValid():
             expand_with_children(item)
             self.tree.resizeColumnToContents(0)
 
     def collapse(self):
         "collapse tree item"
-        item = self.tree.currentItem()
-        if item:
-            self.tree.collapseItem(
+        item = self.tree.currentIndex()
+        if item.isValid():
+            self.tree.collapse(
                 item
             )  # mag eventueel recursief in overeenstemming met vorige
             self.tree.resizeColumnToContents(0)
@@ -549,10 +613,12 @@ class MainFrame(qtw.QMainWindow, AxeMixin):
     def search_next(self, reverse=False):
         "find (default is forward)"
         found, is_attr = find_next(
-            flatten_tree(self.top), self.search_args, reverse, self._search_pos
+            flatten_tree(self.rt, reverse), self.search_args, reverse,
+            self._search_pos
         )  # self.tree.top.child(0)
-        if found:
-            self.tree.setCurrentItem(found)
+        if found is not None:
+            element = found[0] if is_attr else found
+            self.tree.setCurrentIndex(self.model.index_for(element))
             self._search_pos = (found, is_attr)
         else:
             self._meldinfo(_("Niks (meer) gevonden"))
@@ -21,56 +21,44 @@ from .axe_base import (
 
 TITEL = TITEL.replace("editor", "viewer")
 if os.name == "nt":
-    HMASK = "XML files (*.xml)|*.xml|All files (*.*)|*.*"
+    HMASK = ("XML files (*.xml)|*.xml|"
+             "Compressed XML files (*.xml.gz, *.xml.bz2, *.xml.xz)|"
+             "*.xml.gz;*.xml.bz2;*.xml.xz|All files (*.*)|*.*")
 elif os.name == "posix":
-    HMASK = "XML files (*.xml, *.XML)|*.xml;*.XML|All files (*.*)|*.*"
+    HMASK = ("XML files (*.xml, *.XML)|*.xml;*.XML|"
+             "Compressed XML files (*.xml.gz, *.xml.bz2, *.xml.xz)|"
+             "*.xml.gz;*.xml.bz2;*.xml.xz|All files (*.*)|*.*")
 IMASK = "All files|*.*"
 
 
-def calculate_location(win, node):
-    """attempt to calculate some kind of identification for a tree node
+def flatten_tree(tree, element, reverse=False):
+    """generate the tree's structure in document order, or in reverse order
 
-    Returns:
-        tuple: subsequent indices of a child under its parent, which
-            possibly can be used in the replacements dictionary
+    the tree is walked without recursion, and only as far as needed
     """
-    id_table = []
-    while node != win.top:
-        # idx = node.parent().indexOfChild(node)
-        parent_node = win.tree.GetItemParent(node)
-        pos = 0
-        tag, c = win.tree.GetFirstChild(node)
+    stack = [(element, None)]
+    while stack:
+        node, entry = stack.pop()
+        if entry is not None:  # subelements have been done
+            yield entry
+            continue
+        itemdict = tree.GetItemData(node)
+        if itemdict:
+            entry = (node, itemdict["tag"], itemdict["text"] or "",
+                     itemdict["attrs"])
+        else:
+            entry = (node, "", "", [])
+        subnodes = []
+        tag, c = tree.GetFirstChild(node)
         while tag.IsOk() and tag != node:
-            pos += 1
-            tag, c = win.tree.GetNextChild(node, c)
-        id_table.insert(0, pos)
-        node = node.parent()
-        node = parent_node
-    return tuple(id_table)
-
-
-def flatten_tree(element):
-    """return the tree's structure as a flat list
-    probably nicer as a generator function
-    """
-    # itemdict = element.data(0, core.Qt.UserRole)
-    itemdict = win.tree.GetItemData(element)
-    if itemdict:
-        elem_list = [
-            (element, itemdict["tag"], itemdict["text"] or "", itemdict["attrs"])
-        ]
-    else:
-        elem_list = [(element, "", "", [])]
-    subel_list = []
-    # for seq in range(element.childCount()):
-    tag, c = win.tree.GetFirstChild(element)
-    while tag.IsOk() and tag != element:
-        # subitem = element.child(seq)
-        # subel_list = flatten_tree(subitem)
-        subel_list = flatten_tree(tag)
-        elem_list.extend(subel_list)
-        tag, c = win.tree.GetNextChild(element, c)
-    return elem_list
+            subnodes.append((tag, None))
+            tag, c = tree.GetNextChild(node, c)
+        if reverse:
+            stack.append((node, entry))
+            stack.extend(subnodes)
+        else:
+            yield entry
+            stack.extend(reversed(subnodes))
 
 
 class SearchDialog(wx.Dialog):
@@ -266,6 +254,7 @@ class MainFrame(wx.Frame, AxeMixin):
 
     def afsl(self, ev=None):
         """handle CLOSE event"""
+        self.close_tree()
         ev.Skip()
 
     # reimplemented methods from Mixin
@@ -279,7 +268,7 @@ class MainFrame(wx.Frame, AxeMixin):
         def add_to_tree(el, rt):
             "recursively add elements"
             h = (el.tag, el.text)
-            rr = self.tree.AppendItem(rt, getshortname((h, prefixes, uris)))
+            rr = self.tree.AppendItem(rt, getshortname((h, self.namespaces)))
             self.tree.SetItemData(rr, h)
             for attr in el.keys():
                 h = el.get(attr)
@@ -287,7 +276,7 @@ class MainFrame(wx.Frame, AxeMixin):
                     h = '""'
                 h = (attr, h)
                 rrr = self.tree.AppendItem(
-                    rr, getshortname((h, prefixes, uris), attr=True)
+                    rr, getshortname((h, self.namespaces), attr=True)
                 )
                 self.tree.SetItemData(rrr, h)
             for subel in list(el):
@@ -299,7 +288,7 @@ class MainFrame(wx.Frame, AxeMixin):
         self.SetTitle(" - ".join((os.path.basename(titel), TITEL)))
 
         h = (self.rt.tag, self.rt.text)
-        rt = self.tree.AppendItem(self.top, getshortname((h, prefixes, uris)))
+        rt = self.tree.AppendItem(self.top, getshortname((h, self.namespaces)))
         self.tree.SetItemData(rt, h)
         for el in list(self.rt):
             add_to_tree(el, rt)
@@ -481,7 +470,8 @@ class MainFrame(wx.Frame, AxeMixin):
     def search_next(self, reverse=False):
         "find (default is forward)"
         found, is_attr = find_next(
-            flatten_tree(self.top), self.search_args, reverse, self._search_pos
+            flatten_tree(self.tree, self.top, reverse), self.search_args,
+            reverse, self._search_pos
         )  # self.tree.top.child(0)
         if found:
             # self.tree.setCurrentItem(found)
@@ -0,0 +1,56 @@
+"""tests for editing files from the command line
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from axe import batch
+
+
+class BatchTest(unittest.TestCase):
+    "batch.main"
+
+    def write(self, text):
+        "put some text in a file that's removed afterwards"
+        fd, fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        self.addCleanup(os.remove, fname)
+        return fname
+
+    def run_batch(self, *args):
+        "return the exit status and what's written to stdout and stderr"
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = batch.main(list(args))
+        return status, out.getvalue(), err.getvalue()
+
+    def test_matches(self):
+        "a file that's read gives its number of matches"
+        fname = self.write("<r><a/><a/></r>")
+        status, out, err = self.run_batch("-q", "-e", "a", fname)
+        self.assertEqual(status, 0)
+        self.assertEqual(out, "{}: 2\n".format(fname))
+
+    def test_malformed_file(self):
+        "a file that can't be parsed makes the exit status nonzero"
+        fname = self.write("<r><a></r>")
+        status, out, err = self.run_batch("-q", "-e", "a", fname)
+        self.assertEqual(status, 1)
+        self.assertEqual(out, "")
+        self.assertTrue(err)
+
+    def test_missing_file(self):
+        "so does a file that isn't there"
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        fname = os.path.join(tempdir.name, "missing.xml")
+        status, out, err = self.run_batch("-q", "-e", "a", fname)
+        self.assertEqual(status, 1)
+        self.assertEqual(out, "")
+
+
+if __name__ == "__main__":
+    unittest.main()
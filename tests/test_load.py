@@ -0,0 +1,82 @@
+"""tests for reading a document, without a screen
+"""
+import os
+import tempfile
+import unittest
+
+from axe.base import Editor, ELSTART, NEW_ROOT, et
+from axe.gui_headless import Gui
+
+
+class LoadTest(unittest.TestCase):
+    "Editor.load_xml"
+
+    def write(self, text):
+        "put some text in a file that's removed afterwards"
+        fd, fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        self.addCleanup(os.remove, fname)
+        return fname
+
+    def test_load(self):
+        "the document is shown and the file becomes the current one"
+        fname = self.write('<r><a x="1">t</a></r>')
+        editor = Editor(fname, gui_class=Gui)
+        self.assertEqual(editor.xmlfn, fname)
+        self.assertEqual(editor.gui.get_node_title(editor.gui.get_treetop()),
+                         "<> r")
+
+    def test_walk_tree(self):
+        "the nodes come in document order, attributes before subelements"
+        editor = Editor(self.write('<r><a x="1"><b/></a><c/></r>'),
+                        gui_class=Gui)
+        self.assertEqual(
+            [editor.gui.get_node_title(x)
+             for x in editor.walk_tree(editor.gui.get_treetop())],
+            ["<> r", "<> a", "x = 1", "<> b", "<> c"])
+
+    def test_titles_not_kept(self):
+        "titles are made from the names and values when they're asked for"
+        editor = Editor(self.write('<r><a x="1">t</a></r>'), gui_class=Gui)
+        element = editor.gui.get_treetop().children[0]
+        attr = element.children[0]
+        self.assertEqual((element.title, attr.title), (ELSTART, ""))
+        self.assertEqual(editor.gui.get_node_title(element), "<> a: t")
+        self.assertEqual(editor.gui.get_node_title(attr), "x = 1")
+        self.assertTrue(editor.gui.is_element(element))
+        self.assertFalse(editor.gui.is_element(attr))
+
+    def test_root_kept_without_children(self):
+        "only the root's name and text are kept, not the parsed tree"
+        editor = Editor(self.write('<r x="1">t<a>1</a><b/></r>'),
+                        gui_class=Gui)
+        self.assertEqual((editor.rt.tag, editor.rt.text), ("r", "t"))
+        self.assertEqual(len(editor.rt), 0)
+        self.assertEqual(editor.rt.keys(), [])
+
+    def test_parse_error_keeps_document(self):
+        "a file that can't be parsed leaves the open document as it was"
+        editor = Editor(self.write("<r><a>1</a></r>"), gui_class=Gui)
+        old = editor.xmlfn
+        editor.mark_dirty(True)
+        with self.assertRaises(et.ParseError):
+            editor.load_xml(self.write("<r><a>1</a>"))
+        self.assertEqual(editor.xmlfn, old)
+        self.assertTrue(editor.tree_dirty)
+        rt = editor.gui.get_treetop()
+        self.assertEqual(editor.gui.get_node_title(rt), "<> r")
+        self.assertEqual(len(editor.gui.get_node_children(rt)), 1)
+        self.assertIsNone(editor.stashed)
+
+    def test_parse_error_on_start(self):
+        "when the first file can't be read the editor has a new document"
+        editor = Editor(self.write("<r>"), gui_class=Gui)
+        self.assertEqual(editor.xmlfn, "")
+        self.assertTrue(editor.load_error)
+        self.assertEqual(editor.gui.get_node_title(editor.gui.get_treetop()),
+                         "<> " + NEW_ROOT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""tests for viewing a document straight from the file
+"""
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as et
+
+from axe import axe_base
+
+
+class MappedTreeTest(unittest.TestCase):
+    "MappedTree compared to what ElementTree makes of the same file"
+
+    def setUp(self):
+        cachedir = tempfile.TemporaryDirectory()
+        self.addCleanup(cachedir.cleanup)
+        patcher = mock.patch.object(axe_base, "CACHE_DIR",
+                                    pathlib.Path(cachedir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open(self, data):
+        "write the data to a file and map it"
+        fd, fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.addCleanup(os.remove, fname)
+        tree = axe_base.MappedTree(fname)
+        self.addCleanup(tree.close)
+        return tree, et.parse(fname).getroot()
+
+    def assertSame(self, tree, root):
+        "every element has the same name, text and attributes"
+        for mapped, parsed in zip(tree.getroot().iter(), root.iter()):
+            self.assertEqual(mapped.tag, parsed.tag)
+            self.assertEqual(mapped.text, parsed.text or "")
+            self.assertEqual(mapped.items(), parsed.items())
+            self.assertEqual(len(mapped), len(parsed))
+        self.assertEqual(len(list(tree.getroot().iter())),
+                         len(list(root.iter())))
+
+    def test_elements(self):
+        "text, attributes, entities and comments"
+        self.assertSame(*self.open(
+            b'<?xml version="1.0"?>\n<!DOCTYPE r [<!ENTITY e "ENT">]>\n'
+            b'<r a="1">top<!--c--><x b="2">t &lt; &e;<y/>after</x>tail'
+            b'<e/><f k=""><![CDATA[cd<>]]></f></r>'))
+
+    def test_namespaces(self):
+        "namespaces declared, redeclared and reset further down"
+        self.assertSame(*self.open(
+            b'<r xmlns="http://d/" xmlns:p="http://p/"><p:a xmlns:p="http://'
+            b'p2/"><b xmlns="" p:k="v"><p:c/><d/></b></p:a><p:e/></r>'))
+
+    def test_compact_index(self):
+        "the positions and counts take 4 bytes each for a file like this"
+        tree, root = self.open(b"<r><a/><b/></r>")
+        self.assertEqual([x.itemsize for x in tree.arrays()], [4, 4, 4, 4])
+        self.assertEqual(axe_base.get_typecodes(2 ** 32), ("q", "i"))
+
+    def test_close(self):
+        "the file is let go of"
+        tree, root = self.open(b"<r><a/></r>")
+        tree.close()
+        self.assertTrue(tree.map.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,281 @@
+"""tests for writing a document, without a screen
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as et
+
+from axe import base
+from axe.base import Editor
+from axe.gui_headless import Gui
+from axe.shared import COMPRESSIONS
+
+DOCUMENT = ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<r xmlns="http://d/" xmlns:p="http://p/" p:k="v">\n'
+            '  <a x="1 &lt; 2 &amp; &quot;3&quot;" y="&#10;&#9;">t &lt; &gt;'
+            ' &amp; €</a>\n'
+            '  <p:b><c/><c>more text</c></p:b>\n'
+            '  <d xmlns="">no namespace<e p:z="0"/></d>\n'
+            '</r>\n')
+
+
+def structure(el):
+    "an element and everything below it as nested tuples"
+    return (el.tag, sorted(el.items()), (el.text or "").strip(),
+            [structure(x) for x in el])
+
+
+class SaveTestCase(unittest.TestCase):
+    "a directory to save in"
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.dirname = tempdir.name
+
+    def write(self, text, name="doc.xml"):
+        "put some text in a file in the directory"
+        fname = os.path.join(self.dirname, name)
+        with open(fname, "w", encoding="utf-8") as f:
+            f.write(text)
+        return fname
+
+    def read(self, fname):
+        "return what's in a file"
+        with open(fname, "rb") as f:
+            return f.read()
+
+    def canonical(self, fname):
+        """the document in a file in a form that can be compared: names with
+        their namespaces, whichever prefixes are used
+        """
+        return structure(et.parse(fname).getroot())
+
+    def save_as(self, editor, name, full=False):
+        """save the document under another name in the directory and return
+        that; `full` writes everything anew
+        """
+        if full:
+            editor.layout.discard()
+        editor.xmlfn = os.path.join(self.dirname, name)
+        editor.writexml()
+        return editor.xmlfn
+
+
+class WriterTest(SaveTestCase):
+    "XMLWriter"
+
+    def test_round_trip(self):
+        "what's written reads back as the same document"
+        fname = self.write(DOCUMENT)
+        saved = self.save_as(Editor(fname, gui_class=Gui), "out.xml",
+                             full=True)
+        self.assertEqual(self.canonical(saved), self.canonical(fname))
+        self.assertTrue(self.read(saved).startswith(
+            b"<?xml version='1.0' encoding='utf-8'?>\n"))
+
+    def test_lazy_round_trip(self):
+        "subtrees that were never shown are written as they were read"
+        fname = self.write(DOCUMENT)
+        with mock.patch.object(base, "LAZY_LOAD_SIZE", 0):
+            editor = Editor(fname, gui_class=Gui)
+        self.assertTrue(editor.pending)
+        saved = self.save_as(editor, "out.xml", full=True)
+        self.assertEqual(self.canonical(saved), self.canonical(fname))
+
+    def test_changes_written(self):
+        "renamed elements, changed texts and added attributes"
+        fname = self.write(DOCUMENT)
+        editor = Editor(fname, gui_class=Gui)
+        top = editor.gui.get_treetop()
+        a = top.children[1]
+        editor.gui.replace_items([(a, "{http://p/}a", "new & <text>", False)],
+                                 "Replace")
+        editor.add_item(a, "{http://other/}n", 'a "value"', attr=True)
+        saved = self.save_as(editor, "out.xml", full=True)
+        expected = et.parse(fname).getroot()
+        element = expected[0]
+        element.tag, element.text = "{http://p/}a", "new & <text>"
+        element.set("{http://other/}n", 'a "value"')
+        self.assertEqual(self.canonical(saved), structure(expected))
+
+
+class IncrementalSaveTest(SaveTestCase):
+    "saving with what hasn't changed copied from the file (see Layout)"
+
+    odd = b"<b  x = '1' ><c/>\n  </b >"  # what a rewrite would change
+
+    def setUp(self):
+        super().setUp()
+        self.fname = self.write(
+            '<r>\n  <a k="v">t</a>\n  ' + self.odd.decode() +
+            '\n  <d><e>1</e><e>2</e></d>\n</r>\n')
+
+    def edit(self, editor):
+        "change a few things, leaving b alone"
+        top = editor.gui.get_treetop()
+        a, b, d = top.children
+        editor.gui.replace_items([(a, "a", "changed", False)], "Replace")
+        editor.add_item(d, "f", "added")
+        editor.gui.copy(d.children[0], cut=True, retain=False)
+
+    def check(self, editor, expect_copied=True):
+        """save the document as it is and in full, the results should mean
+        the same; only the first one has b as it was in the file
+        """
+        saved = self.save_as(editor, "incremental.xml")
+        full = self.save_as(editor, "full.xml", full=True)
+        self.assertEqual(self.canonical(saved), self.canonical(full))
+        self.assertEqual(self.odd in self.read(saved), expect_copied)
+        self.assertNotIn(self.odd, self.read(full))
+        return saved
+
+    def test_unchanged(self):
+        "an unchanged document is copied as it is"
+        editor = Editor(self.fname, gui_class=Gui)
+        saved = self.save_as(editor, "incremental.xml")
+        self.assertEqual(self.read(saved).split(b"\n", 1)[1].rstrip(),
+                         self.read(self.fname).rstrip())
+
+    def test_edited(self):
+        "what's been changed is written anew, the rest is copied"
+        editor = Editor(self.fname, gui_class=Gui)
+        self.edit(editor)
+        saved = self.check(editor)
+        self.assertIn(b'<a k="v">changed</a>', self.read(saved))
+
+    def test_saved_again(self):
+        "after saving, the file just written is copied from"
+        editor = Editor(self.fname, gui_class=Gui)
+        self.edit(editor)
+        editor.xmlfn = os.path.join(self.dirname, "first.xml")
+        editor.writexml()
+        self.assertEqual(editor.layout.fname, editor.xmlfn)
+        d = editor.gui.get_treetop().children[2]
+        editor.add_item(d, "g", "again")
+        self.check(editor)
+
+    def test_lazy(self):
+        "elements that aren't shown yet are copied too"
+        with mock.patch.object(base, "LAZY_LOAD_SIZE", 0):
+            editor = Editor(self.fname, gui_class=Gui)
+        self.assertTrue(editor.pending)
+        self.edit(editor)
+        self.check(editor)
+
+
+class SafeSaveTest(SaveTestCase):
+    "the file is replaced in one go and the old version kept as backup"
+
+    def setUp(self):
+        super().setUp()
+        self.fname = self.write(DOCUMENT)
+        self.old = self.read(self.fname)
+        self.editor = Editor(self.fname, gui_class=Gui)
+        top = self.editor.gui.get_treetop()
+        self.editor.add_item(top, "new", "element")
+        self.editor.mark_dirty(True)
+
+    def leftovers(self):
+        "files in the directory besides the document and its backup"
+        return sorted(set(os.listdir(self.dirname)) - {"doc.xml",
+                                                       "doc.xml.bak"})
+
+    def test_replace_fails(self):
+        "a save that goes wrong at the end leaves everything as it was"
+        with mock.patch("os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.editor.writexml()
+        self.assertEqual(self.read(self.fname), self.old)
+        self.assertEqual(self.read(self.fname + ".bak"), self.old)
+        self.assertEqual(self.leftovers(), [])
+        self.assertTrue(self.editor.tree_dirty)
+
+    def test_write_fails(self):
+        "a save that goes wrong while writing doesn't touch the file"
+        with mock.patch.object(base.XMLWriter, "write",
+                               side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.editor.writexml()
+        self.assertEqual(self.read(self.fname), self.old)
+        self.assertFalse(os.path.exists(self.fname + ".bak"))
+        self.assertEqual(self.leftovers(), [])
+
+    def test_backup_linked(self):
+        "the backup is the old file itself, not a copy of it"
+        inode = os.stat(self.fname).st_ino
+        self.editor.writexml()
+        self.assertEqual(os.stat(self.fname + ".bak").st_ino, inode)
+        self.assertNotEqual(os.stat(self.fname).st_ino, inode)
+        self.assertEqual(self.read(self.fname + ".bak"), self.old)
+        self.assertIn(b"<new>element</new>", self.read(self.fname))
+        self.assertEqual(self.leftovers(), [])
+
+    def test_backup_renamed(self):
+        "where links can't be made the old file is renamed"
+        with mock.patch("os.link", side_effect=OSError("not supported")):
+            self.editor.writexml()
+        self.assertEqual(self.read(self.fname + ".bak"), self.old)
+        self.assertIn(b"<new>element</new>", self.read(self.fname))
+
+    def test_synced(self):
+        "the new file and the directory entry are flushed to disk"
+        with mock.patch("os.fsync", wraps=os.fsync) as fsync:
+            self.editor.writexml()
+        self.assertEqual(fsync.call_count, 1 if os.name == "nt" else 2)
+
+    @unittest.skipIf(os.name == "nt", "needs symbolic links")
+    def test_symlink(self):
+        "saving through a symbolic link replaces the file it points to"
+        link = os.path.join(self.dirname, "link.xml")
+        os.symlink(self.fname, link)
+        self.editor.xmlfn = link
+        self.editor.writexml(oldfile=self.fname + ".bak")
+        self.assertTrue(os.path.islink(link))
+        self.assertIn(b"<new>element</new>", self.read(self.fname))
+        self.assertEqual(self.read(self.fname + ".bak"), self.old)
+
+
+class CompressedSaveTest(SaveTestCase):
+    "saving as gzip, bzip2 and xz, and reading that back"
+
+    def test_saved_compressed(self):
+        "the extension of the name saved under tells how to compress"
+        fname = self.write(DOCUMENT)
+        expected = self.canonical(fname)
+        for module, magic, ext in COMPRESSIONS:
+            with self.subTest(ext=ext):
+                saved = self.save_as(Editor(fname, gui_class=Gui),
+                                     "doc.xml" + ext)
+                self.assertTrue(self.read(saved).startswith(magic))
+                with module.open(saved) as f:
+                    self.assertEqual(structure(et.parse(f).getroot()),
+                                     expected)
+                editor = Editor(saved, gui_class=Gui)
+                self.assertFalse(editor.load_error)
+                again = self.save_as(editor, "again.xml")
+                self.assertEqual(self.canonical(again), expected)
+
+    def test_stays_compressed(self):
+        "a compressed file is saved compressed, whatever it's called"
+        for module, magic, ext in COMPRESSIONS:
+            with self.subTest(ext=ext):
+                fname = os.path.join(self.dirname, "packed" + ext[1:])
+                with module.open(fname, "wb") as f:
+                    f.write(DOCUMENT.encode("utf-8"))
+                editor = Editor(fname, gui_class=Gui)
+                editor.add_item(editor.gui.get_treetop(), "new", "element")
+                editor.writexml()
+                self.assertTrue(self.read(fname).startswith(magic))
+                with module.open(fname + ".bak") as f:
+                    self.assertEqual(f.read(), DOCUMENT.encode("utf-8"))
+                with module.open(fname) as f:
+                    root = et.parse(f).getroot()
+                self.assertEqual(root[-1].tag, "new")
+                self.assertEqual(root[-1].text, "element")
+                self.assertFalse(editor.layout.usable())
+
+
+if __name__ == "__main__":
+    unittest.main()
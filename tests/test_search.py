@@ -0,0 +1,164 @@
+"""tests for finding things in a document, without a screen
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from axe import base
+from axe.base import Editor
+from axe.gui_headless import Gui
+
+
+class FindAllTest(unittest.TestCase):
+    "SearchIndex.find_all"
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write('<r><a id="1" x="y"/><b id="2"><c id="3">t</c></b>'
+                    '<d k="v"/></r>')
+        self.addCleanup(os.remove, self.fname)
+        self.editor = Editor(self.fname, gui_class=Gui)
+
+    def titles(self, hits):
+        "the titles of the nodes found, whether attribute or not"
+        return [(self.editor.gui.get_node_title(node), is_attr)
+                for node, is_attr in hits]
+
+    def test_attribute_on_several_elements(self):
+        "every element with a matching attribute is found"
+        hits = self.editor.search_index.find_all(("", "id", "", ""))
+        self.assertEqual(self.titles(hits), [("id = 1", True),
+                                             ("id = 2", True),
+                                             ("id = 3", True)])
+
+    def test_attribute_value(self):
+        "only the attributes with a matching value are found"
+        hits = self.editor.search_index.find_all(("", "", "2", ""), "regex")
+        self.assertEqual(self.titles(hits), [("id = 2", True)])
+
+    def test_xpath_with_attribute(self):
+        "with an XPath, the selected elements that have the attribute"
+        hits = self.editor.search_index.find_all(("*", "id", "", ""),
+                                                 "xpath")
+        self.assertEqual(self.titles(hits), [("<> a", False),
+                                             ("<> b", False)])
+
+    def test_xpath_after_edit(self):
+        "a path finds what's been renamed, without building the tree again"
+        index = self.editor.search_index
+        node = index.find_all(("a", "", "", ""), "xpath")[0][0]
+        backing = index.backing_tree
+        attr = self.editor.gui.get_node_children(node)[0]
+        self.editor.gui.replace_items([(node, "z", "", False),
+                                       (attr, "id", "9", True)], "Replace")
+        self.assertEqual(index.find_all(("a", "", "", ""), "xpath"), [])
+        hits = index.find_all(("z[@id='9']", "", "", ""), "xpath")
+        self.assertEqual(self.titles(hits), [("<> z", False)])
+        self.assertIs(index.backing_tree, backing)
+
+
+class LazySearchTest(unittest.TestCase):
+    "searching in a document whose subtrees aren't all shown yet"
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write('<r><s n="1"><i k="a">x</i><i k="b">y</i></s>'
+                    '<s n="2"><i k="c"><j>deep</j></i></s></r>')
+        self.addCleanup(os.remove, self.fname)
+        with mock.patch.object(base, "LAZY_LOAD_SIZE", 0):
+            self.editor = Editor(self.fname, gui_class=Gui)
+        self.gui = self.editor.gui
+        self.sections = self.gui.get_node_children(self.gui.get_treetop())
+
+    def test_nothing_found_adds_nothing(self):
+        "searching doesn't add the subtrees to the visual tree"
+        self.assertEqual(len(self.editor.pending), 2)
+        hits = self.editor.search_index.find_all(("zz", "", "", ""))
+        self.assertEqual(hits, [])
+        self.assertEqual(len(self.editor.pending), 2)
+
+    def test_found_in_subtree(self):
+        "only the nodes leading to what's found are added"
+        found, is_attr = self.editor.search_index.find(("", "", "", "deep"))
+        self.assertFalse(is_attr)
+        self.assertEqual(self.gui.get_node_title(found), "<> j: deep")
+        self.assertIn(self.sections[1], self.editor.search_index.entries)
+        self.assertIn(self.sections[0], self.editor.pending)
+
+    def test_attributes_in_subtree(self):
+        "attributes that are found become nodes too"
+        hits = self.editor.search_index.find_all(("", "k", "", ""))
+        self.assertEqual([(self.gui.get_node_title(node), is_attr)
+                          for node, is_attr in hits],
+                         [("k = a", True), ("k = b", True), ("k = c", True)])
+        for node in self.sections:
+            self.assertNotIn(node, self.editor.pending)
+
+    def test_found_again_without_rebuilding(self):
+        "the nodes added for what's been found take the elements' place"
+        index = self.editor.search_index
+        first = index.find_all(("", "k", "", ""))
+        with mock.patch.object(index, "rebuild",
+                               side_effect=AssertionError("rebuilt")):
+            self.assertEqual(index.find_all(("", "k", "", "")), first)
+            hits = index.find_all(("j", "", "", ""))
+        self.assertEqual([self.gui.get_node_title(x[0]) for x in hits],
+                         ["<> j: deep"])
+
+
+class IndexUpdateTest(unittest.TestCase):
+    "SearchIndex after adding and removing elements"
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write('<r><a><x>1</x></a><b><x>2</x><x>3</x></b><c/></r>')
+        self.addCleanup(os.remove, self.fname)
+        self.editor = Editor(self.fname, gui_class=Gui)
+        self.gui = self.editor.gui
+        self.index = self.editor.search_index
+        self.index.find_all(("", "", "", ""))  # have it built
+        patcher = mock.patch.object(self.index, "rebuild",
+                                    side_effect=AssertionError("rebuilt"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def texts(self):
+        "the texts of the x elements, in the order they're found"
+        return [self.gui.get_node_data(node)[1]
+                for node, _ in self.index.find_all(("x", "", "", ""))]
+
+    def test_added(self):
+        "an element that's added is found in its place"
+        a, b, c = self.gui.get_treetop().children
+        self.editor.add_item(b.children[0], "x", "new", before=False,
+                             below=False)
+        self.editor.add_item(a, "x", "last in a")
+        self.editor.add_item(c, "x", "in c")
+        self.assertEqual(self.texts(),
+                         ["1", "last in a", "2", "new", "3", "in c"])
+
+    def test_pasted(self):
+        "so is a subtree that's pasted"
+        a, b, c = self.gui.get_treetop().children
+        self.editor.paste_subtree(a, self.editor.copy_subtree(b),
+                                  below=False)
+        self.assertEqual(self.texts(), ["1", "2", "3", "2", "3"])
+
+    def test_removed_and_put_back(self):
+        "a subtree that's taken out isn't found until it's put back"
+        top = self.gui.get_treetop()
+        b = top.children[1]
+        self.editor.node_removed(b, top)
+        top.children.remove(b)
+        self.assertEqual(self.texts(), ["1"])
+        top.insert(1, b)
+        self.editor.node_restored(b, top, 1)
+        self.assertEqual(self.texts(), ["1", "2", "3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
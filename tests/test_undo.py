@@ -0,0 +1,149 @@
+"""tests for undoing and redoing edits in the Qt editor, without a screen
+"""
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from axe.base import Editor
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+try:
+    import PyQt5.QtWidgets as qtw
+    from axe import gui_qt
+except ImportError:
+    gui_qt = None
+
+app = None
+
+
+def make_gui_class():
+    "a main window that doesn't ask or tell anything and shares the app"
+
+    class Gui(gui_qt.Gui):
+        "main window as used in these tests"
+
+        def __init__(self, parent=None, fn=""):
+            global app
+            if app is None:
+                app = qtw.QApplication([])
+            self.editor = parent
+            self.app = app
+            self.fn = fn
+            qtw.QMainWindow.__init__(self)
+
+        def go(self):
+            "no event loop"
+
+        def meldfout(self, text, abort=False):
+            "no message box"
+            raise AssertionError(text)
+
+        def meldinfo(self, text):
+            "no message box"
+
+        def ask_yesnocancel(self, prompt):
+            "don't save"
+            return 0
+
+    return Gui
+
+
+@unittest.skipIf(gui_qt is None, "PyQt5 is not available")
+class UndoTest(unittest.TestCase):
+    "UndoRedoStack and the commands on it"
+
+    def setUp(self):
+        fd, fname = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(fd, "w") as f:
+            f.write("<r>" + "".join('<s n="{0}"><i>{0}</i><i>x</i></s>'.format(
+                x) for x in range(10)) + "</r>")
+        self.addCleanup(os.remove, fname)
+        self.editor = Editor(fname, gui_class=make_gui_class())
+        self.gui = self.editor.gui
+        self.addCleanup(self.gui.deleteLater)
+        for _ in range(100):
+            self.gui.app.processEvents()
+            if self.gui.loader is None:
+                break
+            time.sleep(0.01)
+        self.stack = self.gui.undo_stack
+        self.top = self.gui.get_treetop()
+
+    def test_copies_count(self):
+        "a copy kept for the clipboard counts towards the budget"
+        item = self.top.children[0]
+        self.gui.copy(item)
+        self.assertGreater(self.stack.total, item.sizeof())
+        self.assertEqual(self.stack.total,
+                         sum(self.stack.command(x).size()
+                             for x in range(self.stack.count())))
+
+    def test_budget(self):
+        "the oldest commands are released when the budget is used up"
+        size = gui_qt.ITEM_SIZE + self.top.children[0].sizeof()
+        released = []
+        release = gui_qt.CopyElementCommand.release
+
+        def spy(command):
+            released.append(command.text())
+            release(command)
+
+        with mock.patch.object(gui_qt, "UNDO_BUDGET", 2 * size), \
+                mock.patch.object(gui_qt.CopyElementCommand, "release", spy):
+            for item in self.top.children[:2]:
+                self.gui.copy(item)
+            self.assertEqual(released, [])
+            self.gui.copy(self.top.children[2])
+        self.assertEqual(len(released), 1)
+        self.assertEqual(self.stack.floor, 1)
+        self.assertLessEqual(self.stack.total, 2 * size)
+
+    def test_redo_branch_dropped(self):
+        "commands that can't be redone anymore don't count"
+        self.gui.copy(self.top.children[0])
+        self.gui.copy(self.top.children[1])
+        self.stack.undo()
+        self.gui.copy(self.top.children[2])
+        self.assertEqual(self.stack.count(), 2)
+        self.assertEqual(self.stack.sizes, [self.stack.command(x).size()
+                                            for x in range(2)])
+        self.assertEqual(self.stack.total, sum(self.stack.sizes))
+
+    def test_undone_paste_forgotten(self):
+        "an undone paste that can't be redone anymore leaves no ids behind"
+        count = len(self.editor.nodes)
+        self.gui.copy(self.top.children[0])
+        self.gui.paste(self.top.children[1], before=False)
+        self.assertEqual(len(self.editor.nodes), count + 4)
+        self.stack.undo()
+        self.assertEqual(len(self.editor.nodes), count + 4)  # for redo
+        self.gui.copy(self.top.children[2])
+        self.assertEqual(len(self.editor.nodes), count)
+
+    def test_undone_cut_kept(self):
+        "a cut that can't be redone anymore leaves the item in the tree"
+        item = self.top.children[0]
+        count = len(self.editor.nodes)
+        self.gui.copy(item, cut=True)
+        self.stack.undo()
+        self.gui.copy(self.top.children[1])
+        self.assertIs(self.top.children[0], item)
+        self.assertEqual(len(self.editor.nodes), count)
+        self.assertIs(self.editor.get_node(self.gui.get_node_id(item)), item)
+
+    def test_cut_not_seen(self):
+        "nothing in a cut subtree is kept as shown"
+        model = self.gui.model
+        item = self.top.children[0]
+        self.gui.expand_item(item)
+        model.rowCount(model.index_for(item))
+        model.rowCount(model.index_for(item.children[1]))
+        self.assertIn(item.children[1], model.seen)
+        self.gui.copy(item, cut=True)
+        self.assertFalse(set(item.walk()) & model.seen)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+"""tests for finding things in the viewer, without a screen
+"""
+import unittest
+import xml.etree.ElementTree as et
+
+from axe.axe_base import find_next
+try:
+    from axe.xmlviewer_qt import flatten_tree
+except ImportError:
+    flatten_tree = None
+
+
+@unittest.skipIf(flatten_tree is None, "PyQt5 is not available")
+class FindNextTest(unittest.TestCase):
+    "find_next over the viewer's flattened tree"
+
+    def find_all(self, root, search_args, reverse=False):
+        "keep finding the next one until there's nothing more"
+        pos, found = None, []
+        while len(found) < 10:
+            pos = find_next(flatten_tree(root, reverse), search_args, reverse,
+                            pos)
+            if pos[0] is None:
+                break
+            found.append(pos)
+        return found
+
+    def test_attributes_on_one_element(self):
+        "every matching attribute of an element is found once"
+        root = et.fromstring('<r><a x="1" y="1" z="1"/><b x="1"/></r>')
+        a, b = root
+        self.assertEqual(self.find_all(root, ("", "", "1", "")),
+                         [((a, 0), True), ((a, 1), True), ((a, 2), True),
+                          ((b, 0), True)])
+        self.assertEqual(self.find_all(root, ("", "", "1", ""), True),
+                         [((b, 0), True), ((a, 2), True), ((a, 1), True),
+                          ((a, 0), True)])
+
+
+if __name__ == "__main__":
+    unittest.main()
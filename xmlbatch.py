@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+"""Startup script for editing XML files from the command line
+"""
+import sys
+from axe.batch import main
+
+if __name__ == "__main__":
+    sys.exit(main())